@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+awtrix_client.py
+
+Non-blocking client for an Ulanzi clock running the Awtrix firmware.
+
+Calls are queued and sent by a background worker over one keep-alive HTTP session, so showing
+or removing the "Recording" custom app never holds up the MIDI dispatcher or the Hue update.
+The client is a sinks.Sink: it has the same queue policies and stats as the other outputs.
+"""
+
+import logging
+
+from sinks import DROP_NEWEST, Sink
+
+log = logging.getLogger('awtrix_client')
+
+
+class AwtrixClient(Sink):
+    """Drive one custom app on an Awtrix clock from a background thread."""
+
+    def __init__(self, host, app_name='recording', text='REC', color='#FF0000', timeout=2.0, maxsize=16,
+                 policy=DROP_NEWEST):
+        super().__init__('awtrix', maxsize, policy)
+        self.host = host
+        self.app_name = app_name
+        self.text = text
+        self.color = color
+        self.timeout = timeout
+        self.url = f"http://{host}/api/custom"
+        self._session = None
+
+    def show_recording(self, trace=None):
+        """Queue the custom app that tells the studio we are recording."""
+        self.put(True, trace)
+
+    def clear_recording(self, trace=None):
+        """Queue removal of the custom app (an empty payload deletes it)."""
+        self.put(False, trace)
+
+    def setup(self):
+        # The session and requests itself are set up here, off the thread that starts the daemon
+        import requests
+        self._session = requests.Session()
+
+    def teardown(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def send(self, recording, trace=None):
+        import requests
+        payload = {'text': self.text, 'color': self.color} if recording else None
+        try:
+            response = self._session.post(self.url, params={'name': self.app_name}, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            log.error('Awtrix request to %s failed: %s', self.host, e)
+            return False
+        log.info('Awtrix app %s %s', self.app_name, 'updated' if payload else 'removed')
+        return True
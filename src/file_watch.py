@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+file_watch.py
+
+Wait for a few files to change without reading them over and over.
+
+On Linux the directories holding the files are watched with inotify (through ctypes, no extra
+package), on macOS with kqueue. Both watch the directory as well as the files, because the
+files are usually replaced by a rename rather than written in place. Where neither works (no
+such directory yet, another OS) the files' mtime and size are polled instead.
+
+wait() returns True after a change of one of the files, or False when the timeout passed or
+wake() was called from another thread; a spurious True is possible, so callers re-check what
+they care about. `lost` is set when the watched directory itself went away.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+log = logging.getLogger('file_watch')
+
+# inotify(7)
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+# Not IN_MODIFY: a file being written is only read once it is closed
+_IN_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+            IN_DELETE_SELF | IN_MOVE_SELF)
+_IN_EVENT = struct.Struct('iIII')
+
+# Open for event notifications only, so watching does not keep a volume busy
+_O_EVTONLY = getattr(os, 'O_EVTONLY', 0x8000 if sys.platform == 'darwin' else 0)
+
+
+class InotifyWatch:
+    """Linux inotify on the directories of `paths`."""
+
+    kind = 'inotify'
+
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.names = {os.path.basename(path) for path in paths}
+        self.lost = False
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self.fd = fd
+        self._wake_r, self._wake_w = os.pipe()
+        for directory in sorted({os.path.dirname(os.path.abspath(path)) for path in paths}):
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), _IN_MASK) < 0:
+                errno = ctypes.get_errno()
+                self.close()
+                raise OSError(errno, f"cannot watch {directory}: {os.strerror(errno)}")
+
+    def wait(self, timeout=None):
+        ready, _, _ = select.select([self.fd, self._wake_r], [], [], timeout)
+        if self.fd not in ready:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+                name = data[offset + _IN_EVENT.size:offset + _IN_EVENT.size + length].rstrip(b'\0')
+                offset += _IN_EVENT.size + length
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The directory itself went away, the watch is gone with it
+                    self.lost = True
+                    changed = True
+                elif mask & IN_Q_OVERFLOW or os.fsdecode(name) in self.names:
+                    changed = True
+
+    def wake(self):
+        os.write(self._wake_w, b'x')
+
+    def close(self):
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+
+class KqueueWatch:
+    """BSD/macOS kqueue vnode events on `paths` and their directories."""
+
+    kind = 'kqueue'
+    _NOTES = (getattr(select, 'KQ_NOTE_WRITE', 0) | getattr(select, 'KQ_NOTE_DELETE', 0) |
+              getattr(select, 'KQ_NOTE_RENAME', 0) | getattr(select, 'KQ_NOTE_EXTEND', 0) |
+              getattr(select, 'KQ_NOTE_ATTRIB', 0))
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.lost = False
+        self.kq = select.kqueue()
+        self._fds = []
+        self._wake_r, self._wake_w = os.pipe()
+        self.kq.control([select.kevent(self._wake_r, select.KQ_FILTER_READ, select.KQ_EV_ADD)], 0)
+        try:
+            self._register()
+        except OSError:
+            self.close()
+            raise
+
+    def _register(self):
+        # A replaced file is a new vnode: (re)open everything after each change
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+        events = []
+        for path in sorted({os.path.dirname(path) for path in self.paths}) + self.paths:
+            try:
+                fd = os.open(path, os.O_RDONLY | _O_EVTONLY)
+            except OSError:
+                if path in self.paths:
+                    # Not there yet, its directory reports when it appears
+                    continue
+                raise
+            self._fds.append(fd)
+            events.append(select.kevent(fd, select.KQ_FILTER_VNODE, select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                                        self._NOTES))
+        self.kq.control(events, 0)
+
+    def wait(self, timeout=None):
+        events = self.kq.control(None, 16, timeout)
+        if not events or any(event.ident == self._wake_r for event in events):
+            return False
+        try:
+            self._register()
+        except OSError:
+            self.lost = True
+        return True
+
+    def wake(self):
+        os.write(self._wake_w, b'x')
+
+    def close(self):
+        for fd in self._fds + [self._wake_r, self._wake_w]:
+            os.close(fd)
+        self._fds = []
+        self.kq.close()
+
+
+class PollWatch:
+    """Compare the mtime and size of `paths` every `interval` seconds."""
+
+    kind = 'poll'
+
+    def __init__(self, paths, interval=5.0):
+        self.paths = list(paths)
+        self.interval = interval
+        self.lost = False
+        self.checks = 0
+        self._signature = self._stat()
+        self._woken = threading.Event()
+
+    def _stat(self):
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            step = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if step <= 0 or self._woken.wait(step):
+                self._woken.clear()
+                return False
+            self.checks += 1
+            signature = self._stat()
+            if signature != self._signature:
+                self._signature = signature
+                return True
+
+    def wake(self):
+        self._woken.set()
+
+    def close(self):
+        pass
+
+
+def open_watch(paths, interval=5.0, notify=True):
+    """Return the best watch this system has for `paths`, polling every `interval` seconds if need be.
+
+    `notify=False` always polls.
+    """
+    if not notify:
+        return PollWatch(paths, interval)
+    try:
+        if sys.platform.startswith('linux'):
+            return InotifyWatch(paths)
+        if hasattr(select, 'kqueue'):
+            return KqueueWatch(paths)
+    except (OSError, AttributeError) as e:
+        log.info('No file change notifications for %s (%s), polling every %.1f s', paths[0], e, interval)
+    return PollWatch(paths, interval)
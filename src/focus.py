@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+"""
+focus.py
+
+Cached macOS Focus Mode detection, shared by logic_pro_to_hue.py and tools/check_focus.py.
+
+The Do Not Disturb database files are only re-read when their mtime or size changes. Scheduled
+focus modes are compiled into a sorted list of minute-of-day boundaries, so finding the mode
+for a given time is a bisect instead of a walk over every mode. The answer is cached until the
+next schedule boundary or file re-check, which makes FocusCache.get() cheap enough to call for
+every MIDI event.
+
+FocusWatcher does without even that: it sleeps until the database files change (inotify or
+kqueue, see file_watch.py) or the next schedule boundary passes, and pushes the new focus mode
+to a callback.
+"""
+
+import bisect
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from file_watch import open_watch
+
+log = logging.getLogger('focus')
+
+ASSERT_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/Assertions.json")
+MODECONFIG_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/ModeConfigurations.json")
+
+NO_FOCUS = "No focus"
+MINUTES_PER_DAY = 24 * 60
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def scheduled_intervals(configJ):
+    """Return (start, end, name) minute intervals of every enabled schedule, in mode order.
+
+    Schedules that run past midnight are split in two.
+    """
+    intervals = []
+    for modeid in configJ:
+        triggers = configJ[modeid].get('triggers', {}).get('triggers') or [None]
+        trigger = triggers[0]
+        if trigger and trigger.get('enabledSetting') == 2:
+            start = trigger['timePeriodStartTimeHour'] * 60 + trigger['timePeriodStartTimeMinute']
+            end = trigger['timePeriodEndTimeHour'] * 60 + trigger['timePeriodEndTimeMinute']
+            name = configJ[modeid]['mode']['name']
+            if start < end:
+                intervals.append((start, end, name))
+            elif start > end:  # includes midnight
+                intervals.append((start, MINUTES_PER_DAY, name))
+                intervals.append((0, end, name))
+    return intervals
+
+
+class ScheduleIndex:
+    """Minute-of-day lookup table compiled from scheduled focus intervals.
+
+    When schedules overlap the mode listed last wins, as it did in the original linear scan.
+    """
+
+    def __init__(self, intervals):
+        bounds = {0, MINUTES_PER_DAY}
+        for start, end, _ in intervals:
+            bounds.add(start)
+            bounds.add(end)
+        self.bounds = sorted(bounds)
+        self.names = []
+        for lower in self.bounds[:-1]:
+            name = NO_FOCUS
+            for start, end, mode_name in intervals:
+                if start <= lower < end:
+                    name = mode_name
+            self.names.append(name)
+
+    def lookup(self, minute):
+        """Return (focus name, minute at which the answer may change)."""
+        i = bisect.bisect_right(self.bounds, minute) - 1
+        return self.names[i], self.bounds[i + 1]
+
+
+class FocusCache:
+    """Current Focus Mode, re-read only when the database files change."""
+
+    def __init__(self, assert_path=ASSERT_PATH, modeconfig_path=MODECONFIG_PATH, recheck=1.0):
+        self.assert_path = assert_path
+        self.modeconfig_path = modeconfig_path
+        self.recheck = recheck
+        self.loads = 0
+        self.available = False  # whether the database could be read
+        self._signature = None
+        self._asserted = None
+        self._index = ScheduleIndex([])
+        self._focus = NO_FOCUS
+        self._valid_until = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, now=None):
+        """Return the name of the active focus mode, or "No focus".
+
+        `now` (a datetime) is only for testing schedules; without it the cached answer is used
+        until the next file re-check or schedule boundary.
+        """
+        if now is None and time.monotonic() < self._valid_until:
+            return self._focus
+        with self._lock:
+            self._reload_if_changed()
+            if self._asserted:
+                focus, wait = self._asserted, self.recheck
+            else:
+                date = now or datetime.datetime.now()
+                minute = date.hour * 60 + date.minute
+                focus, boundary = self._index.lookup(minute)
+                wait = min(self.recheck, (boundary - minute) * 60 - date.second)
+            if now is None:
+                self._focus = focus
+                self._valid_until = time.monotonic() + wait
+            return focus
+
+    def invalidate(self):
+        """Forget the cached answer, the next get() checks the files again."""
+        self._valid_until = 0.0
+
+    def seconds_to_next_boundary(self, now=None):
+        """Seconds until a schedule may switch focus on or off, None if nothing is scheduled."""
+        with self._lock:
+            self._reload_if_changed()
+            if len(self._index.bounds) <= 2 and self._index.names[0] == NO_FOCUS:
+                return None
+            date = now or datetime.datetime.now()
+            minute = date.hour * 60 + date.minute
+            _, boundary = self._index.lookup(minute)
+            return (boundary - minute) * 60 - date.second - date.microsecond / 1e6
+
+    def _stat(self):
+        signature = []
+        for path in (self.assert_path, self.modeconfig_path):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _reload_if_changed(self):
+        signature = self._stat()
+        if signature == self._signature:
+            return
+        self._signature = signature
+        self.loads += 1
+        try:
+            assertJ = load_json(self.assert_path)['data'][0].get('storeAssertionRecords') or []
+            configJ = load_json(self.modeconfig_path)['data'][0]['modeConfigurations']
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            log.warning('Cannot read Focus Mode database: %s', e)
+            self.available = False
+            self._asserted = None
+            self._index = ScheduleIndex([])
+            return
+        self.available = True
+        self._asserted = None
+        if assertJ:
+            try:
+                modeid = assertJ[0]['assertionDetails']['assertionDetailsModeIdentifier']
+                self._asserted = configJ[modeid]['mode']['name']
+            except (KeyError, IndexError, TypeError) as e:
+                # E.g. a mode that was deleted while it was on: treat it as no asserted mode
+                log.warning('Focus Mode assertion without a known mode, ignoring it: %r', e)
+        try:
+            self._index = ScheduleIndex(scheduled_intervals(configJ))
+        except (KeyError, TypeError, AttributeError) as e:
+            log.warning('Cannot read the Focus Mode schedules, ignoring them: %r', e)
+            self._index = ScheduleIndex([])
+
+
+class FocusWatcher:
+    """Call `on_change(focus)` with the focus mode at start and whenever it changes.
+
+    Runs on a thread of its own that wakes up only for a change of the database files or a
+    schedule boundary; `poll` is the mtime polling interval where file notifications are not
+    available (or not wanted, `notify=False`).
+    """
+
+    def __init__(self, cache, on_change, poll=5.0, notify=True):
+        self.cache = cache
+        self.on_change = on_change
+        self.poll = poll
+        self.notify = notify
+        self.focus = None
+        self.changes = 0
+        self.wakeups = 0
+        self.watch = None
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.watch = self._open()
+        self._closed.clear()
+        self._update()
+        self._thread = threading.Thread(target=self._run, name='focus-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        if self._thread is not None:
+            self.watch.wake()
+            self._thread.join(2.0)
+            self._thread = None
+        self.watch.close()
+
+    def _update(self):
+        self.cache.invalidate()
+        try:
+            focus = self.cache.get()
+        except Exception:
+            log.exception('Cannot read the Focus mode, keeping %s', self.focus)
+            return
+        if focus == self.focus:
+            return
+        self.focus = focus
+        self.changes += 1
+        try:
+            self.on_change(focus)
+        except Exception:
+            log.exception('Focus change callback failed')
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                boundary = self.cache.seconds_to_next_boundary()
+            except Exception:
+                log.exception('Cannot read the Focus schedule, waiting for a file change')
+                boundary = None
+            # Wake just after the boundary, so the lookup lands in the new interval
+            self.watch.wait(None if boundary is None else max(boundary, 0.0) + 0.05)
+            if self._closed.is_set():
+                return
+            self.wakeups += 1
+            if self.watch.lost:
+                self.watch.close()
+                self.watch = self._open()
+            self._update()
+
+    def _open(self):
+        return open_watch([self.cache.assert_path, self.cache.modeconfig_path], self.poll, self.notify)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+hue_client.py
+
+Long-lived client for the Hue bridge REST API, shared by logic_pro_to_hue.py and the tools.
+
+A single requests.Session keeps the HTTP connection to the bridge alive between MIDI events,
+so switching the recording light costs one request instead of a new handshake every time.
+When the bridge drops the connection the session is rebuilt and the request is retried once.
+requests is imported on first use, it takes longer to import than the rest of the daemon.
+"""
+
+import logging
+import threading
+
+log = logging.getLogger('hue_client')
+
+
+class HueRateLimited(Exception):
+    """The bridge answered 429 / 503: too many commands, try again later."""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class HueClient:
+    """Keep-alive connection pool to one Hue bridge for one API user."""
+
+    def __init__(self, bridge_ip, username, timeout=2.0, pool_size=8):
+        self.bridge_ip = bridge_ip
+        self.username = username
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.base_url = f"http://{bridge_ip}/api/{username}"
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def reset(self):
+        """Drop the pooled connections, the next request opens fresh ones."""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def request(self, method, path, payload=None):
+        """Send a request to the bridge and return the decoded JSON body.
+
+        Connection failures reset the pool and the request is tried one more time.
+        """
+        import requests
+        url = f"{self.base_url}{path}"
+        for attempt in (1, 2):
+            session = self._get_session()
+            try:
+                response = session.request(method, url, json=payload, timeout=self.timeout)
+                if response.status_code in (429, 503):
+                    raise HueRateLimited(f"{response.status_code} from {self.bridge_ip}", response=response)
+                return response.json()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                log.warning('Hue bridge %s request failed (attempt %d): %s', self.bridge_ip, attempt, e)
+                self.reset()
+                if attempt == 2:
+                    raise
+
+    def set_light_state(self, light_id, state):
+        """PUT a state dict to a single light, returns the bridge response list."""
+        result = self.request('PUT', f"/lights/{light_id}/state", state)
+        _log_errors(result)
+        return result
+
+    def set_group_action(self, group_id, state):
+        """PUT a state dict to every light of a room, zone or other group in one request."""
+        result = self.request('PUT', f"/groups/{group_id}/action", state)
+        _log_errors(result)
+        return result
+
+    def get_lights(self):
+        """Return the bridge's full /lights inventory."""
+        return self.request('GET', '/lights')
+
+    def get_groups(self):
+        """Return the bridge's /groups inventory (rooms, zones and other groups)."""
+        return self.request('GET', '/groups')
+
+    def health_check(self):
+        """Return True when the bridge answers and accepts our username."""
+        import requests
+        try:
+            result = self.request('GET', '/config')
+        except (requests.RequestException, HueRateLimited) as e:
+            log.error('Hue bridge %s health check failed: %s', self.bridge_ip, e)
+            return False
+        if not isinstance(result, dict) or 'whitelist' not in result:
+            _log_errors(result)
+            return False
+        return True
+
+    def close(self):
+        self.reset()
+
+
+def _log_errors(result):
+    # The v1 API answers with a list of {"success": ...} / {"error": ...} entries
+    if isinstance(result, list):
+        for item in result:
+            if 'error' in item:
+                log.error('Hue bridge error: %s', item['error'].get('description'))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(bridge_ip, username, timeout=2.0):
+    """Return the process-wide client for this bridge, creating it on first use with `timeout`."""
+    key = (bridge_ip, username)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = HueClient(bridge_ip, username, timeout)
+        return client
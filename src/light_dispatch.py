@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""
+light_dispatch.py
+
+Fan a recording-state change out to every configured light, room and zone.
+
+Rooms and zones are switched with one /groups/<id>/action request each. Loose lights that
+exactly match an existing bridge group are switched through that group too; the rest are sent
+as parallel per-light requests. Everything goes through the bridge's CommandScheduler, so the
+fan-out respects the bridge rate limits. A failing group action falls back to its member lights.
+
+Lights and rooms on more bridges are addressed as "bridge/light" and "bridge/room". BridgeFanout
+queues the state on every bridge first and only then waits for the answers, so the bridges work
+in parallel, each paced by its own scheduler and rate limits.
+"""
+
+import logging
+import threading
+import time
+
+from scheduler import PRIORITY_RECORDING, RESULT_TIMEOUT
+from supervisor import Backoff
+
+log = logging.getLogger('light_dispatch')
+
+
+def parse_list(value):
+    """Split a comma separated config value into stripped, non-empty items."""
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def parse_bridges(items):
+    """Parse the [Bridges] entries, name = IP, username[, event stream URL]; raises ValueError on a bad one."""
+    bridges = {}
+    for name, value in items:
+        entry = parse_list(value)
+        if name == 'default' or '/' in name:
+            raise ValueError(f"[Bridges] {name}: the name cannot be 'default' or contain '/'")
+        if len(entry) not in (2, 3):
+            raise ValueError(f"[Bridges] {name} must be 'IP, username[, event stream URL]', got {value!r}")
+        bridges[name] = entry
+    return bridges
+
+
+def split_targets(targets, bridges, default='default'):
+    """Group "bridge/target" addressed lights or rooms by bridge name; plain ones go to `default`."""
+    by_bridge = {}
+    for target in targets:
+        name, sep, rest = str(target).partition('/')
+        if sep and name in bridges:
+            by_bridge.setdefault(name, []).append(rest)
+        else:
+            if sep:
+                log.warning('No bridge called %s, using %s on the %s bridge', name, target, default)
+            by_bridge.setdefault(default, []).append(str(target))
+    return by_bridge
+
+
+class LightDispatcher:
+    """Apply one state to a set of lights and groups with as few bridge requests as possible."""
+
+    def __init__(self, scheduler, light_ids=(), rooms=(), priority=PRIORITY_RECORDING, backoff=None):
+        self.scheduler = scheduler
+        self.light_ids = [str(light_id) for light_id in light_ids]
+        self.rooms = list(rooms)
+        self.priority = priority
+        self.group_ids = []     # groups to address with one action each
+        self.group_lights = {}  # group id -> member light ids, for the per-light fallback
+        self.loose_lights = list(self.light_ids)
+        self.backoff = backoff or Backoff(1.0, 60.0)
+        self._resolved = False
+        self._retry_at = 0.0
+        self._resolving = threading.Lock()
+
+    def resolve(self):
+        """Map configured rooms/zones to group ids and collapse loose lights into a group.
+
+        Needs the bridge; until it answers the lights are sent one by one and the rooms, whose
+        lights only the bridge knows, are skipped. send() tries again in the background with backoff.
+        """
+        try:
+            groups = self.scheduler.client.get_groups()
+        except Exception as e:
+            if self.rooms:
+                log.warning('Cannot read Hue groups, skipping rooms %s until they resolve: %s', self.rooms, e)
+            else:
+                log.warning('Cannot read Hue groups, sending per light for now: %s', e)
+            return False
+        if not isinstance(groups, dict):
+            return False
+
+        by_name = {details.get('name'): group_id for group_id, details in groups.items()}
+        group_ids, group_lights = [], {}
+        covered = set()
+        for room in self.rooms:
+            group_id = room if room in groups else by_name.get(room)
+            if group_id is None:
+                log.error('Hue room or zone not found: %s', room)
+                continue
+            group_ids.append(group_id)
+            group_lights[group_id] = list(groups[group_id].get('lights', []))
+            covered.update(group_lights[group_id])
+
+        loose = [light_id for light_id in self.light_ids if light_id not in covered]
+        if len(loose) > 1:
+            # An existing group with exactly these lights saves one request per light
+            for group_id, details in groups.items():
+                if set(details.get('lights', [])) == set(loose):
+                    group_ids.append(group_id)
+                    group_lights[group_id] = loose
+                    loose = []
+                    break
+
+        self.group_ids, self.group_lights, self.loose_lights = group_ids, group_lights, loose
+        self._resolved = True
+        log.info('Hue fan-out: groups %s, single lights %s', group_ids, loose)
+        return True
+
+    def apply(self, state, trace=None):
+        """Send `state` to all targets in parallel and wait until the bridge has answered.
+
+        With a trace, the first request leaving the scheduler is marked as hue_sent and the last
+        answer as hue_ack.
+        """
+        ok, sent_ns = self.wait(self.send(state))
+        if trace is not None:
+            if sent_ns:
+                trace.mark('hue_sent', sent_ns)
+            trace.mark('hue_ack')
+        return ok
+
+    def send(self, state):
+        """Queue `state` for all targets without waiting; pass the result to wait()."""
+        if not self._resolved and (self.rooms or len(self.light_ids) > 1):
+            self._resolve_later()
+        groups = [(group_id, self.scheduler.set_group_action(group_id, state, self.priority)) for group_id in self.group_ids]
+        lights = [(light_id, self.scheduler.set_light_state(light_id, state, self.priority)) for light_id in self.loose_lights]
+        return state, groups, lights
+
+    def _resolve_later(self):
+        # The bridge may be slow or gone: retry off the recording path, with backoff
+        if time.monotonic() < self._retry_at or not self._resolving.acquire(blocking=False):
+            return
+        threading.Thread(target=self._resolve_in_background, name='hue-resolve', daemon=True).start()
+
+    def _resolve_in_background(self):
+        try:
+            if self.resolve():
+                self.backoff.reset()
+            else:
+                self._retry_at = time.monotonic() + self.backoff.next()
+        finally:
+            self._resolving.release()
+
+    def wait(self, sent):
+        """Wait for the answers to send(); returns (all succeeded, time the first request went out)."""
+        state, groups, lights = sent
+        # Groups whose action failed are retried light by light, still in parallel
+        for group_id, future in groups:
+            if not _succeeded(group_id, future):
+                log.warning('Group action on %s failed, falling back to its lights', group_id)
+                lights += [(light_id, self.scheduler.set_light_state(light_id, state, self.priority))
+                           for light_id in self.group_lights.get(group_id, [])]
+
+        failed = [light_id for light_id, future in lights if not _succeeded(light_id, future)]
+        sent = [ns for ns in (getattr(future, 'sent_ns', None) for _, future in groups + lights) if ns]
+        if failed:
+            log.error('Hue fan-out failed for lights %s', failed)
+        return not failed, min(sent, default=None)
+
+
+class BridgeFanout:
+    """The LightDispatcher interface over several bridges: `dispatchers` maps bridge name to its own."""
+
+    def __init__(self, dispatchers):
+        self.dispatchers = dict(dispatchers)
+
+    def resolve(self):
+        return all([dispatcher.resolve() for dispatcher in self.dispatchers.values()])
+
+    def apply(self, state, trace=None):
+        """Send `state` to every bridge at once and wait until all of them have answered."""
+        sent = [(name, dispatcher, dispatcher.send(state)) for name, dispatcher in self.dispatchers.items()]
+        ok, first = True, []
+        for name, dispatcher, pending in sent:
+            done, sent_ns = dispatcher.wait(pending)
+            if not done:
+                log.error('Hue fan-out incomplete on bridge %s', name)
+                ok = False
+            if sent_ns:
+                first.append(sent_ns)
+        if trace is not None:
+            if first:
+                trace.mark('hue_sent', min(first))
+            trace.mark('hue_ack')
+        return ok
+
+
+def _succeeded(target, future):
+    try:
+        result = future.result(RESULT_TIMEOUT)
+    except Exception as e:
+        log.error('Error setting %s: %s', target, e)
+        return False
+    return not _has_error(result)
+
+
+def _has_error(result):
+    return isinstance(result, list) and any('error' in item for item in result)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+"""
+light_mirror.py
+
+Local mirror of the bridge's light states, kept current by the Hue API v2 event stream.
+
+The mirror is filled once from /lights and /groups and then follows the server-sent events the
+bridge pushes on /eventstream/clip/v2, so questions like "which lights are on" are answered
+from memory. Successful writes from the CommandScheduler are recorded as well, and the
+scheduler asks the mirror whether a light already has the state it is about to send.
+
+The mirror only answers while the stream is connected. After a disconnect it reconnects with
+backoff and jitter and re-reads the inventory before it is trusted again; `on_live` is then
+called, so the owner can put back anything the bridge lost while it was away.
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+
+from scheduler import LIGHT
+from supervisor import Backoff
+
+log = logging.getLogger('light_mirror')
+
+# v1 state keys that can be compared against the mirror; anything else is always sent
+COMPARABLE = ('on', 'bri', 'hue', 'sat', 'xy', 'ct')
+
+
+def event_stream_url(bridge_ip):
+    return f"https://{bridge_ip}/eventstream/clip/v2"
+
+
+def iter_sse(chunks):
+    """Yield (event id, data) for every event in a stream of raw byte chunks."""
+    buffer = b''
+    event_id, data = None, []
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line = line.rstrip(b'\r').decode('utf-8', 'replace')
+            if not line:
+                if data:
+                    yield event_id, '\n'.join(data)
+                event_id, data = None, []
+            elif line.startswith(':'):
+                continue  # comment / keep-alive
+            else:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'data':
+                    data.append(value)
+                elif field == 'id':
+                    event_id = value
+
+
+def v1_state(resource):
+    """Translate the v2 attributes of a light event into v1 state keys."""
+    state = {}
+    if 'on' in resource:
+        state['on'] = resource['on']['on']
+    if 'dimming' in resource:
+        state['bri'] = max(1, min(254, round(resource['dimming']['brightness'] * 2.54)))
+    xy = resource.get('color', {}).get('xy')
+    if xy:
+        state['xy'] = [xy['x'], xy['y']]
+    mirek = resource.get('color_temperature', {}).get('mirek')
+    if mirek is not None:
+        state['ct'] = mirek
+    return state
+
+
+def _same(key, current, wanted):
+    if key == 'bri':
+        # v2 reports brightness in percent, allow the rounding error
+        return abs(current - wanted) <= 1
+    if key == 'xy':
+        return abs(current[0] - wanted[0]) < 0.001 and abs(current[1] - wanted[1]) < 0.001
+    return current == wanted
+
+
+class LightMirror:
+    """Light states of one bridge, in memory."""
+
+    def __init__(self, client, stream_url=None, backoff=(1.0, 30.0), idle_timeout=300.0, echo_window=2.0,
+                 on_live=None):
+        self.client = client
+        self.stream_url = stream_url or event_stream_url(client.bridge_ip)
+        self.backoff = backoff
+        self.on_live = on_live
+        self.idle_timeout = idle_timeout
+        self.echo_window = echo_window
+        self._colour_writes = {}  # light id -> monotonic time we last sent hue/sat
+        self.lights = {}  # light id -> v1 state dict
+        self.names = {}   # light id -> name
+        self.groups = {}  # group id -> member light ids
+        self.live = False
+        self.events = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._response = None
+        self._thread = None
+
+    def fill(self):
+        """Read the full inventory over REST, once per (re)connect."""
+        lights = self.client.get_lights()
+        groups = self.client.get_groups()
+        if not isinstance(lights, dict) or not isinstance(groups, dict):
+            raise ValueError(f"unexpected inventory from the bridge: {lights!r:.80}")
+        with self._lock:
+            self.lights = {light_id: dict(details.get('state', {})) for light_id, details in lights.items()}
+            self.names = {light_id: details.get('name', light_id) for light_id, details in lights.items()}
+            self.groups = {group_id: [str(m) for m in details.get('lights', [])] for group_id, details in groups.items()}
+
+    def start(self):
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, name='hue-events', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self.live = False
+        response = self._response
+        sock = getattr(getattr(response and response.raw, 'connection', None), 'sock', None)
+        if sock is not None:
+            # Closing the response would wait for the blocked reader, a shutdown wakes it up
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def wait_live(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not self.live and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.live
+
+    # Reads served from memory
+
+    def state(self, light_id):
+        with self._lock:
+            state = self.lights.get(str(light_id))
+            return dict(state) if state is not None else None
+
+    def lights_on(self, on=True):
+        """Return [(light id, name)] of the lights that are on (or off with on=False)."""
+        with self._lock:
+            return [(light_id, self.names.get(light_id, light_id)) for light_id, state in self.lights.items()
+                    if state.get('on') == on]
+
+    def members(self, kind, target):
+        """Light ids a light or group command touches, None when the group is unknown."""
+        if kind == LIGHT:
+            return [str(target)]
+        if str(target) == '0':
+            return list(self.lights)
+        return self.groups.get(str(target))
+
+    def matches(self, light_ids, state):
+        """True when every light is known to have `state` already, so a write can be skipped."""
+        if not self.live or not light_ids:
+            return False
+        with self._lock:
+            for light_id in light_ids:
+                current = self.lights.get(light_id)
+                if current is None:
+                    return False
+                if state.get('on') is False and current.get('on') is False:
+                    continue  # an off light looks the same whatever its colour
+                for key, wanted in state.items():
+                    if key not in COMPARABLE or key not in current or not _same(key, current[key], wanted):
+                        return False
+        return True
+
+    # Updates
+
+    def before_write(self, light_ids, state):
+        """Note a write about to be sent, so its colour event is not taken for someone else's."""
+        if 'hue' in state or 'sat' in state:
+            now = time.monotonic()
+            with self._lock:
+                for light_id in light_ids:
+                    self._colour_writes[light_id] = now
+
+    def record_write(self, light_ids, state):
+        """Apply a write the bridge accepted."""
+        with self._lock:
+            for light_id in light_ids:
+                current = self.lights.get(light_id)
+                if current is None:
+                    continue
+                if 'hue' in state or 'sat' in state:
+                    # The bridge recomputes these, the next event tells their new values
+                    current.pop('xy', None)
+                    current.pop('ct', None)
+                current.update({key: value for key, value in state.items() if key in COMPARABLE})
+
+    def apply_event(self, payload):
+        """Apply one decoded event stream message (a list of events)."""
+        with self._lock:
+            for event in payload:
+                if event.get('type') not in ('update', 'add'):
+                    continue
+                for resource in event.get('data', []):
+                    id_v1 = resource.get('id_v1', '')
+                    if resource.get('type') != 'light' or not id_v1.startswith('/lights/'):
+                        continue
+                    self.events += 1
+                    light_id = id_v1.rsplit('/', 1)[1]
+                    current = self.lights.setdefault(light_id, {})
+                    changes = v1_state(resource)
+                    # v2 only reports xy/mirek. A colour change that is not the echo of our own
+                    # hue/sat write means the hue/sat we knew are stale.
+                    echo = time.monotonic() - self._colour_writes.get(light_id, float('-inf')) < self.echo_window
+                    if not echo and 'xy' in changes and not ('xy' in current and _same('xy', current['xy'], changes['xy'])):
+                        for key in ('hue', 'sat', 'ct'):
+                            current.pop(key, None)
+                    if not echo and 'ct' in changes and current.get('ct') != changes['ct']:
+                        for key in ('hue', 'sat', 'xy'):
+                            current.pop(key, None)
+                    current.update(changes)
+
+    def _run(self):
+        import requests
+        import urllib3
+        # The bridge serves the stream over HTTPS with its own certificate
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        backoff = Backoff(*self.backoff)
+        session = requests.Session()
+        headers = {'hue-application-key': self.client.username, 'Accept': 'text/event-stream'}
+        while not self._closed.is_set():
+            try:
+                with session.get(self.stream_url, headers=headers, stream=True, verify=False,
+                                 timeout=(self.client.timeout, self.idle_timeout)) as response:
+                    response.raise_for_status()
+                    self._response = response
+                    # Events that arrive while we read the inventory wait in the socket
+                    self.fill()
+                    self.live = True
+                    self.connects += 1
+                    backoff.reset()
+                    log.info('Hue event stream connected, mirroring %d lights', len(self.lights))
+                    if self.on_live is not None:
+                        try:
+                            self.on_live()
+                        except Exception:
+                            log.exception('Hue event stream on_live callback failed')
+                    for _, data in iter_sse(iter(lambda: response.raw.read1(65536), b'')):
+                        try:
+                            self.apply_event(json.loads(data))
+                        except (ValueError, AttributeError, KeyError, TypeError) as e:
+                            log.warning('Ignoring malformed Hue event: %s', e)
+                    raise requests.ConnectionError('event stream closed by the bridge')
+            except Exception as e:
+                self.live = False
+                self._response = None
+                if self._closed.is_set():
+                    break
+                delay = backoff.next()
+                log.warning('Hue event stream lost (%s), reconnecting in %.1f s', e, delay)
+                self._closed.wait(delay)
+        session.close()
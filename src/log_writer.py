@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+log_writer.py
+
+Logging that stays off the MIDI path: a log call only puts the record on a bounded queue, and
+a background thread formats it and writes it to a rotating file.
+
+Records are formatted on the writer thread, so log calls should use %-style arguments rather
+than f-strings and pass values that are not changed afterwards. Lines are written as JSON with
+the time, level, logger, a sequence id unique within the run, an optional event name
+(`extra={'event': ...}`) and any other extra fields. Noisy DEBUG records can be sampled per call
+site. When the queue is full, records are dropped and counted, never waited for. Before start()
+and after stop() records are written straight away on the caller's thread.
+"""
+
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; everything else was passed in `extra`
+_STANDARD = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'event', 'event_id', 'sampled', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def __init__(self, run_id=None):
+        super().__init__()
+        self.run_id = run_id or f"{int(time.time()):x}"
+
+    def format(self, record):
+        entry = {
+            'time': f"{time.strftime('%Y-%m-%dT%H:%M:%S', self.converter(record.created))}.{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'id': f"{self.run_id}-{getattr(record, 'event_id', 0)}",
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            entry['event'] = event
+        entry['msg'] = record.getMessage()
+        for key, value in vars(record).items():
+            if key not in _STANDARD:
+                entry[key] = value
+        sampled = getattr(record, 'sampled', 0)
+        if sampled:
+            entry['sampled'] = sampled
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Pass the first and then every `every`-th DEBUG record of each call site.
+
+    A call site is the logger and the unformatted message. Passed records carry `sampled`, the
+    number of records each one stands for. The counts are not locked: under contention a
+    sample may come a record early or late, which is fine for debug output.
+    """
+
+    def __init__(self, every=100, level=logging.DEBUG):
+        super().__init__()
+        self.every = every
+        self.level = level
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        key = (record.name, record.msg)
+        seen = self.counts.get(key, 0)
+        self.counts[key] = seen + 1
+        if seen % self.every:
+            return False
+        if seen:
+            record.sampled = self.every
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as they are, up to `maxsize` waiting; the writer thread formats them."""
+
+    def __init__(self, log_queue, maxsize=10000):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.direct = None  # handler that takes the records instead while no writer thread runs
+        self._ids = itertools.count(1)
+
+    def handle(self, record):
+        # Putting on the queue is thread-safe, the handler lock would only add contention
+        if self.filter(record):
+            direct = self.direct
+            if direct is not None:
+                record.event_id = next(self._ids)
+                direct.handle(record)
+            else:
+                self.emit(record)
+
+    def prepare(self, record):
+        # The stdlib handler formats the message here, on the caller's thread; leave it to the writer
+        record.event_id = next(self._ids)
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue has no size limit and a cheaper put than queue.Queue; bound it here
+        if self.queue.qsize() < self.maxsize:
+            self.queue.put(record)
+        else:
+            self.dropped += 1
+
+
+class LogWriter:
+    """Root logger set-up: queue handler, background writer and rotating log file.
+
+    Rotates by size (`max_bytes`) or, when `when` is set ('midnight', 'H', 'W0'...), by time,
+    keeping `backups` old files. `json_lines=False` writes the classic text format.
+    """
+
+    def __init__(self, path, level=logging.INFO, json_lines=True, max_bytes=10 * 1024 * 1024, when='',
+                 backups=5, sample=100, maxsize=10000):
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        self.handler = QueueHandler(self.queue, maxsize)
+        if sample > 1:
+            self.handler.addFilter(SampleFilter(sample))
+        if when:
+            self.file_handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backups,
+                                                                          delay=True)
+        elif max_bytes:
+            self.file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                                     delay=True)
+        else:
+            self.file_handler = logging.FileHandler(path, delay=True)
+        self.file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler)
+        self.handler.direct = self.file_handler
+        self._running = False
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def install(self, logger=None):
+        """Send the records of `logger` (the root logger by default) through the queue."""
+        logger = logger or logging.getLogger()
+        logger.setLevel(self.level)
+        logger.addHandler(self.handler)
+        return self
+
+    def start(self):
+        if not self._running:
+            self.listener.start()
+            self.handler.direct = None
+            self._running = True
+        return self
+
+    def stop(self):
+        """Write out everything queued so far and stop the writer thread."""
+        if self._running:
+            self._running = False
+            self.handler.direct = self.file_handler
+            self.listener.stop()
+            # The writer is gone once it read the stop marker; a record queued just after it is left
+            while not self.queue.empty():
+                self.file_handler.handle(self.queue.get_nowait())
+        self.file_handler.flush()
@@ -15,17 +15,31 @@ Version: v1.1.0
 
 from __future__ import print_function
 
-import json
-import os
-import datetime
+import collections
+import functools
 import logging
 import sys
+import threading
 import time
-from rtmidi.midiutil import open_midiinput
-import requests
-import subprocess
 import configparser
-from phue import Bridge
+from awtrix_client import AwtrixClient
+from focus import FocusCache, FocusWatcher
+from hue_client import get_client
+from light_dispatch import BridgeFanout, LightDispatcher, parse_bridges, parse_list, split_targets
+from light_mirror import LightMirror
+from log_writer import LogWriter
+from metrics import MetricsServer, Registry, process_stats
+from midi_decoder import MidiDecoder, format_record
+from midi_input import MidiDispatcher
+from recording_state import RecordingStateMachine
+from rules import RECORDING, SCENE, SET_STATE, WEBHOOK, RuleEngine
+from scheduler import PRIORITY_NORMAL, PRIORITY_RECORDING, RESULT_TIMEOUT, get_scheduler
+from status_api import StatusServer
+from sinks import LATEST, CallbackSink, MqttSink, OscSink, WebhookSink, parse_address
+from streaming import EffectEngine, FramePacker, Streamer
+from supervisor import Backoff, PortWatcher, SupervisedSink
+from tracing import Tracer
+from webhook import WebhookClient
 
 # Load config from external file
 config = configparser.ConfigParser()
@@ -33,179 +47,612 @@ config.read('config.ini')
 
 # Read the light configuration from the config file
 BRIDGE_IP = config.get('Hue', 'BRIDGE_IP')
-LIGHT_ID = config.getint('Hue', 'LIGHT_ID')
+# LIGHT_IDS and ROOMS (room or zone names) take a comma separated list, LIGHT_ID a single light;
+# lights and rooms on a bridge from [Bridges] are written as name/4 or name/Studio B
+LIGHT_IDS = [x if '/' in x else int(x)
+             for x in parse_list(config.get('Hue', 'LIGHT_IDS', fallback=config.get('Hue', 'LIGHT_ID', fallback='')))]
+LIGHT_ID = LIGHT_IDS[0] if LIGHT_IDS else None
+ROOMS = parse_list(config.get('Hue', 'ROOMS', fallback=''))
 USERNAME = config.get('Hue', 'USERNAME')
-FOCUS_MODE = config.get('Hue','FOCUS_MODE')
-AWTRIX_HOST = config.get('Awtrix', 'AWTRIX_HOST')
-
-ASSERT_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/Assertions.json")
-MODECONFIG_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/ModeConfigurations.json")
-
-# Specify the MIDI input port name
+# Seconds a request may take before the bridge counts as unreachable (tried twice)
+HUE_TIMEOUT = config.getfloat('Hue', 'TIMEOUT', fallback=2.0)
+# More bridges, all switched on each recording change: name = IP, username[, event stream URL]
+BRIDGES = parse_bridges(config.items('Bridges')) if config.has_section('Bridges') else {}
+# MIDI is only handled while this Focus Mode is on (empty: always); the quotes are optional
+FOCUS_MODE = config.get('Hue', 'FOCUS_MODE', fallback='').strip('\'"')
+# Seconds between checks of the Focus Mode files where the OS can't report changes
+FOCUS_POLL = config.getfloat('Hue', 'FOCUS_POLL', fallback=5.0)
+# Mirror light states from the bridge's v2 event stream and skip writes that change nothing
+EVENT_STREAM = config.getboolean('Hue', 'EVENT_STREAM', fallback=True)
+EVENT_STREAM_URL = config.get('Hue', 'EVENT_STREAM_URL', fallback='')
+# Bursts of record arm/disarm within this many milliseconds collapse into one light change
+COALESCE_MS = config.getint('Hue', 'COALESCE_MS', fallback=50)
+AWTRIX_HOST = config.get('Awtrix', 'AWTRIX_HOST', fallback='')
+# More outputs for the recording state, each with its own queue and worker: MQTT broker
+# (host[:port]) and topic, OSC receiver (host:port) and address, webhook URL. POLICY says what a
+# full queue of QUEUE changes gives up: latest (keep only the newest), drop_oldest or drop_newest
+MQTT_BROKER = config.get('Sinks', 'MQTT', fallback='')
+MQTT_TOPIC = config.get('Sinks', 'MQTT_TOPIC', fallback='studio/recording')
+OSC_TARGET = config.get('Sinks', 'OSC', fallback='')
+OSC_ADDRESS = config.get('Sinks', 'OSC_ADDRESS', fallback='/recording')
+WEBHOOK_URL = config.get('Sinks', 'WEBHOOK', fallback='')
+SINK_QUEUE = config.getint('Sinks', 'QUEUE', fallback=16)
+SINK_POLICY = config.get('Sinks', 'POLICY', fallback=LATEST)
+# Local Prometheus endpoint (0 = off) and optional JSON-lines dump of every event's trace
+METRICS_PORT = config.getint('Metrics', 'PORT', fallback=0)
+TRACE_FILE = config.get('Metrics', 'TRACE_FILE', fallback='')
+# Push the recording and Focus state to subscribers on http://HOST:PORT/events (SSE) and /ws
+# (WebSocket), 0 = off
+STATUS_PORT = config.getint('Status', 'PORT', fallback=0)
+STATUS_HOST = config.get('Status', 'HOST', fallback='127.0.0.1')
+# Longest a recording change waits for the Hue write before it is pushed anyway, in seconds
+STATUS_HOLD = config.getfloat('Status', 'HOLD', fallback=0.25)
+# Entertainment-style UDP stream of note/velocity/clock driven frames, off unless enabled
+STREAMING = config.getboolean('Streaming', 'ENABLED', fallback=False)
+STREAM_HOST = config.get('Streaming', 'HOST', fallback='')
+STREAM_PORT = config.getint('Streaming', 'PORT', fallback=2100)
+STREAM_RATE = config.getfloat('Streaming', 'RATE', fallback=50.0)
+ENTERTAINMENT_ID = config.get('Streaming', 'ENTERTAINMENT_ID', fallback='')
+STREAM_CHANNELS = [int(x) for x in parse_list(config.get('Streaming', 'CHANNELS', fallback='0'))]
+# MIDI to light rules, reloaded when the file changes; without it note 24 drives the recording light
+RULES_FILE = config.get('Rules', 'RULES_FILE', fallback='rules.json')
+
+# Focus Mode state, the DB files are parsed lazily and only when they change; the watcher
+# pushes changes to the dispatcher, created in start()
+focus_cache = FocusCache()
+focus_watcher = None
+
+# Rules mapping MIDI events to actions, watched for changes from start()
+rule_engine = RuleEngine(RULES_FILE, bridges=BRIDGES)
+
+# JSON-lines log written by a background thread, rotated by size or, with ROTATE_WHEN, by time
+LOG_FILE = config.get('Logging', 'FILE', fallback='logic_pro_to_hue.log')
+LOG_LEVEL = config.get('Logging', 'LEVEL', fallback='INFO').upper()
+LOG_JSON = config.get('Logging', 'FORMAT', fallback='json').lower() == 'json'
+LOG_MAX_MB = config.getfloat('Logging', 'MAX_MB', fallback=10.0)
+LOG_ROTATE_WHEN = config.get('Logging', 'ROTATE_WHEN', fallback='')
+LOG_BACKUPS = config.getint('Logging', 'BACKUPS', fallback=5)
+# Only one in this many DEBUG records per call site is written
+LOG_DEBUG_SAMPLE = config.getint('Logging', 'DEBUG_SAMPLE', fallback=100)
+
+# Specify the MIDI input port name(s), all handled by one dispatcher
 port_name = "Logic Pro Virtual Out"
-
-# Set up logging
-logging.basicConfig(filename='logic_pro_to_hue.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+PORT_NAMES = parse_list(config.get('MIDI', 'PORTS', fallback=port_name))
+# Print every incoming MIDI event (debugging only, costs time on every event)
+PRINT_EVENTS = config.getboolean('MIDI', 'PRINT_EVENTS', fallback=False)
+
+# Supervised (daemon) mode: ride out bridge outages and MIDI ports that come and go.
+# Retries start after BACKOFF_MIN seconds and back off up to BACKOFF_MAX; at most BUFFER
+# recording changes are kept while the bridge is down; ports are checked every PORT_CHECK seconds
+SUPERVISED = config.getboolean('Supervisor', 'ENABLED', fallback=False)
+BACKOFF_MIN = config.getfloat('Supervisor', 'BACKOFF_MIN', fallback=0.5)
+BACKOFF_MAX = config.getfloat('Supervisor', 'BACKOFF_MAX', fallback=30.0)
+SUPERVISOR_BUFFER = config.getint('Supervisor', 'BUFFER', fallback=64)
+PORT_CHECK = config.getfloat('Supervisor', 'PORT_CHECK', fallback=1.0)
+
+# Awtrix clock client, started in main() when AWTRIX_HOST is set
+awtrix = None
+
+# Outputs for the recording state (Hue first, then the clock and the others), created in start()
+sinks = []
+
+# Recording/Focus status API for tablets and dashboards, started in start() when STATUS_PORT is set
+status_server = None
+
+# Recording state machine, created in main()
+recording = None
+
+# Fan-out to all recording lights and rooms, created in main()
+lights = None
+
+# Light state mirror fed by the bridge's event stream, created in start(), with the mirrors
+# and schedulers of every bridge in use
+mirror = None
+mirrors = []
+hue_schedulers = {}
+
+# MIDI dispatcher and the names of the ports feeding it, metrics endpoint and webhook sender,
+# created in start()
+dispatcher = None
+port_names = []
+metrics_server = None
+webhooks = None
+
+# Streaming effects engine and sender, created in start() when streaming is enabled
+effects = None
+streamer = None
+
+# Supervised recording lights and MIDI port watcher, created in start() in supervised mode
+hue_sink = None
+port_watcher = None
+
+# Per-event stage tracing, exported as metrics
+registry = Registry()
+tracer = Tracer(registry, TRACE_FILE or None)
+registry.gauge('lp2hue_midi_messages', 'MIDI messages received per input port',
+               lambda: {port_names[source]: count for source, count in dispatcher.by_source.items()} if dispatcher else {},
+               'port')
+registry.gauge('lp2hue_midi_queue_depth', 'MIDI messages waiting for the dispatcher',
+               lambda: dispatcher.queue.qsize() if dispatcher else 0)
+registry.gauge('lp2hue_midi_queue_dropped', 'MIDI messages dropped because the queue was full',
+               lambda: dispatcher.dropped if dispatcher else 0)
+registry.gauge('lp2hue_midi_gated', 'MIDI messages not handled because the Focus Mode was off',
+               lambda: dispatcher.gated if dispatcher else 0)
+registry.gauge('lp2hue_recording_changes', 'Recording state changes by what happened to them',
+               lambda: recording.counters() if recording else {}, 'result')
+registry.gauge('lp2hue_hue_mirror_live', 'Whether the light state mirror follows the bridge event stream',
+               lambda: int(mirror.live) if mirror else 0)
+registry.gauge('lp2hue_sink_backlog', 'Recording changes queued or being sent per output',
+               lambda: {sink.name: sink.backlog() for sink in sinks}, 'sink')
+registry.gauge('lp2hue_sink_sent', 'Recording changes sent per output',
+               lambda: {sink.name: sink.sent for sink in sinks}, 'sink')
+registry.gauge('lp2hue_sink_dropped', 'Recording changes an output dropped or replaced by a newer one',
+               lambda: {sink.name: sink.dropped for sink in sinks}, 'sink')
+# A daemon that runs for weeks should stay flat here, tools/soak.py checks that it does
+registry.gauge('lp2hue_process_resident_bytes', 'Resident memory of the daemon',
+               lambda: process_stats()['rss_bytes'])
+registry.gauge('lp2hue_process_open_fds', 'Open file descriptors, sockets included',
+               lambda: process_stats()['fds'])
+registry.gauge('lp2hue_process_sockets', 'Open sockets', lambda: process_stats()['sockets'])
+registry.gauge('lp2hue_process_threads', 'Python threads', lambda: process_stats()['threads'])
+registry.gauge('lp2hue_status_subscribers', 'Connected status API subscribers',
+               lambda: status_server.subscribers() if status_server else {}, 'kind')
+registry.gauge('lp2hue_sink_up', 'Whether a supervised sink currently takes changes',
+               lambda: {hue_sink.name: int(hue_sink.up)} if hue_sink else {}, 'sink')
+registry.gauge('lp2hue_sink_buffered', 'Recording changes buffered while a supervised sink was down',
+               lambda: {hue_sink.name: hue_sink.buffered} if hue_sink else {}, 'sink')
+registry.gauge('lp2hue_sink_outages', 'Outages of a supervised sink',
+               lambda: {hue_sink.name: hue_sink.outages} if hue_sink else {}, 'sink')
+registry.gauge('lp2hue_midi_ports_reopened', 'MIDI input ports reopened after they disappeared',
+               lambda: port_watcher.reopened if port_watcher else 0)
+registry.gauge('lp2hue_hue_queue_depth', 'Hue commands waiting per bridge and priority lane',
+               lambda: {(name, lane): depth for name, scheduler in list(hue_schedulers.items())
+                        for lane, depth in scheduler.depth().items()}, ('bridge', 'lane'))
+
+# Set up logging: log calls only queue the record, the writer thread is started with the pipeline
+log_writer = LogWriter(LOG_FILE, getattr(logging, LOG_LEVEL, logging.INFO), LOG_JSON, int(LOG_MAX_MB * 1024 * 1024),
+                       LOG_ROTATE_WHEN, LOG_BACKUPS, LOG_DEBUG_SAMPLE).install()
+log = logging.getLogger('logic_pro_to_hue')
+registry.gauge('lp2hue_log_dropped', 'Log records dropped because the log queue was full',
+               lambda: log_writer.dropped)
 
 
 def connect_to_hue_bridge():
-    # Connect to the Hue Bridge
-    try:
-        bridge = Bridge(BRIDGE_IP, USERNAME)
-        # If running for the first time, press the button on your Hue bridge
-        bridge.connect()
-        return bridge
-    except Exception as e:
-        logging.error(f'Error connecting to the Hue Bridge: {str(e)}')
-        print(f"Error connecting to the Hue Bridge: {e}")
+    # Return the shared, keep-alive client for the Hue Bridge after checking it answers,
+    # which also leaves an open connection in its pool
+    bridge = get_client(BRIDGE_IP, USERNAME, HUE_TIMEOUT)
+    if not bridge.health_check():
+        log.error('Error connecting to the Hue Bridge at %s', BRIDGE_IP, extra={'event': 'hue.unreachable'})
+        print(f"Error connecting to the Hue Bridge at {BRIDGE_IP}")
         return None
-
-
-def parse_midi_message(message):
-    """Parse the MIDI message and return channel, note, and velocity."""
-    # Extract the message type, channel, note, and velocity
-    status_byte = message[0]
-    channel = (status_byte & 0x0F) + 1  # Last 4 bits for channel (1-indexed)
-    msg_type = status_byte & 0xF0  # First 4 bits for message type
-
-    # Determine if it's a Note On or Note Off based on velocity
-    note = message[1]
-    velocity = message[2]
-    
-    if msg_type == 0x90:  # Note On
-        if velocity > 0:
-            return "Note On ", channel, note, velocity
-        else:
-            # Treat velocity 0 as a Note Off for Note On messages
-            return "Note Off", channel, note, 0
-    elif msg_type == 0x80 or (msg_type == 0x90 and velocity == 0):  # Note Off
-        return "Note Off", channel, note, velocity
-    else:
-        return None, None, None, None  # Other message types
-
-def format_timestamp(timer):
-    """Format the timer into a friendly timestamp."""
-    return time.strftime("%H:%M:%S", time.localtime(timer)) + f".{int((timer % 1) * 1000):03d}"
+    return bridge
 
 
 #Function to check if macOS Focus Mode is set to "Music Production"
 def get_focus():
-    focus = "No focus" #default
-    assertJ = json.load(open(ASSERT_PATH))['data'][0]['storeAssertionRecords']
-    configJ = json.load(open(MODECONFIG_PATH))['data'][0]['modeConfigurations']
-    if assertJ:
-        modeid = assertJ[0]['assertionDetails']['assertionDetailsModeIdentifier']
-        focus = configJ[modeid]['mode']['name']
-    else:
-        date = datetime.datetime.today()
-        now = date.hour * 60 + date.minute
-
-        for modeid in configJ:
-            triggers = configJ[modeid]['triggers']['triggers'][0]
-            if triggers and triggers['enabledSetting'] == 2:
-                start = triggers['timePeriodStartTimeHour'] * 60 + triggers['timePeriodStartTimeMinute']
-                end = triggers['timePeriodEndTimeHour'] * 60 + triggers['timePeriodEndTimeMinute']
-                if start < end:
-                    if now >= start and now < end:
-                        focus = configJ[modeid]['mode']['name']
-                elif start > end: # includes midnight
-                    if now >= start or now < end:
-                        focus = configJ[modeid]['mode']['name']
-    return focus
+    # Cached: the DB files are only parsed again after they change
+    return focus_cache.get()
 
 
 def set_light_state(light_id, state):
-    # Connect to the bridge
-    bridge = connect_to_hue_bridge()
-    if bridge is None:
-        logging.debug(f'Bridge connect response: {bridge}')
+    # Queue on the shared scheduler: paced for the bridge, ahead of bulk updates
+    scheduler = get_scheduler(BRIDGE_IP, USERNAME, HUE_TIMEOUT)
+    try:
+        result = scheduler.set_light_state(light_id, state, PRIORITY_RECORDING).result(RESULT_TIMEOUT)
+    except Exception as e:
+        log.error('Error setting light %s: %s', light_id, e, extra={'event': 'light.failed', 'light': light_id})
         return
-    
-    bridge.set_light(light_id, state)
-    logging.debug(f'Bridge connect response: {bridge}')
-    logging.info(f"Set light with ID: {light_id} to state: {state}")
+
+    log.debug('Bridge response: %s', result, extra={'event': 'hue.response'})
+    log.info('Set light with ID: %s to state: %s', light_id, state,
+             extra={'event': 'light.set', 'light': light_id, 'state': state})
 
 def switch_on_light_by_id(light_id):
-    onAIR = {
-        'on': True,
-        'bri': 254, # Full luminosity
-        'sat': 254, # Full saturation
-        'hue': 65535 # Red
-    }
-    set_light_state(light_id, onAIR)
+    set_light_state(light_id, rule_engine.rules.states['onAIR'])
 
 def switch_off_light_by_id(light_id):
-    offAIR = {
-        'on': False,
-        'bri': 254, # Full luminosity
-        'sat': 254, # Full saturation
-        'hue': 65535 # Red
-    }
-    set_light_state(light_id, offAIR)
+    set_light_state(light_id, rule_engine.rules.states['offAIR'])
+
+def set_recording_lights(state, trace=None):
+    # One request per room/zone, parallel requests for the remaining lights
+    if lights.apply(state, trace):
+        log.info('Set lights %s and rooms %s to state: %s', LIGHT_IDS, ROOMS, state,
+                 extra={'event': 'lights.set', 'trace': trace.event_id if trace else None, 'state': state})
+        return True
+    return False
+
+def apply_recording_lights(is_recording, trace=None):
+    # SupervisedSink callback; looks the state up when applied, so a recovery uses the current rules
+    return set_recording_lights(rule_engine.rules.states['onAIR' if is_recording else 'offAIR'], trace)
+
+def reconcile_recording_lights():
+    # The bridge may have lost the recording state while the event stream was away, e.g. on a reboot
+    if hue_sink is not None:
+        hue_sink.reconcile()
+
+def log_action_result(future):
+    # Rule actions are fire-and-forget, only failures are worth a line in the log
+    if not future.cancelled() and future.exception() is not None:
+        log.error('Rule action failed: %s', future.exception(), extra={'event': 'action.failed'})
+
+
+def run_action(action, trace=None):
+    """Execute one compiled rule action."""
+    kind = action[0]
+    if kind == RECORDING:
+        # Coalesced and applied to the recording lights and clock by the state machine
+        recording.feed(action[1], trace)
+    elif kind == SET_STATE:
+        _, targets, state = action
+        for name, light_ids, group_ids in targets:
+            scheduler = bridge_scheduler(name)
+            for light_id in light_ids:
+                scheduler.set_light_state(light_id, state, PRIORITY_NORMAL).add_done_callback(log_action_result)
+            for group_id in group_ids:
+                scheduler.set_group_action(group_id, state, PRIORITY_NORMAL).add_done_callback(log_action_result)
+    elif kind == SCENE:
+        _, name, group_id, scene = action
+        bridge_scheduler(name).set_group_action(
+            group_id, {'scene': scene}, PRIORITY_NORMAL).add_done_callback(log_action_result)
+    elif kind == WEBHOOK:
+        _, method, url, body = action
+        webhooks.call(method, url, body)
+
+
+def handle_midi_record(record, trace):
+    """Run the actions of every rule matching one decoded MIDI record."""
+    actions = rule_engine.match(record)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('MIDI record %s matched %d action(s)', record, len(actions), extra={'event': 'midi.match'})
+    if not actions:
+        trace.release('ignored')
+        return
+    trace.mark('decision')
+    # The first recording action carries the trace, the state machine releases it
+    traced = False
+    for action in actions:
+        if action[0] == RECORDING and not traced:
+            run_action(action, trace)
+            traced = True
+        else:
+            run_action(action)
+    if not traced:
+        trace.release('applied')
 
-def main():
 
-    connect_to_hue_bridge()
-    #print(check_focus_mode(FOCUS_MODE))
-    print(get_focus())
+def print_midi_records(records, batch, ports, timers):
+    """Debug sink: print every record with its port and a friendly timestamp.
+
+    `timers` holds the running wall-clock time per port and is updated in place.
+    """
+    times = []
+    for message, deltatime, received, source in batch:
+        timers[source] += deltatime
+        times.append(timers[source])
+    for record in records:
+        print(format_record(record, times[record[4]], ports[batch[record[4]][3]]))
+
+
+def discard_recording_state(trace, reason):
+    if trace is not None:
+        trace.release(reason)
+
 
-# Main function to receive MIDI input.#
+def send_recording_lights(is_recording, trace=None):
+    """Hue output: switch the recording lights, through the supervisor in supervised mode.
 
-# Continuous loop
+    The trace's outcome is what happened to this write.
+    """
+    outcome = 'failed'
     try:
-        midiin, actual_port_name = open_midiinput(port_name)
-        logging.info(f"Successfully opened MIDI input port: {actual_port_name}")
-    except (EOFError, KeyboardInterrupt):
-        logging.error("Exiting due to user interruption.")
-        sys.exit()
-    except Exception as e:
-        logging.error(f"Error opening MIDI input port '{port_name}': {e}")
-        sys.exit()
+        if hue_sink is not None:
+            # While the bridge is down the change is only buffered
+            ok = hue_sink.set(is_recording, trace)
+            outcome = 'applied' if ok else 'buffered'
+        else:
+            ok = apply_recording_lights(is_recording, trace)
+            outcome = 'applied' if ok else 'failed'
+        return ok
+    finally:
+        if trace is not None:
+            trace.settle(outcome)
+
 
-    print("Entering main loop. Press Control-C to exit.")
+def apply_recording_state(is_recording, trace=None):
+    """Switch the sinks to the (coalesced) recording state."""
+    if is_recording:
+        log.info('Recording started. Setting light to red.',
+                 extra={'event': 'recording.start', 'trace': trace.event_id if trace else None})
+    else:
+        log.info('Recording stopped. Switching the light off.',
+                 extra={'event': 'recording.stop', 'trace': trace.event_id if trace else None})
+    # Every output has its own queue and worker, none waits for another
+    for sink in sinks:
+        sink.put(is_recording, trace)
+    if trace is not None:
+        # The Hue sink settles the outcome once its worker got to the change
+        trace.release()
+
+
+def publish_status(is_recording, trace=None, hue=None):
+    """Status API output: push the change to the subscribers once `hue`, the Hue output, sent it."""
+    # Fanning out to hundreds of subscribers takes CPU the light should not wait for
+    if hue is not None:
+        hue.wait_idle(STATUS_HOLD)
+    return status_server.publish(recording=is_recording)
+
+
+def make_sinks():
+    """Return the recording-state outputs, not started yet."""
+    hue = CallbackSink('hue', send_recording_lights, drop_outcome='coalesced')
+    outputs = [hue]
+    if AWTRIX_HOST:
+        outputs.append(AwtrixClient(AWTRIX_HOST, maxsize=SINK_QUEUE, policy=SINK_POLICY))
+    if MQTT_BROKER:
+        host, port = parse_address(MQTT_BROKER, 1883)
+        outputs.append(MqttSink(host, port, MQTT_TOPIC, maxsize=SINK_QUEUE, policy=SINK_POLICY))
+    if OSC_TARGET:
+        host, port = parse_address(OSC_TARGET, 9000)
+        outputs.append(OscSink(host, port, OSC_ADDRESS, maxsize=SINK_QUEUE, policy=SINK_POLICY))
+    if WEBHOOK_URL:
+        outputs.append(WebhookSink(WEBHOOK_URL, maxsize=SINK_QUEUE, policy=SINK_POLICY))
+    if status_server:
+        outputs.append(CallbackSink('status', functools.partial(publish_status, hue=hue)))
+    return outputs
+
+
+def make_batch_handler(ports):
+    """Return a MidiDispatcher handler that decodes each batch and acts on the records."""
+    # Running status is per port, so is the decoder; `ports` may still grow until the first batch
+    decoders = collections.defaultdict(MidiDecoder)
+    timers = collections.defaultdict(time.time)
+
+    def handle_batch(batch):
+        records = []
+        start, end = 0, len(batch)
+        while start < end:
+            # Decode each run of messages from the same port in one go
+            source = batch[start][3]
+            stop = start + 1
+            while stop < end and batch[stop][3] == source:
+                stop += 1
+            decoders[source].decode_batch([item[0] for item in batch[start:stop]], records, start)
+            start = stop
+        decoded = time.monotonic_ns()
+        if PRINT_EVENTS:
+            print_midi_records(records, batch, ports, timers)
+        if effects is not None:
+            effects.feed_batch(records, batch)
+        for record in records:
+            trace = tracer.start(batch[record[4]][2])
+            trace.mark('parse', decoded)
+            handle_midi_record(record, trace)
+
+    return handle_batch
+
+
+def bridge_scheduler(name):
+    """Return the scheduler of a bridge by name; one without recording lights gets it on first use."""
+    scheduler = hue_schedulers.get(name)
+    if scheduler is None:
+        ip, username, _ = bridge_address(name)
+        scheduler = hue_schedulers[name] = get_scheduler(ip, username, HUE_TIMEOUT)
+    return scheduler
+
+
+def bridge_address(name):
+    """Return (IP, username, event stream URL) of the [Hue] bridge ('default') or one from [Bridges]."""
+    if name == 'default':
+        return BRIDGE_IP, USERNAME, EVENT_STREAM_URL
+    ip, username, *stream_url = BRIDGES[name]
+    return ip, username, stream_url[0] if stream_url else ''
+
+
+def start_mirror(client, stream_url):
+    if SUPERVISED:
+        return LightMirror(client, stream_url or None, (BACKOFF_MIN, BACKOFF_MAX),
+                           on_live=reconcile_recording_lights).start()
+    return LightMirror(client, stream_url or None).start()
+
+
+def make_light_dispatcher():
+    """Return the fan-out to the recording lights and rooms of every bridge.
+
+    Each bridge gets its own scheduler (and mirror), so each is paced by its own rate limits.
+    """
+    global mirror
+    light_ids = split_targets(LIGHT_IDS, BRIDGES)
+    rooms = split_targets(ROOMS, BRIDGES)
+    names = ['default'] + [name for name in BRIDGES if name in light_ids or name in rooms]
+    mirrors.clear()
+    hue_schedulers.clear()
+    dispatchers = {}
+    for name in names:
+        ip, username, stream_url = bridge_address(name)
+        scheduler = hue_schedulers[name] = get_scheduler(ip, username, HUE_TIMEOUT)
+        if EVENT_STREAM:
+            scheduler.mirror = start_mirror(scheduler.client, stream_url)
+            mirrors.append(scheduler.mirror)
+        dispatchers[name] = LightDispatcher(scheduler, light_ids.get(name, []), rooms.get(name, []))
+    mirror = mirrors[0] if mirrors else None
+    if len(dispatchers) == 1:
+        return dispatchers['default']
+    return BridgeFanout(dispatchers)
+
+
+def warm_up():
+    """Open the bridge connection and map rooms to groups, off the MIDI path."""
+    connect_to_hue_bridge()
+    lights.resolve()
+
+
+def on_focus_change(focus):
+    """Switch MIDI handling on or off for the new Focus Mode."""
+    # Without a readable Focus database (other OS, no Full Disk Access) MIDI is never gated
+    enabled = not FOCUS_MODE or not focus_cache.available or focus == FOCUS_MODE
+    dispatcher.enabled = enabled
+    if status_server:
+        status_server.publish(focus=focus, midi_enabled=enabled)
+    log.info('Focus mode: %s, MIDI handling %s', focus, 'on' if enabled else 'off',
+             extra={'event': 'focus.state', 'focus': focus, 'enabled': enabled})
+
+
+def attach_inputs(inputs):
+    """Return a dispatcher queueing the events of the MIDI inputs; start() starts handling them."""
+    global dispatcher
+    port_names[:] = [name for _, name in inputs]
+    dispatcher = MidiDispatcher(make_batch_handler(port_names))
+    for source, (midiin, name) in enumerate(inputs):
+        if midiin is not None:
+            dispatcher.attach(midiin, source)
+    return dispatcher
+
+
+def start(inputs, midi_dispatcher=None, open_port=None):
+    """Wire the sinks to opened MIDI inputs, a list of (midiin, port name), and handle their events.
+
+    Events are queued from the moment the inputs are attached, so nothing is lost while the
+    sinks start; pass a dispatcher they are already attached to, e.g. from attach_inputs().
+    The bridge connection and the focus state are warmed up in the background.
+
+    In supervised mode a port may be listed with None for midiin; with `open_port(name)` the
+    port watcher opens it later, and reopens ports that disappear.
+    """
+    global awtrix, recording, lights, dispatcher, metrics_server, webhooks, effects, streamer
+    global hue_sink, port_watcher, focus_watcher, sinks, status_server
+
+    dispatcher = midi_dispatcher or attach_inputs(inputs)
+    log_writer.start()
+    if METRICS_PORT:
+        metrics_server = MetricsServer(registry, METRICS_PORT).start()
+        log.info('Metrics on http://127.0.0.1:%d/metrics', metrics_server.port, extra={'event': 'metrics.listen'})
+    tracer.open_dump()
+    status_server = None
+    if STATUS_PORT:
+        status_server = StatusServer(STATUS_PORT, STATUS_HOST,
+                                     state={'recording': None, 'focus': None, 'midi_enabled': True}).start()
+        log.info('Recording status on http://%s:%d/events and /ws', STATUS_HOST, status_server.port,
+                 extra={'event': 'status.listen'})
+    hue_sink = port_watcher = None
+    if SUPERVISED:
+        hue_sink = SupervisedSink('Hue', apply_recording_lights, Backoff(BACKOFF_MIN, BACKOFF_MAX),
+                                  SUPERVISOR_BUFFER)
+    lights = make_light_dispatcher()
+    sinks = [sink.start() for sink in make_sinks()]
+    awtrix = next((sink for sink in sinks if isinstance(sink, AwtrixClient)), None)
+    if STREAMING:
+        effects = EffectEngine(len(STREAM_CHANNELS))
+        packer = FramePacker(ENTERTAINMENT_ID, STREAM_CHANNELS)
+        streamer = Streamer(STREAM_HOST or BRIDGE_IP, STREAM_PORT, effects, packer, STREAM_RATE).start()
+    webhooks = WebhookClient()
+    webhooks.start()
+    rule_engine.start()
+    recording = RecordingStateMachine(apply_recording_state, COALESCE_MS / 1000.0, discard_recording_state)
+
+    # Reads the Focus files once, then only when they change or a schedule boundary passes
+    focus_watcher = FocusWatcher(focus_cache, on_focus_change, FOCUS_POLL).start()
+
+    # rtmidi pushes every message into the one dispatcher queue, tagged with its port
+    dispatcher.start()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    if SUPERVISED and open_port is not None:
+        port_watcher = PortWatcher(inputs, open_port, dispatcher.attach, PORT_CHECK,
+                                   lambda: Backoff(PORT_CHECK, BACKOFF_MAX)).start()
+    return dispatcher
+
+
+def stop(inputs, dispatcher):
+    """Stop handling events from the MIDI inputs and shut the sinks down."""
+    if port_watcher:
+        port_watcher.stop()
+    for midiin, _ in inputs:
+        if midiin is not None:
+            midiin.cancel_callback()
+    dispatcher.stop()
+    focus_watcher.stop()
+    rule_engine.stop()
+    recording.cancel()
+    log.info('Recording events: %s', recording.counters(), extra={'event': 'stats.recording'})
+    for sink in sinks:
+        sink.stop()
+        log.info('Sink %s: %s', sink.name, sink.stats(), extra={'event': 'stats.sink', 'sink': sink.name})
+    if hue_sink:
+        hue_sink.close()
+        log.info('Supervised Hue lights: %s', hue_sink.stats(), extra={'event': 'stats.supervisor'})
+    if status_server:
+        log.info('Status API: %d changes pushed, %d slow subscribers dropped', status_server.published,
+                 status_server.dropped, extra={'event': 'stats.status'})
+        status_server.stop()
+    if streamer:
+        streamer.stop()
+    webhooks.stop()
+    for name, scheduler in hue_schedulers.items():
+        log.info('Hue scheduler %s: %s', name, scheduler.stats(), extra={'event': 'stats.scheduler', 'bridge': name})
+        scheduler.close()
+    hue_schedulers.clear()
+    for light_mirror in mirrors:
+        light_mirror.stop()
+    tracer.close()
+    if metrics_server:
+        metrics_server.stop()
+    log_writer.stop()
+
+
+def main():
+    from rtmidi.midiutil import open_midiinput
+
+    if SUPERVISED:
+        # A daemon has nobody to pick a port from a list, a missing port is retried instead
+        def open_port(name):
+            return open_midiinput(name, interactive=False)
+    else:
+        open_port = open_midiinput
+
+    # Open the ports before anything else and queue their events, the rest starts behind them
+    log_writer.start()
+    midi_dispatcher = MidiDispatcher(make_batch_handler(port_names))
+    inputs = []
+    for name in PORT_NAMES:
+        try:
+            midiin, actual_port_name = open_port(name)
+            midi_dispatcher.attach(midiin, len(inputs))
+            port_names.append(actual_port_name)
+            log.info('Successfully opened MIDI input port: %s', actual_port_name,
+                     extra={'event': 'midi.port_opened', 'port': actual_port_name})
+            inputs.append((midiin, actual_port_name))
+        except (EOFError, KeyboardInterrupt):
+            log.error('Exiting due to user interruption.')
+            log_writer.stop()
+            sys.exit()
+        except Exception as e:
+            log.error("Error opening MIDI input port '%s': %s", name, e,
+                      extra={'event': 'midi.port_failed', 'port': name})
+            if SUPERVISED:
+                # Keep its source number, the port watcher opens it when it shows up
+                port_names.append(name)
+                inputs.append((None, name))
+    if all(midiin is None for midiin, _ in inputs):
+        if not SUPERVISED:
+            log_writer.stop()
+            sys.exit()
+        log.warning('No MIDI input port open yet, waiting for %s', PORT_NAMES, extra={'event': 'midi.waiting'})
+
+    dispatcher = start(inputs, midi_dispatcher, open_port if SUPERVISED else None)
+
+    print("Waiting for MIDI events. Press Control-C to exit.")
     try:
-        timer = time.time()
-        #focus = get_focus()
-        while True:
-            msg = midiin.get_message()
-
-            if msg:
-                message, deltatime = msg
-                timer += deltatime
-
-                # Parse the MIDI message
-                msg_type, channel, note, velocity = parse_midi_message(message)         
-
-                if msg_type:
-                    friendly_time = format_timestamp(timer)
-                    print(f"[{actual_port_name}] {friendly_time} {msg_type} - Channel: {channel}, Note: {note}, Velocity: {velocity}")
-
-                # Set light color based on velocity (127 = started, 0 = stopped)
-                if velocity == 127 and note == 24:
-                    color = {"on": True, "bri": 255, "xy": [1, 0]}  # Red (Recording started)
-                    if AWTRIX_HOST:
-                        result = subprocess.run(["python", "rest_pub_recording.py"], capture_output=True, text=True)
-                        logging.info(f"Awtrix recording app started: {result}")    
-                    logging.info('Recording started. Setting light to red.')
-                    switch_on_light_by_id(LIGHT_ID)
-                elif velocity == 0 and note == 24:
-                    color = {"on": True, "bri": 255, "xy": [0.214, 0.709]}  # Blue (Recording stopped)
-                    if AWTRIX_HOST:
-                        result = subprocess.run(["python", "rest_del_recording.py"], capture_output=True, text=True)
-                        logging.info (f"Awtrix recording app  stopped: {result}")   
-                    logging.info('Recording stopped. Setting light to blue.')
-                    switch_off_light_by_id(LIGHT_ID)
-
-            time.sleep(0.01)  # Prevent CPU overload
+        dispatcher.join()
     except KeyboardInterrupt:
         print('Exiting...')
     finally:
-        print("Closing MIDI input port...")
-        midiin.close_port()
-        del midiin
-        print("MIDI input port closed. Goodbye!")
+        print("Closing MIDI input ports...")
+        stop(inputs, dispatcher)
+        for midiin, _ in inputs:
+            if midiin is not None:
+                midiin.close_port()
+        del inputs
+        print("MIDI input ports closed. Goodbye!")
         logging.shutdown()
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+metrics.py
+
+Minimal Prometheus-style metrics: counters, callback gauges and histograms, rendered in the
+text exposition format by a small HTTP server on localhost.
+
+Only the standard library is used; observing a value is a lock, a bisect and two additions.
+"""
+
+import bisect
+import logging
+import os
+import resource
+import stat
+import sys
+import threading
+
+log = logging.getLogger('metrics')
+
+# Seconds, tuned for a pipeline where a few ms matter and a second is an outage
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(label, value):
+    if isinstance(label, tuple):
+        # Several labels: the value is a tuple in the same order
+        return '{' + ','.join(f'{name}="{item}"' for name, item in zip(label, value)) + '}'
+    return f'{{{label}="{value}"}}' if label else ''
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label_value=None):
+        with self._lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(self.values.items(), key=lambda item: str(item[0])):
+            lines.append(f"{self.name}{_labels(self.label, value)} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time; the callback may return a {label: value} dict.
+
+    With a tuple of label names, the dict is keyed by tuples of label values.
+    """
+
+    def __init__(self, name, help, read, label=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.read()
+        except Exception as e:
+            log.warning('Cannot read gauge %s: %s', self.name, e)
+            return lines
+        items = value.items() if isinstance(value, dict) else [(None, value)]
+        for label_value, number in items:
+            lines.append(f"{self.name}{_labels(self.label, label_value)} {number}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}  # label value -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label_value: list(values) for label_value, values in self.series.items()}
+        for label_value, values in sorted(series.items(), key=lambda item: str(item[0])):
+            prefix = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{_labels(self.label, label_value)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label, label_value)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label=None):
+        return self._add(Counter(name, help, label))
+
+    def gauge(self, name, help, read, label=None):
+        return self._add(Gauge(name, help, read, label))
+
+    def histogram(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, label, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def process_stats():
+    """Resident memory in bytes, open file descriptors, sockets among them and threads of this process."""
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    else:
+        # macOS has no cheap current RSS, the peak (in bytes there) still shows growth
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    fds = sockets = 0
+    for name in os.listdir('/proc/self/fd' if os.path.isdir('/proc/self/fd') else '/dev/fd'):
+        try:
+            mode = os.fstat(int(name)).st_mode
+        except OSError:
+            # The descriptor listdir() used, closed by now
+            continue
+        fds += 1
+        sockets += stat.S_ISSOCK(mode)
+    return {'rss_bytes': rss, 'fds': fds, 'sockets': sockets, 'threads': threading.active_count()}
+
+
+def _handler_class():
+    # http.server pulls in http.client and the email package, only import it when serving
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+class MetricsServer:
+    """Serve a registry on http://host:port/metrics from a background thread."""
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        from http.server import ThreadingHTTPServer
+        self.server = ThreadingHTTPServer((host, port), _handler_class())
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
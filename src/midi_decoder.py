@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+midi_decoder.py
+
+Table-driven MIDI decoder for batches of raw messages as delivered by rtmidi.
+
+A 256-entry table, built once at import, tells for every status byte what kind of message it
+starts, its channel and how many data bytes follow. Decoding a batch is then a couple of list
+lookups per message and produces compact (kind, channel, data1, data2, index) tuples of small
+ints: no strings on the hot path. Running status, SysEx, System Common and realtime bytes
+(clock, start/stop, active sensing, even in the middle of another message) are handled.
+Human-readable output lives in format_record(), for the optional debug sink.
+"""
+
+import time
+
+# Message kinds
+UNKNOWN = 0
+NOTE_OFF = 1
+NOTE_ON = 2
+POLY_PRESSURE = 3
+CONTROL_CHANGE = 4
+PROGRAM_CHANGE = 5
+CHANNEL_PRESSURE = 6
+PITCH_BEND = 7
+SYSEX = 8
+TIME_CODE = 9
+SONG_POSITION = 10
+SONG_SELECT = 11
+TUNE_REQUEST = 12
+CLOCK = 13
+START = 14
+CONTINUE = 15
+STOP = 16
+ACTIVE_SENSING = 17
+RESET = 18
+
+KIND_NAMES = (
+    'Unknown', 'Note Off', 'Note On ', 'Poly Pressure', 'Control Change', 'Program Change',
+    'Channel Pressure', 'Pitch Bend', 'SysEx', 'Time Code', 'Song Position', 'Song Select',
+    'Tune Request', 'Clock', 'Start', 'Continue', 'Stop', 'Active Sensing', 'Reset',
+)
+
+_SYSEX_START = 0xF0
+_SYSEX_END = 0xF7
+
+
+def _build_tables():
+    kind = [UNKNOWN] * 256
+    channel = [0] * 256
+    length = [0] * 256
+    voice = ((0x80, NOTE_OFF, 2), (0x90, NOTE_ON, 2), (0xA0, POLY_PRESSURE, 2), (0xB0, CONTROL_CHANGE, 2),
+             (0xC0, PROGRAM_CHANGE, 1), (0xD0, CHANNEL_PRESSURE, 1), (0xE0, PITCH_BEND, 2))
+    for base, message_kind, data_bytes in voice:
+        for ch in range(16):
+            kind[base + ch] = message_kind
+            channel[base + ch] = ch + 1  # 1-indexed, as shown in Logic
+            length[base + ch] = data_bytes
+    system = {0xF0: (SYSEX, 0), 0xF1: (TIME_CODE, 1), 0xF2: (SONG_POSITION, 2), 0xF3: (SONG_SELECT, 1),
+              0xF6: (TUNE_REQUEST, 0), 0xF8: (CLOCK, 0), 0xFA: (START, 0), 0xFB: (CONTINUE, 0),
+              0xFC: (STOP, 0), 0xFE: (ACTIVE_SENSING, 0), 0xFF: (RESET, 0)}
+    for status, (message_kind, data_bytes) in system.items():
+        kind[status] = message_kind
+        length[status] = data_bytes
+    return kind, channel, length
+
+
+KIND, CHANNEL, LENGTH = _build_tables()
+
+
+class MidiDecoder:
+    """Decode batches of raw MIDI messages, keeping running status between messages."""
+
+    def __init__(self):
+        self.running = 0  # last channel voice status byte, 0 when running status is not allowed
+
+    def decode_batch(self, messages, out=None, first_index=0):
+        """Decode an iterable of byte lists and return the list of records.
+
+        Each record is (kind, channel, data1, data2, index) where index is the position of the
+        source message in `messages`, plus `first_index`. Note On with velocity 0 comes out as
+        NOTE_OFF with data2 0. SysEx records carry the payload length in data1.
+        """
+        if out is None:
+            out = []
+        append = out.append
+        kind_table, channel_table, length_table = KIND, CHANNEL, LENGTH
+        running = self.running
+        for index, message in enumerate(messages, first_index):
+            n = len(message)
+            if n == 3:
+                # Fast path: one complete channel message, by far the most common case
+                status, data1, data2 = message
+                if length_table[status] == 2 and not (data1 | data2) & 0x80:
+                    # Song Position (0xF2) has two data bytes too but cancels running status
+                    running = status if status < 0xF0 else 0
+                    kind = kind_table[status]
+                    if kind == NOTE_ON and data2 == 0:
+                        kind = NOTE_OFF
+                    append((kind, channel_table[status], data1, data2, index))
+                    continue
+            elif n == 1 and message[0] >= 0xF8:
+                append((kind_table[message[0]], 0, 0, 0, index))
+                continue
+            i = 0
+            while i < n:
+                status = message[i]
+                if status >= 0xF8:
+                    # Realtime: a single byte, may be interleaved, leaves running status alone
+                    append((kind_table[status], 0, 0, 0, index))
+                    i += 1
+                    continue
+                if status < 0x80:
+                    # Data byte without status: running status, or garbage to skip
+                    if not running:
+                        i += 1
+                        continue
+                    status = running
+                else:
+                    i += 1
+                    if status == _SYSEX_START:
+                        end = i
+                        while end < n and message[end] != _SYSEX_END:
+                            end += 1
+                        append((SYSEX, 0, end - i, 0, index))
+                        i = end + 1
+                        running = 0
+                        continue
+                    running = status if status < 0xF0 else 0
+                kind = kind_table[status]
+                data_bytes = length_table[status]
+                if i + data_bytes > n:
+                    break  # truncated message
+                data1 = message[i] if data_bytes else 0
+                data2 = message[i + 1] if data_bytes == 2 else 0
+                if (data1 | data2) & 0x80:
+                    # Rare: realtime bytes inside the message, or a truncated one
+                    data1, data2, i = _collect_data(message, i, data_bytes, append, index)
+                    if i < 0:
+                        i = -i
+                        continue
+                else:
+                    i += data_bytes
+                if kind == NOTE_ON and data2 == 0:
+                    kind = NOTE_OFF
+                append((kind, channel_table[status], data1, data2, index))
+        self.running = running
+        return out
+
+
+def _collect_data(message, i, data_bytes, append, index):
+    """Slow path: gather data bytes while emitting interleaved realtime bytes.
+
+    Returns (data1, data2, next index); the index is negated when a new status byte or the end
+    of the message cut it short, in which case the incomplete message is skipped.
+    """
+    data = []
+    n = len(message)
+    while len(data) < data_bytes and i < n:
+        byte = message[i]
+        if byte >= 0xF8:
+            append((KIND[byte], 0, 0, 0, index))
+        elif byte >= 0x80:
+            return 0, 0, -i
+        else:
+            data.append(byte)
+        i += 1
+    if len(data) < data_bytes:
+        return 0, 0, -n
+    data += [0, 0]
+    return data[0], data[1], i
+
+
+def format_record(record, timer, port):
+    """Human-readable line for a decoded record; only used by the debug sink."""
+    kind, channel, data1, data2, _ = record
+    friendly_time = time.strftime("%H:%M:%S", time.localtime(timer)) + f".{int((timer % 1) * 1000):03d}"
+    if kind in (NOTE_ON, NOTE_OFF):
+        return f"[{port}] {friendly_time} {KIND_NAMES[kind]} - Channel: {channel}, Note: {data1}, Velocity: {data2}"
+    if channel:
+        return f"[{port}] {friendly_time} {KIND_NAMES[kind]} - Channel: {channel}, Data: {data1} {data2}"
+    return f"[{port}] {friendly_time} {KIND_NAMES[kind]}"
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+midi_input.py
+
+Event-driven MIDI ingestion for logic_pro_to_hue.py.
+
+rtmidi calls our input callback from its own thread as soon as a message arrives. The callback
+only timestamps the message and puts it on a bounded queue; a dispatcher thread sleeps on that
+queue, drains everything that is pending when it wakes up and hands the batch to a handler.
+Nothing polls, so an idle process does not wake up at all.
+
+Any number of ports can be attached to one dispatcher. Each callback tags its messages with
+the port's source number, and they are merged in arrival order on the single queue, without
+a thread or poll loop of our own per port.
+
+Handling can be switched off and on (`enabled`), e.g. by the Focus Mode watcher: while it is off
+the dispatcher still drains the queue but drops the batches, so nothing is checked per message.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger('midi_input')
+
+_STOP = object()
+
+
+class MidiDispatcher:
+    """Bounded queue between the rtmidi callback and a single dispatcher thread.
+
+    `handler` is called on the dispatcher thread with a list of (message, deltatime, received,
+    source) tuples, where `received` is the time.monotonic_ns() value at which the callback saw
+    the message and `source` the number the port was attached with.
+    """
+
+    def __init__(self, handler, maxsize=1024, max_batch=256):
+        self.handler = handler
+        self.queue = queue.Queue(maxsize)
+        self.max_batch = max_batch
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.gated = 0
+        self.enabled = True
+        self.by_source = {}
+        self._drop_lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, midiin, source=0):
+        """Register the dispatcher as the input callback of an rtmidi MidiIn object.
+
+        Messages rtmidi queued between opening the port and now are taken over as well. They
+        have to be read before the callback is set: with a callback, rtmidi's get_message()
+        only warns and returns nothing. A message arriving in the moment between the last read
+        and set_callback() stays in rtmidi's queue and is lost; the next toggle corrects it.
+        """
+        self.by_source.setdefault(source, 0)
+        self._drain(midiin, source)
+        midiin.set_callback(self.on_midi, source)
+
+    def _drain(self, midiin, source):
+        event = midiin.get_message()
+        while event:
+            self.on_midi(event, source)
+            event = midiin.get_message()
+
+    def on_midi(self, event, source=None):
+        # Runs on the rtmidi thread, one per port: do as little as possible. What arrives is
+        # counted on the dispatcher thread, so the callbacks share no counters but `dropped`.
+        message, deltatime = event
+        try:
+            self.queue.put_nowait((message, deltatime, time.monotonic_ns(), source or 0))
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='midi-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        get = self.queue.get
+        get_nowait = self.queue.get_nowait
+        while True:
+            item = get()
+            if item is _STOP:
+                return
+            batch = [item]
+            # Drain whatever else arrived while we were asleep or busy
+            while len(batch) < self.max_batch:
+                try:
+                    item = get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._dispatch(batch)
+                    return
+                batch.append(item)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        by_source = self.by_source
+        for item in batch:
+            by_source[item[3]] = by_source.get(item[3], 0) + 1
+        self.received += len(batch)
+        if not self.enabled:
+            self.gated += len(batch)
+            self.handled += len(batch)
+            return
+        try:
+            self.handler(batch)
+        except Exception:
+            log.exception('MIDI handler failed on a batch of %d message(s)', len(batch))
+        self.handled += len(batch)
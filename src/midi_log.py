@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+midi_log.py
+
+Compact binary log of raw MIDI input, for recording a session once and replaying it into the
+pipeline as often as needed.
+
+The file is a 20 byte header (magic, version, wall-clock start time) followed by one record per
+message: the deltatime rtmidi reported, in microseconds (uint32), the message length (uint8,
+255 means a uint32 length follows for long SysEx) and the raw bytes. A note costs 8 bytes.
+MidiLog memory-maps the file and decodes records in place, so opening even a long session is
+instant and iterating does no file I/O.
+"""
+
+import mmap
+import struct
+import time
+
+MAGIC = b'LP2HMIDI'
+VERSION = 1
+_HEADER = struct.Struct('<8sHHd')
+_RECORD = struct.Struct('<IB')
+_LONG = struct.Struct('<I')
+_MAX_DELTA_US = 0xFFFFFFFF
+
+
+class MidiRecorder:
+    """Append (message, deltatime) tuples to a log file.
+
+    on_midi() has the rtmidi callback signature, so a recorder can be attached to a port directly
+    or fed from midiin.get_message().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, 0, time.time()))
+
+    def write(self, message, deltatime):
+        length = len(message)
+        delta_us = min(_MAX_DELTA_US, max(0, int(round(deltatime * 1e6))))
+        if length < 255:
+            self._file.write(_RECORD.pack(delta_us, length))
+        else:
+            self._file.write(_RECORD.pack(delta_us, 255) + _LONG.pack(length))
+        self._file.write(bytes(message))
+        self.count += 1
+
+    def on_midi(self, event, data=None):
+        message, deltatime = event
+        self.write(message, deltatime)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MidiLog:
+    """Read-only, memory-mapped view of a recorded session."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.started = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a MIDI session log")
+
+    def __iter__(self):
+        """Yield (message, deltatime) tuples, as rtmidi delivered them."""
+        data = self._map
+        end = len(data)
+        offset = _HEADER.size
+        unpack_record = _RECORD.unpack_from
+        while offset + _RECORD.size <= end:
+            delta_us, length = unpack_record(data, offset)
+            offset += _RECORD.size
+            if length == 255:
+                length, = _LONG.unpack_from(data, offset)
+                offset += _LONG.size
+            if offset + length > end:
+                break  # recording was cut off mid-record
+            yield list(data[offset:offset + length]), delta_us / 1e6
+            offset += length
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay(events, sink, speed=1.0):
+    """Feed (message, deltatime) tuples to `sink(event)` with their original spacing.
+
+    `speed` 2.0 plays twice as fast, 0 as fast as possible. Timing is kept against the start of
+    the replay, so a slow sink makes later events late rather than shifting the whole session.
+    Returns (messages, seconds taken, worst lateness in seconds).
+    """
+    count = 0
+    lateness = 0.0
+    start = time.perf_counter()
+    due = 0.0
+    for event in events:
+        if speed:
+            due += event[1] / speed
+            wait = start + due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            elif -wait > lateness:
+                lateness = -wait
+        sink(event)
+        count += 1
+    return count, time.perf_counter() - start, lateness
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+recording_state.py
+
+Recording-state machine between the MIDI parser and the light/clock sinks.
+
+Logic sends bursts of note 24 on/off when tracks are armed and disarmed quickly. The first change
+after a quiet period is applied at once; further changes inside the coalescing window only update
+the wanted state, which is applied when the window closes (last writer wins). A state that equals
+the one last applied is never written again.
+
+Each change may carry a context object (the event's trace). The context of the change that is
+applied goes to apply(); contexts of coalesced or dropped changes go to discard(context, reason).
+"""
+
+import logging
+import threading
+
+log = logging.getLogger('recording_state')
+
+
+class RecordingStateMachine:
+    """Coalesce recording on/off changes and hand the result to `apply(recording, context)`."""
+
+    def __init__(self, apply, window=0.05, discard=None):
+        self.apply = apply
+        self.window = window
+        self.discard = discard
+        self.received = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.applied = 0
+        self.state = None  # last state handed to apply(), None until the first write
+        self._pending = None
+        self._pending_context = None
+        self._timer = None
+        self._lock = threading.Lock()
+        # Serialises apply() calls so a slow write can never land after a newer one
+        self._apply_lock = threading.Lock()
+
+    def feed(self, recording, context=None):
+        """Register a recording state change reported by Logic."""
+        apply = False
+        discarded = None
+        with self._lock:
+            self.received += 1
+            if self._timer is not None:
+                # Inside the window: remember only the latest wish
+                if self._pending is not None:
+                    self.coalesced += 1
+                    discarded = self._pending_context, 'coalesced'
+                self._pending = recording
+                self._pending_context = context
+            elif recording == self.state:
+                self.dropped += 1
+                discarded = context, 'dropped'
+            else:
+                self.state = recording
+                self.applied += 1
+                self._open_window()
+                self._apply_lock.acquire()
+                apply = True
+        if apply:
+            self._apply(recording, context)
+        elif discarded:
+            self._discard(*discarded)
+
+    def counters(self):
+        return {
+            'received': self.received,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'applied': self.applied,
+        }
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = None
+            context, self._pending_context = self._pending_context, None
+        self._discard(context, 'cancelled')
+
+    def _open_window(self):
+        if self.window > 0:
+            self._timer = threading.Timer(self.window, self._close_window)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _close_window(self):
+        apply = False
+        with self._lock:
+            recording, self._pending = self._pending, None
+            context, self._pending_context = self._pending_context, None
+            self._timer = None
+            if recording is None:
+                return
+            if recording == self.state:
+                self.dropped += 1
+            else:
+                self.state = recording
+                self.applied += 1
+                # Keep coalescing while the burst goes on
+                self._open_window()
+                self._apply_lock.acquire()
+                apply = True
+        if apply:
+            self._apply(recording, context)
+        else:
+            self._discard(context, 'dropped')
+
+    def _apply(self, recording, context):
+        # Called with _apply_lock held, taken while the state lock was still ours
+        try:
+            self.apply(recording, context)
+        except Exception:
+            log.exception('Applying recording state %s failed', recording)
+        finally:
+            self._apply_lock.release()
+
+    def _discard(self, context, reason):
+        if context is not None and self.discard:
+            self.discard(context, reason)
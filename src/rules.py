@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+rules.py
+
+Declarative rules that map MIDI events to light actions, compiled into a lookup table.
+
+A rules file (JSON) lists named light states and rules. A rule matches a channel (or any), a
+note, released note (`note_off`) or CC number and a velocity/value range, and carries a list of actions: drive the
+recording state, set a light or group state, recall a scene or call a webhook. At load time the
+rules are compiled into a table keyed by (note/CC, channel, number) holding one action tuple per
+velocity, so matching an event is a dict lookup and an index however many rules there are.
+RuleEngine swaps in a freshly compiled table when the file changes; events in flight keep using
+the table they started with, nothing waits for the compile.
+
+Example:
+
+    {
+      "states": {"onAIR": {"on": true, "bri": 254, "sat": 254, "hue": 65535}},
+      "rules": [
+        {"name": "Record", "note": 24, "velocity": 127, "actions": [{"type": "recording", "on": true}]},
+        {"name": "Sustain", "channel": 2, "cc": 64, "value": [64, 127],
+         "actions": [{"type": "scene", "group": "1", "scene": "AbCdEf123"}]}
+      ]
+    }
+"""
+
+import json
+import logging
+import os
+import threading
+
+from light_dispatch import split_targets
+from midi_decoder import CONTROL_CHANGE, KIND_NAMES, NOTE_OFF, NOTE_ON
+
+log = logging.getLogger('rules')
+
+# Action types, the first item of every compiled action tuple
+RECORDING = 'recording'
+SET_STATE = 'set_state'
+SCENE = 'scene'
+WEBHOOK = 'webhook'
+
+# What a rule can match on. "note" matches Note On; Note Off only matches "note_off" rules, and
+# velocity 0 of "note" rules, since the decoder reports Note On with velocity 0 as Note Off
+NOTE = 1
+CC = 2
+RELEASE = 3
+_MATCH_CLASS = tuple(NOTE if kind == NOTE_ON else RELEASE if kind == NOTE_OFF else
+                     CC if kind == CONTROL_CHANGE else 0 for kind in range(len(KIND_NAMES)))
+_TARGETS = (('note', NOTE), ('note_off', RELEASE), ('cc', CC))
+
+EMPTY = ()
+
+# Light states used for recording on / off unless the rules file overrides them
+DEFAULT_STATES = {
+    'onAIR': {
+        'on': True,
+        'bri': 254,  # Full luminosity
+        'sat': 254,  # Full saturation
+        'hue': 65535,  # Red
+    },
+    'offAIR': {
+        'on': False,
+        'bri': 254,
+        'sat': 254,
+        'hue': 65535,
+    },
+}
+
+# Logic's Recording Light control surface: note 24, velocity 127 = started, 0 = stopped
+DEFAULT_RULES = {
+    'states': DEFAULT_STATES,
+    'rules': [
+        {'name': 'Recording started', 'note': 24, 'velocity': 127, 'actions': [{'type': RECORDING, 'on': True}]},
+        {'name': 'Recording stopped', 'note': 24, 'velocity': 0, 'actions': [{'type': RECORDING, 'on': False}]},
+    ],
+}
+
+
+def _key(match_class, channel, number):
+    # One int instead of a tuple: cheaper to hash on the hot path
+    return (match_class << 12) | (channel << 7) | number
+
+
+def _range(rule, name, default):
+    value = rule.get(name, default)
+    lo, hi = (value, value) if isinstance(value, int) else value
+    if not 0 <= lo <= hi <= 127:
+        raise ValueError(f"{name} must be 0-127 or a [low, high] range, got {value!r}")
+    return lo, hi
+
+
+def _by_bridge(targets, bridges):
+    # Lights and groups on a bridge from [Bridges] are written as name/4; plain ones are on the [Hue] bridge
+    for target in targets:
+        name, sep, _ = target.partition('/')
+        if sep and name not in bridges:
+            raise ValueError(f"no bridge called {name!r} in [Bridges] for {target!r}")
+    return split_targets(targets, bridges)
+
+
+def _compile_action(action, states, bridges):
+    kind = action.get('type')
+    if kind == RECORDING:
+        return (RECORDING, bool(action['on']))
+    if kind == SET_STATE:
+        state = action['state']
+        if isinstance(state, str):
+            state = states[state]
+        lights = tuple(str(light_id) for light_id in action.get('lights', ()))
+        groups = tuple(str(group_id) for group_id in action.get('groups', ()))
+        if not lights and not groups:
+            raise ValueError('set_state needs "lights" and/or "groups"')
+        lights, groups = _by_bridge(lights, bridges), _by_bridge(groups, bridges)
+        targets = tuple((name, tuple(lights.get(name, ())), tuple(groups.get(name, ())))
+                        for name in dict.fromkeys([*lights, *groups]))
+        return (SET_STATE, targets, dict(state))
+    if kind == SCENE:
+        (bridge, (group,)), = _by_bridge([str(action['group'])], bridges).items()
+        return (SCENE, bridge, group, str(action['scene']))
+    if kind == WEBHOOK:
+        return (WEBHOOK, action.get('method', 'POST').upper(), action['url'], action.get('body'))
+    raise ValueError(f"unknown action type {kind!r}")
+
+
+class RuleSet:
+    """Rules compiled into a {(class, channel, number): [actions per velocity]} table."""
+
+    def __init__(self, table, states, count):
+        self.table = table
+        self.states = states
+        self.count = count
+
+    @classmethod
+    def compile(cls, spec, bridges=()):
+        """Build a RuleSet from a parsed rules file; raises ValueError on a bad rule.
+
+        `bridges` are the names from [Bridges] that actions may address lights and groups on.
+        """
+        states = dict(DEFAULT_STATES)
+        states.update(spec.get('states', {}))
+        spans = {}  # key -> [(low, high, actions)] in file order
+        rules = spec.get('rules', [])
+        for number, rule in enumerate(rules, 1):
+            try:
+                targets = [(match_class, rule[name]) for name, match_class in _TARGETS if name in rule]
+                if len(targets) != 1:
+                    raise ValueError('give exactly one of "note", "note_off" or "cc"')
+                (match_class, target), = targets
+                if not 0 <= target <= 127:
+                    raise ValueError(f"note/cc must be 0-127, got {target!r}")
+                lo, hi = _range(rule, 'velocity' if 'velocity' in rule else 'value', [0, 127])
+                channel = rule.get('channel')
+                channels = range(1, 17) if channel is None else (channel,)
+                if channel is not None and not 1 <= channel <= 16:
+                    raise ValueError(f"channel must be 1-16, got {channel!r}")
+                actions = tuple(_compile_action(action, states, bridges) for action in rule.get('actions', ()))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"rule {number} ({rule.get('name', 'unnamed')}): {e}") from None
+            for ch in channels:
+                spans.setdefault(_key(match_class, ch, target), []).append((lo, hi, actions))
+                if match_class == NOTE and lo == 0:
+                    spans.setdefault(_key(RELEASE, ch, target), []).append((0, 0, actions))
+
+        table = {}
+        for key, key_spans in spans.items():
+            # Every velocity between two span edges matches the same rules, fill it in one slice
+            edges = sorted({lo for lo, _, _ in key_spans} | {hi + 1 for _, hi, _ in key_spans} | {0, 128})
+            row = [EMPTY] * 128
+            for start, end in zip(edges, edges[1:]):
+                actions = tuple(action for lo, hi, acts in key_spans if lo <= start <= hi for action in acts)
+                if actions:
+                    row[start:end] = [actions] * (end - start)
+            table[key] = row
+        return cls(table, states, len(rules))
+
+    def match(self, record):
+        """Return the action tuples for a decoded (kind, channel, data1, data2, index) record."""
+        row = self.table.get(_key(_MATCH_CLASS[record[0]], record[1], record[2]))
+        return row[record[3]] if row else EMPTY
+
+
+class RuleEngine:
+    """The current RuleSet, recompiled from the rules file in the background when it changes.
+
+    Without a rules file the built-in rules for Logic's Recording Light are used. A file that
+    fails to load is logged and the previous rules stay active.
+    """
+
+    def __init__(self, path, recheck=1.0, bridges=()):
+        self.path = path
+        self.recheck = recheck
+        self.bridges = bridges
+        self.rules = RuleSet.compile(DEFAULT_RULES)
+        self.loads = 0
+        self.errors = 0
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def match(self, record):
+        return self.rules.match(record)
+
+    def reload_if_changed(self):
+        """Recompile when the file's mtime or size changed; returns True when new rules are active."""
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        if signature is None:
+            log.info('No rules file at %s, using the built-in recording rules', self.path)
+            self.rules = RuleSet.compile(DEFAULT_RULES)
+            return True
+        try:
+            with open(self.path) as f:
+                rules = RuleSet.compile(json.load(f), self.bridges)
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            log.error('Cannot load rules from %s, keeping the previous rules: %s', self.path, e)
+            return False
+        # A single reference swap: the dispatcher never sees a half-built table
+        self.rules = rules
+        self.loads += 1
+        log.info('Loaded %d rules from %s', rules.count, self.path)
+        return True
+
+    def start(self):
+        self.reload_if_changed()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rules-reload', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.recheck):
+            self.reload_if_changed()
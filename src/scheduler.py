@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+scheduler.py
+
+Rate-limited, prioritised command queue in front of a Hue bridge.
+
+The bridge handles roughly 10 light commands or 1 group command per second and answers bursts
+beyond that with errors or silently drops them. Every write goes through a CommandScheduler:
+token buckets per bridge and per endpoint class pace the requests, recording start/stop jumps
+ahead of cosmetic and bulk updates, and a command that is still queued for the same light or
+group absorbs newer ones instead of queueing behind them. With a LightMirror attached, a write
+is answered straight away when the lights already have that state.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from hue_client import HueRateLimited, get_client
+
+log = logging.getLogger('scheduler')
+
+# Priority lanes, lowest number goes first
+PRIORITY_RECORDING = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+LANES = (PRIORITY_RECORDING, PRIORITY_NORMAL, PRIORITY_BULK)
+
+# Endpoint classes
+LIGHT = 'light'
+GROUP = 'group'
+
+# Longest a caller waits on a write: the retry deadline plus a request that times out
+RESULT_TIMEOUT = 15.0
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `burst` saved up."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now, cost=1.0):
+        """Seconds until `cost` tokens are available, 0 if they are available now."""
+        self._refill(now)
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def take(self, now, cost=1.0):
+        self._refill(now)
+        self.tokens -= cost
+
+    def penalise(self, now, seconds):
+        """Empty the bucket so nothing goes out for `seconds` (after a 429 from the bridge)."""
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class Command:
+    __slots__ = ('kind', 'target', 'state', 'priority', 'futures', 'queued_at', 'deadline')
+
+    def __init__(self, kind, target, state, priority, future, retry_for):
+        self.kind = kind
+        self.target = target
+        self.state = dict(state)
+        self.priority = priority
+        self.futures = [future]
+        self.queued_at = time.monotonic()
+        # Rate-limited retries stop here, the futures fail with the last HueRateLimited
+        self.deadline = self.queued_at + retry_for
+
+
+class CommandScheduler:
+    """Queue bridge writes in priority lanes and send them as fast as the rate limits allow.
+
+    submit() returns a Future that resolves to the bridge response and carries the
+    time.monotonic_ns() at which the request was sent as `sent_ns`. Commands are sent from a
+    small thread pool, so requests within the rate limits still run in parallel.
+
+    A skipped write resolves to an empty response list and has no `sent_ns`. Writes are only
+    skipped while nothing is queued or in flight for the same lights, so an older queued
+    command can never overtake them.
+
+    A command the bridge keeps answering with 429/503 is retried for `retry_for` seconds after
+    it was queued, then its futures fail with HueRateLimited.
+    """
+
+    def __init__(self, client, light_rate=10.0, group_rate=1.0, bridge_rate=10.0,
+                 max_workers=8, retry_after=1.0, retry_for=10.0, mirror=None):
+        self.client = client
+        self.mirror = mirror
+        self.retry_after = retry_after
+        self.retry_for = retry_for
+        # Light and group commands share the bridge's budget: a group action costs as much as
+        # the light commands the bridge could have handled instead (~10 for 1 group per second)
+        self.costs = {LIGHT: 1.0, GROUP: max(1.0, bridge_rate / group_rate)}
+        self.bridge_bucket = TokenBucket(bridge_rate, burst=max(bridge_rate, self.costs[GROUP]))
+        self.buckets = {LIGHT: TokenBucket(light_rate), GROUP: TokenBucket(group_rate, burst=1)}
+        self.lanes = {priority: collections.deque() for priority in LANES}
+        self.pending = {}
+        self.inflight = collections.Counter()
+        self.submitted = 0
+        self.merged = 0
+        self.skipped = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.waits = collections.deque(maxlen=1000)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hue-send')
+        self._thread = threading.Thread(target=self._run, name='hue-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, target, state, priority=PRIORITY_NORMAL):
+        """Queue `state` for a light or group; a queued command for the same target is merged."""
+        future = Future()
+        key = (kind, str(target))
+        with self._cond:
+            if self._closed:
+                future.set_exception(RuntimeError(f"Hue scheduler for {self.client.bridge_ip} is closed"))
+                return future
+            self.submitted += 1
+            command = self.pending.get(key)
+            if command is None and self._already_set(kind, str(target), state):
+                self.skipped += 1
+                future.set_result([])
+                return future
+            if command is not None:
+                # Newer values win, the command keeps its place but may move to a faster lane
+                self.merged += 1
+                command.state.update(state)
+                command.futures.append(future)
+                if priority < command.priority:
+                    self.lanes[command.priority].remove(command)
+                    command.priority = priority
+                    self.lanes[priority].append(command)
+            else:
+                command = self.pending[key] = Command(kind, str(target), state, priority, future, self.retry_for)
+                self.lanes[priority].append(command)
+            self._cond.notify()
+        return future
+
+    def _already_set(self, kind, target, state):
+        # Called with the lock held
+        if self.mirror is None or not self.mirror.live:
+            return False
+        light_ids = self.mirror.members(kind, target)
+        if not light_ids:
+            return False
+        busy = set()
+        for other_kind, other_target in list(self.pending) + list(self.inflight):
+            members = self.mirror.members(other_kind, other_target)
+            if members is None:
+                return False
+            busy.update(members)
+        if busy.intersection(light_ids):
+            return False
+        return self.mirror.matches(light_ids, state)
+
+    def set_light_state(self, light_id, state, priority=PRIORITY_NORMAL):
+        return self.submit(LIGHT, light_id, state, priority)
+
+    def set_group_action(self, group_id, state, priority=PRIORITY_NORMAL):
+        return self.submit(GROUP, group_id, state, priority)
+
+    def depth(self):
+        """Number of queued commands per priority lane."""
+        with self._cond:
+            return {priority: len(lane) for priority, lane in self.lanes.items()}
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self.waits)
+            return {
+                'depth': {priority: len(lane) for priority, lane in self.lanes.items()},
+                'submitted': self.submitted,
+                'merged': self.merged,
+                'skipped': self.skipped,
+                'sent': self.sent,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed,
+                'wait_avg_ms': sum(waits) / len(waits) * 1000 if waits else 0.0,
+                'wait_p95_ms': waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+                'wait_max_ms': waits[-1] * 1000 if waits else 0.0,
+            }
+
+    def close(self, timeout=2.0):
+        """Stop sending; queued writes are cancelled and later ones fail straight away."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        # The next get_scheduler() for this bridge starts a fresh one
+        with _schedulers_lock:
+            for key, scheduler in list(_schedulers.items()):
+                if scheduler is self:
+                    del _schedulers[key]
+        self._thread.join(timeout)
+        self._pool.shutdown(wait=False)
+        for lane in self.lanes.values():
+            for command in lane:
+                for future in command.futures:
+                    future.cancel()
+            lane.clear()
+        self.pending.clear()
+
+    def _next(self, now):
+        """Return (command, 0) for the command to send now, or (None, seconds to wait)."""
+        bridge_delay = self.bridge_bucket.delay(now)
+        if bridge_delay > 0:
+            return None, bridge_delay
+        wait = None
+        for priority in LANES:
+            for command in self.lanes[priority]:
+                delay = self.buckets[command.kind].delay(now)
+                if delay == 0:
+                    bridge_delay = self.bridge_bucket.delay(now, self.costs[command.kind])
+                    if bridge_delay == 0:
+                        return command, 0.0
+                    # It only waits for the shared budget: nothing behind it may use that up
+                    return None, bridge_delay if wait is None else min(wait, bridge_delay)
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                command, wait = self._next(now)
+                if command is None:
+                    self._cond.wait(wait)
+                    continue
+                self.lanes[command.priority].remove(command)
+                del self.pending[(command.kind, command.target)]
+                self.inflight[(command.kind, command.target)] += 1
+                self.bridge_bucket.take(now, self.costs[command.kind])
+                self.buckets[command.kind].take(now)
+                self.waits.append(now - command.queued_at)
+                self._pool.submit(self._send, command)
+
+    def _send(self, command):
+        # Lets callers trace when their request actually left the queue
+        sent_ns = time.monotonic_ns()
+        for future in command.futures:
+            future.sent_ns = sent_ns
+        if self.mirror is not None:
+            light_ids = self.mirror.members(command.kind, command.target)
+            if light_ids:
+                self.mirror.before_write(light_ids, command.state)
+        try:
+            if command.kind == LIGHT:
+                result = self.client.set_light_state(command.target, command.state)
+            else:
+                result = self.client.set_group_action(command.target, command.state)
+        except HueRateLimited as e:
+            self._requeue(command, e)
+            return
+        except Exception as e:
+            with self._cond:
+                self.failed += 1
+                self._landed(command)
+            for future in command.futures:
+                future.set_exception(e)
+            return
+        with self._cond:
+            self.sent += 1
+            if self.mirror is not None and not (isinstance(result, list) and any('error' in item for item in result)):
+                light_ids = self.mirror.members(command.kind, command.target)
+                if light_ids:
+                    self.mirror.record_write(light_ids, command.state)
+            self._landed(command)
+        for future in command.futures:
+            future.set_result(result)
+
+    def _landed(self, command):
+        # Called with the lock held once the bridge has answered
+        key = (command.kind, command.target)
+        self.inflight[key] -= 1
+        if self.inflight[key] <= 0:
+            del self.inflight[key]
+
+    def _requeue(self, command, error):
+        # The bridge is saturated: back off and put the command first in line again
+        with self._cond:
+            self.rate_limited += 1
+            self._landed(command)
+            now = time.monotonic()
+            give_up = self._closed or now >= command.deadline
+            if give_up:
+                self.failed += 1
+            else:
+                self.bridge_bucket.penalise(now, self.retry_after)
+                key = (command.kind, command.target)
+                newer = self.pending.get(key)
+                if newer is not None:
+                    # A newer command for the same target is queued: fold the old state under it
+                    newer.state = {**command.state, **newer.state}
+                    newer.futures = command.futures + newer.futures
+                    newer.deadline = min(newer.deadline, command.deadline)
+                else:
+                    self.pending[key] = command
+                    self.lanes[command.priority].appendleft(command)
+                self._cond.notify()
+        if give_up:
+            log.error('Hue bridge %s still rate limited after %.1f s, giving up on %s %s', self.client.bridge_ip,
+                      now - command.queued_at, command.kind, command.target)
+            for future in command.futures:
+                future.set_exception(error)
+            return
+        log.warning('Hue bridge %s rate limited, retrying %s %s', self.client.bridge_ip, command.kind, command.target)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(bridge_ip, username, timeout=2.0):
+    """Return the process-wide scheduler for this bridge, creating it on first use.
+
+    `timeout` is the seconds a request may take when the bridge's client is created.
+    """
+    key = (bridge_ip, username)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = CommandScheduler(get_client(bridge_ip, username, timeout))
+        return scheduler
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+"""
+sinks.py
+
+Outputs for recording-state changes, each behind its own bounded queue and worker thread.
+
+A recording change is put on the queue of every sink and returns at once; each worker sends
+it at its own pace, so a slow or dead sink only builds up its own backlog and never delays the
+others. What a full queue gives up is the sink's policy: the oldest change, the newest one, or
+(`latest`, the usual choice for a state) everything but the newest.
+
+Sinks here: a callback (the Hue lights), MQTT (a minimal 3.1.1 publisher, no extra package),
+OSC over UDP and a webhook. awtrix_client.AwtrixClient is a sink as well.
+"""
+
+import collections
+import logging
+import socket
+import struct
+import threading
+import time
+
+log = logging.getLogger('sinks')
+
+# What a full queue gives up
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+LATEST = 'latest'  # keep only the newest change, whatever the queue size
+POLICIES = (DROP_OLDEST, DROP_NEWEST, LATEST)
+
+
+class Sink:
+    """Bounded queue and worker thread in front of one output.
+
+    Subclasses implement send(recording, trace), returning False or raising when the output did
+    not take the change, and may set up connections in setup() and close them in teardown(), both
+    on the worker thread. A trace is held until the change was sent or dropped; with `stages` it
+    gets <name>_queued and <name>_ack stage marks. The output that decides a trace's outcome sets
+    `drop_outcome` for the changes its queue drops.
+    """
+
+    drop_outcome = None
+
+    def __init__(self, name, maxsize=16, policy=DROP_OLDEST, stages=True):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown sink policy {policy!r}, use one of {', '.join(POLICIES)}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.stages = stages
+        self.queue = collections.deque()
+        self.received = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_backlog = 0
+        self.latencies = collections.deque(maxlen=1000)  # seconds from put() until sent
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        """Send what is still queued (for up to `timeout` seconds) and stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, recording, trace=None):
+        """Queue a change; returns False when the policy dropped it."""
+        if trace is not None:
+            trace.hold()
+            if self.stages:
+                trace.mark(f"{self.name}_queued")
+        dropped = []
+        accepted = True
+        with self._cond:
+            self.received += 1
+            if self.policy == LATEST:
+                # Older changes are obsolete once a newer state is known
+                dropped.extend(self.queue)
+                self.queue.clear()
+            elif len(self.queue) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    accepted = False
+                else:
+                    dropped.append(self.queue.popleft())
+            if accepted:
+                self.queue.append((recording, trace, time.monotonic()))
+                self.max_backlog = max(self.max_backlog, len(self.queue))
+                self._cond.notify()
+            else:
+                dropped.append((recording, trace, None))
+            self.dropped += len(dropped)
+        if dropped and self.policy != LATEST:
+            log.warning('Sink %s queue full, dropped a change', self.name)
+        for _, old_trace, _ in dropped:
+            if old_trace is not None:
+                old_trace.release(self.drop_outcome)
+        return accepted
+
+    def wait_idle(self, timeout=None):
+        """Wait until nothing is queued or being sent; returns False if `timeout` passed first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.queue and not self._busy, timeout)
+
+    def backlog(self):
+        """Changes queued or being sent."""
+        with self._cond:
+            return len(self.queue) + self._busy
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self.latencies)
+            return {
+                'received': self.received,
+                'sent': self.sent,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'backlog': len(self.queue) + self._busy,
+                'max_backlog': self.max_backlog,
+                'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            }
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def send(self, recording, trace=None):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            self.setup()
+        except Exception:
+            log.exception('Sink %s could not be set up', self.name)
+        while True:
+            with self._cond:
+                while not self.queue and not self._closed:
+                    self._cond.wait()
+                if not self.queue:
+                    break
+                recording, trace, queued = self.queue.popleft()
+                self._busy = True
+            try:
+                ok = self.send(recording, trace) is not False
+            except Exception as e:
+                log.error('Sink %s failed to send recording=%s: %s', self.name, recording, e)
+                ok = False
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                if ok:
+                    self.sent += 1
+                    self.latencies.append(time.monotonic() - queued)
+                else:
+                    self.failed += 1
+            if trace is not None:
+                if self.stages:
+                    trace.mark(f"{self.name}_ack")
+                trace.release()
+        self.teardown()
+
+
+class CallbackSink(Sink):
+    """Hand each change to `func(recording, trace)`, e.g. the Hue fan-out."""
+
+    def __init__(self, name, func, maxsize=1, policy=LATEST, stages=False, drop_outcome=None):
+        super().__init__(name, maxsize, policy, stages)
+        self.func = func
+        self.drop_outcome = drop_outcome
+
+    def send(self, recording, trace=None):
+        return self.func(recording, trace)
+
+
+class WebhookSink(Sink):
+    """POST {"recording": true|false} as JSON to `url`."""
+
+    def __init__(self, url, maxsize=16, policy=LATEST, timeout=2.0, name='webhook'):
+        super().__init__(name, maxsize, policy)
+        self.url = url
+        self.timeout = timeout
+        self._session = None
+
+    def setup(self):
+        # requests is imported here, off the thread that starts the daemon
+        import requests
+        self._session = requests.Session()
+
+    def teardown(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def send(self, recording, trace=None):
+        response = self._session.post(self.url, json={'recording': recording}, timeout=self.timeout)
+        response.raise_for_status()
+        return True
+
+
+class OscSink(Sink):
+    """Send `address` with one int32 argument (1 recording, 0 not) as an OSC message over UDP."""
+
+    def __init__(self, host, port, address='/recording', maxsize=16, policy=LATEST, name='osc'):
+        super().__init__(name, maxsize, policy)
+        self.target = (host, port)
+        self.address = address
+        self._socket = None
+
+    def setup(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def teardown(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def send(self, recording, trace=None):
+        self._socket.sendto(osc_message(self.address, int(recording)), self.target)
+        return True
+
+
+def _osc_string(text):
+    data = text.encode() + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+
+def osc_message(address, value):
+    """An OSC message with a single int32 argument."""
+    return _osc_string(address) + _osc_string(',i') + struct.pack('>i', value)
+
+
+class MqttSink(Sink):
+    """Publish "1"/"0" to `topic` on an MQTT broker, retained so late subscribers see the state.
+
+    Speaks just enough MQTT 3.1.1 for QoS 0 publishing: CONNECT, CONNACK and PUBLISH, with the
+    keep-alive off so an idle connection is not dropped by the broker. A publish that fails
+    reconnects and is tried once more.
+    """
+
+    def __init__(self, host, port=1883, topic='studio/recording', client_id='logic-pro-to-hue', retain=True,
+                 maxsize=16, policy=LATEST, timeout=2.0, name='mqtt'):
+        super().__init__(name, maxsize, policy)
+        self.address = (host, port)
+        self.topic = topic
+        self.client_id = client_id
+        self.retain = retain
+        self.timeout = timeout
+        self._socket = None
+
+    def teardown(self):
+        self._disconnect()
+
+    def send(self, recording, trace=None):
+        packet = mqtt_publish(self.topic, b'1' if recording else b'0', self.retain)
+        for attempt in (1, 2):
+            try:
+                if self._socket is None:
+                    self._connect()
+                self._socket.sendall(packet)
+                return True
+            except OSError:
+                self._disconnect()
+                if attempt == 2:
+                    raise
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(mqtt_connect(self.client_id))
+            ack = b''
+            while len(ack) < 4:
+                chunk = sock.recv(4 - len(ack))
+                if not chunk:
+                    raise ConnectionError('MQTT broker closed the connection')
+                ack += chunk
+            if ack[0] != 0x20 or ack[3] != 0:
+                raise ConnectionError(f"MQTT broker refused the connection (code {ack[3]})")
+        except OSError:
+            sock.close()
+            raise
+        self._socket = sock
+        log.info('Connected to MQTT broker %s:%d', *self.address)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.sendall(b'\xe0\x00')
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+
+def _mqtt_string(text):
+    data = text.encode() if isinstance(text, str) else text
+    return struct.pack('>H', len(data)) + data
+
+
+def _mqtt_packet(header, body):
+    length = bytearray()
+    remaining = len(body)
+    while True:
+        byte, remaining = remaining % 128, remaining // 128
+        length.append(byte | 0x80 if remaining else byte)
+        if not remaining:
+            break
+    return bytes([header]) + bytes(length) + body
+
+
+def mqtt_connect(client_id):
+    # Protocol "MQTT" level 4, clean session, keep-alive 0 (off)
+    return _mqtt_packet(0x10, _mqtt_string('MQTT') + bytes([4, 0x02]) + struct.pack('>H', 0) + _mqtt_string(client_id))
+
+
+def mqtt_publish(topic, payload, retain=False):
+    return _mqtt_packet(0x30 | (1 if retain else 0), _mqtt_string(topic) + payload)
+
+
+def parse_address(value, default_port):
+    """Split "host[:port]" into (host, port)."""
+    host, _, port = value.rpartition(':') if ':' in value else (value, '', '')
+    return host, int(port) if port else default_port
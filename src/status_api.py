@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+"""
+status_api.py
+
+Local push API for the recording and Focus state: server-sent events and WebSocket.
+
+A subscriber gets a snapshot of the whole state first and then a delta with the changed keys
+for every change, each numbered with `seq` so it can tell that nothing was missed:
+
+    {"type": "snapshot", "seq": 7, "state": {"recording": false, "focus": "Music Production", ...}}
+    {"type": "delta", "seq": 8, "state": {"recording": true}}
+
+GET /events is the SSE stream (event: snapshot|delta, data: the JSON above), GET /ws the same
+messages as WebSocket text frames and GET /status a one-off snapshot.
+
+All connections live on one thread with a selector, so hundreds of idle subscribers cost no
+threads. publish() only records the change and wakes that thread; each message is encoded
+once and fanned out there. A subscriber that stops reading is dropped once its unsent data
+passes `max_buffer` bytes; it gets a fresh snapshot when it reconnects.
+"""
+
+import base64
+import collections
+import hashlib
+import json
+import logging
+import selectors
+import socket
+import struct
+import threading
+import time
+
+log = logging.getLogger('status_api')
+
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_MAX_REQUEST = 8192
+
+SSE = 'sse'
+WEBSOCKET = 'ws'
+
+
+def ws_frame(payload, opcode=0x1):
+    """An unmasked (server to client) WebSocket frame."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _message(kind, seq, state):
+    data = json.dumps({'type': kind, 'seq': seq, 'state': state}, separators=(',', ':')).encode()
+    return {
+        SSE: b'id: %d\nevent: %s\ndata: %s\n\n' % (seq, kind.encode(), data),
+        WEBSOCKET: ws_frame(data),
+    }
+
+
+class _Client:
+    __slots__ = ('sock', 'kind', 'seq', 'inbuf', 'out', 'closing')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.kind = None  # set once the request was read
+        self.seq = 0
+        self.inbuf = b''
+        self.out = bytearray()
+        self.closing = False
+
+
+class StatusServer:
+    """Serve the recording state to SSE and WebSocket subscribers from one background thread."""
+
+    def __init__(self, port, host='127.0.0.1', keepalive=15.0, max_buffer=65536, state=None):
+        self.keepalive = keepalive
+        self.max_buffer = max_buffer
+        self.state = dict(state or {})
+        self.seq = 0
+        self.published = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._clients = {}
+        self._closed = False
+        self._thread = None
+        self.listener = socket.create_server((host, port), backlog=512)
+        self.listener.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+
+    @property
+    def port(self):
+        return self.listener.getsockname()[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='status-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+        for client in list(self._clients.values()):
+            self._close(client)
+        self.selector.close()
+        for sock in (self.listener, self._wake_r, self._wake_w):
+            sock.close()
+
+    def publish(self, **changes):
+        """Merge `changes` into the state and push the changed keys; returns False if nothing changed."""
+        with self._lock:
+            delta = {key: value for key, value in changes.items() if self.state.get(key, object()) != value}
+            if not delta:
+                return False
+            self.state.update(delta)
+            self.seq += 1
+            self._pending.append((self.seq, delta))
+        self._wake()
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            return self.seq, dict(self.state)
+
+    def subscribers(self):
+        counts = {SSE: 0, WEBSOCKET: 0}
+        for client in list(self._clients.values()):
+            if client.kind in counts:
+                counts[client.kind] += 1
+        return counts
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'x')
+        except (BlockingIOError, OSError):
+            # Already woken (the buffer is full) or shutting down
+            pass
+
+    def _run(self):
+        last_keepalive = time.monotonic()
+        while not self._closed:
+            for key, events in self.selector.select(self.keepalive):
+                if key.fileobj is self.listener:
+                    self._accept()
+                elif key.fileobj is self._wake_r:
+                    self._drain_wake()
+                    self._fan_out()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and client.sock.fileno() != -1:
+                        self._flush(client)
+            now = time.monotonic()
+            if now - last_keepalive >= self.keepalive:
+                last_keepalive = now
+                self._send_keepalive()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # Out of file descriptors: leave the connection in the backlog for now
+                log.warning('Status API cannot accept a subscriber: %s', e)
+                time.sleep(0.1)
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(sock)
+            self._clients[sock.fileno()] = client
+            self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def _fan_out(self):
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for seq, delta in pending:
+            message = _message('delta', seq, delta)
+            self.published += 1
+            for client in list(self._clients.values()):
+                # A subscriber whose snapshot already includes this change skips it
+                if client.kind in message and seq > client.seq:
+                    self._send(client, message[client.kind])
+
+    def _send_keepalive(self):
+        messages = {SSE: b': keepalive\n\n', WEBSOCKET: ws_frame(b'', 0x9)}
+        for client in list(self._clients.values()):
+            if client.kind in messages:
+                self._send(client, messages[client.kind])
+
+    def _send(self, client, data):
+        if client.out:
+            client.out += data
+            if len(client.out) > self.max_buffer:
+                log.info('Status subscriber stopped reading, dropping it', extra={'event': 'status.drop'})
+                self.dropped += 1
+                self._close(client)
+            return
+        try:
+            sent = client.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(client)
+            return
+        if sent < len(data):
+            client.out += data[sent:]
+            self.selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        elif client.closing:
+            self._close(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.out)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close(client)
+            return
+        del client.out[:sent]
+        if not client.out:
+            if client.closing:
+                self._close(client)
+            else:
+                self.selector.modify(client.sock, selectors.EVENT_READ, client)
+
+    def _close(self, client):
+        if self._clients.pop(client.sock.fileno(), None) is None:
+            return
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(client)
+            return
+        client.inbuf += data
+        if client.kind is None:
+            self._request(client)
+        elif client.kind == WEBSOCKET:
+            self._ws_frames(client)
+        else:
+            # SSE subscribers have nothing to say
+            client.inbuf = b''
+        if len(client.inbuf) > _MAX_REQUEST:
+            self._close(client)
+
+    def _request(self, client):
+        if b'\r\n\r\n' not in client.inbuf:
+            return
+        head, client.inbuf = client.inbuf.split(b'\r\n\r\n', 1)
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        path = parts[1].split('?', 1)[0] if len(parts) > 1 else ''
+        if parts[:1] != ['GET']:
+            self._respond(client, '405 Method Not Allowed', 'text/plain', b'GET only\n')
+        elif path == '/status':
+            seq, state = self.snapshot()
+            body = json.dumps({'type': 'snapshot', 'seq': seq, 'state': state}).encode()
+            self._respond(client, '200 OK', 'application/json', body)
+        elif path == '/events':
+            client.kind = SSE
+            self._send(client, b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                               b'Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\nretry: 1000\n\n')
+            self._send_snapshot(client)
+        elif path == '/ws' and headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in headers:
+            accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + _WS_GUID).digest())
+            client.kind = WEBSOCKET
+            self._send(client, b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                               b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+            self._send_snapshot(client)
+            self._ws_frames(client)
+        else:
+            self._respond(client, '404 Not Found', 'text/plain', b'/events, /ws or /status\n')
+
+    def _respond(self, client, status, content_type, body):
+        client.kind = 'http'
+        client.closing = True
+        self._send(client, f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                           f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + body)
+
+    def _send_snapshot(self, client):
+        if client.sock.fileno() == -1:
+            return
+        client.seq, state = self.snapshot()
+        self._send(client, _message('snapshot', client.seq, state)[client.kind])
+
+    def _ws_frames(self, client):
+        buf = client.inbuf
+        while len(buf) >= 2 and client.sock.fileno() != -1:
+            opcode, length = buf[0] & 0x0f, buf[1] & 0x7f
+            offset = 2
+            if length == 126:
+                if len(buf) < 4:
+                    break
+                length, offset = struct.unpack_from('>H', buf, 2)[0], 4
+            elif length == 127:
+                if len(buf) < 10:
+                    break
+                length, offset = struct.unpack_from('>Q', buf, 2)[0], 10
+            masked = buf[1] & 0x80
+            end = offset + (4 if masked else 0) + length
+            if end > len(buf):
+                break
+            payload = buf[end - length:end]
+            if masked:
+                mask = buf[offset:offset + 4]
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+            buf = buf[end:]
+            if opcode == 0x8:
+                client.closing = True
+                self._send(client, ws_frame(payload[:2], 0x8))
+            elif opcode == 0x9:
+                self._send(client, ws_frame(payload, 0xA))
+            # Text, binary and pong frames from subscribers are ignored
+        client.inbuf = buf
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+streaming.py
+
+Streaming effects mode: MIDI notes, velocity and clock turned into light frames sent over UDP at
+a fixed rate, following the Hue Entertainment streaming model.
+
+EffectEngine keeps a small envelope per channel: a Note On hits the channel `note % channels`
+with its velocity and decays from there, and every quarter note of MIDI clock adds a short pulse
+to all channels. Streamer renders the engine into a preallocated "HueStream" v2 frame 25-50
+times per second and sends it to the receiver. Nothing is allocated per frame: the colour
+values, the packet buffer and the struct used to fill it are all created up front.
+
+Sent as plain UDP. A real bridge expects the stream inside a DTLS 1.2 (PSK) session on port
+2100 for an entertainment configuration that was started over the REST API first; the standard
+library has no DTLS, so that part is left to a proxy in front of the bridge.
+"""
+
+import array
+import logging
+import socket
+import struct
+import threading
+import time
+
+from midi_decoder import CLOCK, CONTINUE, NOTE_ON, START, STOP
+
+log = logging.getLogger('streaming')
+
+PROTOCOL = b'HueStream'
+VERSION = (2, 0)
+COLOUR_SPACE_RGB = 0
+HEADER_SIZE = 52  # protocol, version, sequence, reserved, colour space, reserved, 36 byte config id
+SEQUENCE_OFFSET = 11
+MAX_CHANNELS = 20
+CLOCKS_PER_BEAT = 24
+
+_CHANNEL = struct.Struct('>BHHH')  # channel id, red, green, blue (16 bit each)
+
+
+class FramePacker:
+    """One reusable HueStream v2 packet for a fixed set of entertainment channels."""
+
+    def __init__(self, entertainment_id, channel_ids):
+        if not 0 < len(channel_ids) <= MAX_CHANNELS:
+            raise ValueError(f"between 1 and {MAX_CHANNELS} channels per frame, got {len(channel_ids)}")
+        if len(entertainment_id) != 36 or not entertainment_id.isascii():
+            raise ValueError(f"ENTERTAINMENT_ID must be the 36 character id of the entertainment configuration, "
+                             f"got {entertainment_id!r}")
+        config_id = entertainment_id.encode('ascii')
+        self.channel_ids = tuple(channel_ids)
+        self.buffer = bytearray(HEADER_SIZE + _CHANNEL.size * len(channel_ids))
+        self.buffer[0:9] = PROTOCOL
+        self.buffer[9:11] = bytes(VERSION)
+        self.buffer[14] = COLOUR_SPACE_RGB
+        self.buffer[16:52] = config_id
+        self.offsets = tuple(HEADER_SIZE + _CHANNEL.size * i for i in range(len(channel_ids)))
+
+    def pack(self, sequence, values):
+        """Write the sequence number and `values` (r, g, b per channel) into the buffer."""
+        buffer = self.buffer
+        buffer[SEQUENCE_OFFSET] = sequence
+        pack_into = _CHANNEL.pack_into
+        i = 0
+        for channel_id, offset in zip(self.channel_ids, self.offsets):
+            pack_into(buffer, offset, channel_id, values[i], values[i + 1], values[i + 2])
+            i += 3
+        return buffer
+
+
+def parse_frame(data):
+    """Decode a HueStream v2 packet into (sequence, entertainment id, [(channel, r, g, b)])."""
+    if data[0:9] != PROTOCOL or tuple(data[9:11]) != VERSION:
+        raise ValueError('not a HueStream v2 packet')
+    channels = [_CHANNEL.unpack_from(data, offset) for offset in range(HEADER_SIZE, len(data), _CHANNEL.size)]
+    return data[SEQUENCE_OFFSET], data[16:52].decode('ascii'), channels
+
+
+class EffectEngine:
+    """Light levels per channel driven by MIDI notes, velocity and clock."""
+
+    def __init__(self, channels, colour=(1.0, 0.0, 0.0), decay=0.3, beat_level=0.35, beat_length=0.12):
+        self.channels = channels
+        self.colour = colour
+        self.decay = decay
+        self.beat_level = beat_level
+        self.beat_length = beat_length
+        self.hits = [0.0] * channels       # velocity of the last note per channel, 0-1
+        self.hit_times = [0.0] * channels  # when it was played (time.monotonic())
+        self.beat_time = None
+        self.clocks = 0
+        self.running = False
+
+    def feed(self, record, now):
+        """Take one decoded MIDI record received at `now` (time.monotonic() seconds)."""
+        kind = record[0]
+        if kind == NOTE_ON:
+            channel = record[2] % self.channels
+            self.hits[channel] = record[3] / 127.0
+            self.hit_times[channel] = now
+        elif kind == CLOCK:
+            if self.running:
+                self.clocks += 1
+                if self.clocks % CLOCKS_PER_BEAT == 0:
+                    self.beat_time = now
+        elif kind == START:
+            self.clocks = 0
+            self.running = True
+            self.beat_time = now
+        elif kind == CONTINUE:
+            self.running = True
+        elif kind == STOP:
+            self.running = False
+
+    def feed_batch(self, records, batch):
+        """Feed decoded records with the receive times of their dispatcher batch."""
+        for record in records:
+            self.feed(record, batch[record[4]][2] / 1e9)
+
+    def render(self, now, values):
+        """Write 16 bit r, g, b per channel for time `now` into `values`."""
+        beat = 0.0
+        if self.running and self.beat_time is not None and now - self.beat_time < self.beat_length:
+            beat = self.beat_level * (1.0 - (now - self.beat_time) / self.beat_length)
+        red, green, blue = self.colour
+        i = 0
+        for channel in range(self.channels):
+            level = self.hits[channel] * (1.0 - (now - self.hit_times[channel]) / self.decay)
+            level = beat + (level if level > 0.0 else 0.0)
+            scale = 65535.0 * (level if level < 1.0 else 1.0)
+            values[i] = int(red * scale)
+            values[i + 1] = int(green * scale)
+            values[i + 2] = int(blue * scale)
+            i += 3
+
+
+class Streamer:
+    """Render and send frames at a fixed rate from a background thread.
+
+    Frames are scheduled on absolute deadlines, so jitter in one frame does not shift the next.
+    When the thread falls more than a frame behind it skips ahead instead of bursting.
+    """
+
+    def __init__(self, host, port, engine, packer, rate=50.0):
+        if not 1 <= rate <= 60:
+            raise ValueError(f"frame rate must be 1-60 Hz, got {rate}")
+        self.address = (host, port)
+        self.engine = engine
+        self.packer = packer
+        self.period = 1.0 / rate
+        self.values = array.array('H', bytes(2 * 3 * len(packer.channel_ids)))
+        self.frames = 0
+        self.late = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._sock = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect(self.address)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='hue-stream', daemon=True)
+        self._thread.start()
+        log.info('Streaming effects to %s:%d at %.0f Hz', self.address[0], self.address[1], 1 / self.period)
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(2.0)
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _run(self):
+        engine, packer, values, sock = self.engine, self.packer, self.values, self._sock
+        period = self.period
+        sequence = 0
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = time.monotonic()
+            engine.render(now, values)
+            try:
+                sock.send(packer.pack(sequence, values))
+            except OSError as e:
+                # Nobody listening (ICMP port unreachable) or the network is down, keep the beat
+                self.errors += 1
+                if self.errors == 1:
+                    log.warning('Streaming to %s:%d failed: %s', self.address[0], self.address[1], e)
+            sequence = (sequence + 1) & 0xFF
+            self.frames += 1
+            deadline += period
+            if now - deadline > period:
+                self.late += 1
+                deadline = now + period
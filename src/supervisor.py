@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""
+supervisor.py
+
+Supervised mode: keep the recording light and the MIDI inputs going through outages.
+
+SupervisedSink sits in front of a sink such as the Hue recording lights. When the sink fails,
+it is marked down and later recording changes are only buffered (up to a limit) instead of
+each waiting for the dead sink; a recovery thread retries with exponential backoff and jitter.
+On recovery the sink gets the current recording state once, not every toggle it missed.
+reconcile() applies the current state again when the sink may have lost it, e.g. after a
+bridge reboot.
+
+PortWatcher checks the MIDI input ports every few seconds and reopens ports that disappeared
+(Logic quit, an interface was unplugged) or never opened, with the same kind of backoff.
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger('supervisor')
+
+
+class Backoff:
+    """Exponential delays from `initial` up to `maximum`, each cut randomly by up to `jitter`.
+
+    The jitter keeps several clients that lost the same device from retrying in lockstep.
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.5, rng=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1.0 - self.jitter * self.rng.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+class SupervisedSink:
+    """Apply recording states to a sink, buffering while it is down and reconciling on recovery.
+
+    `apply(recording, context)` returns False or raises when the sink did not take the state.
+    """
+
+    def __init__(self, name, apply, backoff=None, buffer=64):
+        self.name = name
+        self.apply = apply
+        self.backoff = backoff or Backoff()
+        self.up = True
+        self.wanted = None  # the latest recording state asked for
+        self.buffer = collections.deque(maxlen=buffer)  # (recording, time) of changes while down
+        self.failures = 0
+        self.outages = 0
+        self.buffered = 0
+        self.overflowed = 0
+        self.recoveries = collections.deque(maxlen=100)  # (seconds down, changes buffered)
+        self._down_since = None
+        self._lock = threading.Lock()
+        # One application at a time, so an older state can never land after a newer one
+        self._apply_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def set(self, recording, context=None):
+        """Apply `recording` now if the sink is up; returns False when it was buffered instead."""
+        with self._lock:
+            self.wanted = recording
+            if not self.up:
+                self._buffer(recording)
+                return False
+        if self._sync(context):
+            return True
+        self._mark_down()
+        return False
+
+    def reconcile(self):
+        """Apply the current state again, or retry at once when the sink is down."""
+        with self._lock:
+            if self.wanted is None:
+                return
+            if not self.up:
+                self._wake.set()
+                return
+        if not self._sync():
+            self._mark_down()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'up': self.up,
+                'failures': self.failures,
+                'outages': self.outages,
+                'buffered': self.buffered,
+                'overflowed': self.overflowed,
+                'waiting': len(self.buffer),
+            }
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(2.0)
+
+    def _sync(self, context=None):
+        with self._apply_lock:
+            with self._lock:
+                recording = self.wanted
+            try:
+                return self.apply(recording, context) is not False
+            except Exception:
+                log.exception('%s: applying recording state %s failed', self.name, recording)
+                return False
+
+    def _buffer(self, recording):
+        # Called with the state lock held
+        if len(self.buffer) == self.buffer.maxlen:
+            self.overflowed += 1
+        self.buffer.append((recording, time.monotonic()))
+        self.buffered += 1
+
+    def _mark_down(self):
+        with self._lock:
+            self.failures += 1
+            if not self.up:
+                return
+            self.up = False
+            self.outages += 1
+            self._down_since = time.monotonic()
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._recover, name=f"recover-{self.name}", daemon=True)
+            self._thread.start()
+        log.warning('%s is down, buffering recording changes', self.name)
+
+    def _recover(self):
+        self.backoff.reset()
+        while not self._closed.is_set():
+            self._wake.wait(self.backoff.next())
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            with self._lock:
+                wanted = self.wanted
+            if not self._sync():
+                with self._lock:
+                    self.failures += 1
+                continue
+            with self._lock:
+                if self.wanted != wanted:
+                    # Changed while we were applying: go again straight away
+                    self._wake.set()
+                    continue
+                self.up = True
+                missed = len(self.buffer)
+                self.buffer.clear()
+                downtime = time.monotonic() - self._down_since
+                self.recoveries.append((downtime, missed))
+                self._thread = None
+            log.info('%s is back after %.1f s, reconciled to recording=%s (%d buffered changes)',
+                     self.name, downtime, wanted, missed)
+            return
+
+
+class PortWatcher:
+    """Reopen MIDI input ports that disappear.
+
+    `inputs` is the daemon's list of (midiin, port name) per source number, updated in place;
+    a port that is not open has None for midiin. `open_port(name)` returns (midiin, actual name)
+    or raises, `attach(midiin, source)` connects a reopened port. Ports are reopened by the name
+    they had when the watcher started.
+    """
+
+    def __init__(self, inputs, open_port, attach, interval=2.0, backoff=None):
+        self.inputs = inputs
+        self.names = [name for _, name in inputs]
+        self.open_port = open_port
+        self.attach = attach
+        self.interval = interval
+        self.backoff = backoff or (lambda: Backoff(interval, 60.0))
+        self.lost = 0
+        self.reopened = 0
+        self._retry = {}  # source -> (Backoff, next attempt)
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, name='port-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def check(self):
+        """Look at every port once: notice missing ones, reopen those that are due."""
+        now = time.monotonic()
+        for source, (midiin, name) in enumerate(self.inputs):
+            if midiin is not None:
+                try:
+                    present = name in midiin.get_ports()
+                except Exception:
+                    present = False
+                if present:
+                    continue
+                log.warning('MIDI input port %s disappeared', name)
+                self.lost += 1
+                midiin.cancel_callback()
+                midiin.close_port()
+                self.inputs[source] = (None, name)
+                self._retry[source] = (self.backoff(), now)
+            backoff, due = self._retry.setdefault(source, (self.backoff(), now))
+            if now < due:
+                continue
+            try:
+                midiin, actual = self.open_port(self.names[source])
+            except Exception as e:
+                self._retry[source] = (backoff, now + backoff.next())
+                log.debug('MIDI input port %s not available: %s', self.names[source], e)
+                continue
+            self.attach(midiin, source)
+            self.inputs[source] = (midiin, actual)
+            del self._retry[source]
+            self.reopened += 1
+            log.info('MIDI input port %s reopened', actual)
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.check()
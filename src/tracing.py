@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+tracing.py
+
+Per-event latency tracing for the MIDI to light pipeline.
+
+Every MIDI message gets a Trace when the rtmidi callback sees it. The pipeline marks the stages
+it passes (parse, decision, Hue request sent/acknowledged, Awtrix call) with time.monotonic_ns().
+When the last part of the event is done the stage times, relative to receive, go into histograms
+and, optionally, one JSON line per event into a trace file written by a background thread.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger('tracing')
+
+_STOP = object()
+
+
+class Trace:
+    """Stage timestamps of one MIDI event.
+
+    The trace is finished when release() has been called once more than hold(): the dispatcher
+    holds one reference, asynchronous work such as the Awtrix call takes another.
+    """
+
+    __slots__ = ('tracer', 'event_id', 'stages', 'outcome', 'refs')
+
+    def __init__(self, tracer, event_id, received_ns):
+        self.tracer = tracer
+        self.event_id = event_id
+        self.stages = [('receive', received_ns)]
+        self.outcome = None
+        self.refs = 1
+
+    def mark(self, stage, ns=None):
+        self.stages.append((stage, ns or time.monotonic_ns()))
+
+    def hold(self):
+        with self.tracer.lock:
+            self.refs += 1
+
+    def settle(self, outcome):
+        """Record how the event ended, unless that was decided already; the first outcome wins."""
+        if outcome and self.outcome is None:
+            self.outcome = outcome
+
+    def release(self, outcome=None):
+        self.settle(outcome)
+        with self.tracer.lock:
+            self.refs -= 1
+            done = self.refs == 0
+        if done:
+            self.tracer.finish(self)
+
+
+class Tracer:
+    """Create traces and turn finished ones into metrics and an optional JSON-lines dump."""
+
+    def __init__(self, registry, dump_path=None):
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.events = registry.counter('lp2hue_midi_events_total', 'MIDI events by outcome', 'outcome')
+        self.stage_seconds = registry.histogram(
+            'lp2hue_stage_seconds', 'Time from MIDI receive until the event reached a stage', 'stage')
+        self.hue_seconds = registry.histogram(
+            'lp2hue_hue_request_seconds', 'Time from sending the Hue request until the bridge acknowledged it')
+        self.awtrix_seconds = registry.histogram(
+            'lp2hue_awtrix_request_seconds', 'Time from queueing the Awtrix call until the clock answered')
+        self.dump_path = dump_path
+        self._dump = None
+        self._thread = None
+
+    def start(self, received_ns):
+        return Trace(self, next(self._ids), received_ns)
+
+    def open_dump(self):
+        """Start the background writer for the JSON-lines trace file, if one is configured."""
+        if self.dump_path and self._thread is None:
+            self._dump = queue.Queue(4096)
+            self._thread = threading.Thread(target=self._write, args=(self._dump,), name='trace-dump', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            # Traces finished from now on only go to the metrics, not to a writer that is gone
+            dump, self._dump = self._dump, None
+            dump.put(_STOP)
+            self._thread.join(2.0)
+            self._thread = None
+
+    def finish(self, trace):
+        start = trace.stages[0][1]
+        times = dict(trace.stages)
+        for stage, ns in trace.stages[1:]:
+            self.stage_seconds.observe((ns - start) / 1e9, stage)
+        if 'hue_sent' in times and 'hue_ack' in times:
+            self.hue_seconds.observe((times['hue_ack'] - times['hue_sent']) / 1e9)
+        if 'awtrix_queued' in times and 'awtrix_ack' in times:
+            self.awtrix_seconds.observe((times['awtrix_ack'] - times['awtrix_queued']) / 1e9)
+        self.events.inc(label_value=trace.outcome or 'ignored')
+        if self._dump is not None:
+            try:
+                self._dump.put_nowait(trace)
+            except queue.Full:
+                pass
+
+    def _write(self, dump):
+        with open(self.dump_path, 'a') as f:
+            while True:
+                trace = dump.get()
+                if trace is _STOP:
+                    return
+                start = trace.stages[0][1]
+                f.write(json.dumps({
+                    'event': trace.event_id,
+                    'outcome': trace.outcome or 'ignored',
+                    'receive_ns': start,
+                    'stages_us': {stage: (ns - start) // 1000 for stage, ns in trace.stages[1:]},
+                }) + '\n')
+                if dump.empty():
+                    f.flush()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+webhook.py
+
+Fire-and-forget webhook calls for rule actions.
+
+Calls are queued and sent by a background worker over one keep-alive HTTP session, so a slow
+endpoint never holds up the MIDI dispatcher.
+"""
+
+import logging
+import queue
+import threading
+
+log = logging.getLogger('webhook')
+
+_STOP = object()
+
+
+class WebhookClient:
+    """Send queued HTTP requests from a background thread."""
+
+    def __init__(self, timeout=2.0, maxsize=64):
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='webhook', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def call(self, method, url, body=None):
+        """Queue a request; `body` is sent as JSON when given."""
+        try:
+            self.queue.put_nowait((method, url, body))
+        except queue.Full:
+            self.dropped += 1
+            log.warning('Webhook queue full, dropped %s %s', method, url)
+
+    def _run(self):
+        # The session and requests itself are set up here, off the thread that starts the daemon
+        import requests
+        session = requests.Session()
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                session.close()
+                return
+            method, url, body = item
+            try:
+                response = session.request(method, url, json=body, timeout=self.timeout)
+                response.raise_for_status()
+                self.sent += 1
+            except requests.RequestException as e:
+                self.failed += 1
+                log.error('Webhook %s %s failed: %s', method, url, e)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+bench_bridges.py
+
+Measure the recording-light fan-out across several bridges, against local fake bridges.
+
+Every bridge takes about 10 light commands per second (the fake answers more with HTTP 429),
+so the schedulers pace each bridge at that rate. The same lamps are switched as if they all
+hung on one bridge, bridge by bridge, and on all bridges at once through BridgeFanout; the
+report shows the time until the last lamp changed. Then the whole daemon is started with a
+[Bridges] registry and "bridge/light" addressed lamps, and record toggles are timed from the
+MIDI note until every lamp on every bridge has switched.
+
+Usage: python tools/bench_bridges.py [--bridges N] [--lights N] [--latency MS] [--rounds N]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import load_app, percentile
+from fakes import FakeHueBridge, FakeMidiIn
+from hue_client import HueClient
+from light_dispatch import BridgeFanout, LightDispatcher
+from scheduler import CommandScheduler
+
+
+def all_changed(bridges, on, since):
+    return all(light['state']['on'] == on and bridge.changed.get(light_id, 0) >= since
+               for bridge in bridges for light_id, light in bridge.lights.items())
+
+
+def wait_all(bridges, on, since, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not all_changed(bridges, on, since):
+        if time.monotonic() > deadline:
+            raise RuntimeError('not every lamp followed')
+        time.sleep(0.0005)
+    return max(bridge.changed[light_id] for bridge in bridges for light_id in bridge.lights) - since
+
+
+def fanout(args):
+    """Time until the last lamp changed: one bridge, bridge by bridge, all bridges at once."""
+    total = args.bridges * args.lights
+    single = FakeHueBridge(total, latency=args.latency / 1000.0, rate_limit=10).start()
+    shards = [FakeHueBridge(args.lights, latency=args.latency / 1000.0, rate_limit=10).start()
+              for _ in range(args.bridges)]
+    schedulers = []
+
+    def dispatcher(bridge, count):
+        # The rates get_scheduler() uses for the daemon
+        scheduler = CommandScheduler(HueClient(bridge.host, bridge.username, pool_size=8))
+        schedulers.append(scheduler)
+        return LightDispatcher(scheduler, range(1, count + 1))
+
+    one = dispatcher(single, total)
+    each = {f"b{i + 1}": dispatcher(bridge, args.lights) for i, bridge in enumerate(shards)}
+    parallel = BridgeFanout(each)
+
+    def in_turn(state):
+        return all([light_dispatcher.apply(state) for light_dispatcher in each.values()])
+
+    modes = (
+        (f"one bridge, {total} lamps", [single], one.apply),
+        (f"{args.bridges} bridges in turn", shards, in_turn),
+        (f"{args.bridges} bridges at once", shards, parallel.apply),
+    )
+    results = []
+    for name, bridges, switch in modes:
+        times = []
+        for i in range(args.rounds):
+            # Let the token buckets fill up again, as between two record presses
+            time.sleep(total / 10.0 + 0.5 if len(bridges) == 1 else args.lights / 10.0 + 0.5)
+            on = i % 2 == 0
+            since = time.monotonic()
+            switch({'on': on})
+            times.append(wait_all(bridges, on, since) * 1000)
+        rejected = sum(bridge.rejected for bridge in bridges)
+        results.append((name, times, rejected))
+    for scheduler in schedulers:
+        scheduler.close()
+    for bridge in [single] + shards:
+        bridge.stop()
+    return results
+
+
+def daemon(args):
+    """Record toggles through the whole daemon, with lamps on every bridge."""
+    app = load_app()
+    bridges = [FakeHueBridge(args.lights, latency=args.latency / 1000.0, rate_limit=10).start()
+               for _ in range(args.bridges)]
+    first = bridges[0]
+    app.BRIDGE_IP, app.USERNAME, app.AWTRIX_HOST = first.host, first.username, ''
+    app.EVENT_STREAM_URL = f"http://{first.host}/eventstream/clip/v2"
+    app.BRIDGES = {f"b{i}": [bridge.host, bridge.username, f"http://{bridge.host}/eventstream/clip/v2"]
+                   for i, bridge in enumerate(bridges[1:], 2)}
+    app.LIGHT_IDS = list(range(1, args.lights + 1)) + [f"b{i}/{light_id}" for i in range(2, args.bridges + 1)
+                                                       for light_id in range(1, args.lights + 1)]
+    app.ROOMS = []
+    midiin = FakeMidiIn('Bridges Virtual Out')
+    inputs = [(midiin, midiin.port_name)]
+    dispatcher = app.start(inputs)
+    for light_mirror in app.mirrors:
+        light_mirror.wait_live()
+    times = []
+    try:
+        on = not first.lights['1']['state']['on']
+        for i in range(args.rounds):
+            time.sleep(args.lights / 10.0 + 0.5)
+            since = time.monotonic()
+            midiin.send([0x90, 24, 127 if on else 0])
+            times.append(wait_all(bridges, on, since) * 1000)
+            on = not on
+        used = sorted(app.hue_schedulers)
+    finally:
+        app.stop(inputs, dispatcher)
+        for bridge in bridges:
+            bridge.stop()
+    return times, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--bridges', type=int, default=4)
+    parser.add_argument('--lights', type=int, default=12, help='lamps per bridge')
+    parser.add_argument('--latency', type=float, default=20.0, help='fake bridge response time in ms')
+    parser.add_argument('--rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{args.bridges} bridges x {args.lights} lamps, {args.latency:.0f} ms latency, 10 commands/s per bridge")
+    print(f"{'fan-out':<28}{'p50 ms':>10}{'max ms':>10}{'429s':>6}")
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        results = fanout(args)
+    for name, times, rejected in results:
+        print(f"{name:<28}{percentile(times, 50):>10.1f}{max(times):>10.1f}{rejected:>6}")
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        times, used = daemon(args)
+    print(f"{'daemon, note to last lamp':<28}{percentile(times, 50):>10.1f}{max(times):>10.1f}"
+          f"      (schedulers: {', '.join(used)})")
+
+
+if __name__ == "__main__":
+    main()
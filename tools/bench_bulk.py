@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+bench_bulk.py
+
+Time "all lights off" for N lights against the fake bridge: the old hue_controller loop
+(fetch /lights, then one unpooled requests.put per light, one after the other) against the
+HueController bulk API, per light in parallel, as one room action and as one group 0 action.
+
+Runs twice: with the fake bridge refusing writes above its rate limit, as a real bridge does,
+and without any limit to show the raw gain of parallel requests.
+
+Usage: python tools/bench_bulk.py [--lights N] [--latency MS] [--rate-limit N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeHueBridge
+from hue_client import HueClient
+from hue_controller import HueController, Inventory
+from scheduler import CommandScheduler
+
+
+def old_loop(bridge, light_ids):
+    """What turn_on_off_lights() did before: sequential requests without a session."""
+    base = f"http://{bridge.host}/api/{bridge.username}"
+    requests.get(f"{base}/lights").json()
+    failed = []
+    for light_id in light_ids:
+        response = requests.put(f"{base}/lights/{light_id}/state", json={'on': False})
+        if response.status_code != 200 or any('error' in item for item in response.json()):
+            failed.append(light_id)
+    return failed
+
+
+def run(name, args, rate_limit, action):
+    bridge = FakeHueBridge(args.lights, groups={'Studio': range(1, args.lights + 1)},
+                           latency=args.latency / 1000.0, rate_limit=rate_limit).start()
+    for light in bridge.lights.values():
+        light['state']['on'] = True
+    client = HueClient(bridge.host, bridge.username, pool_size=args.lights)
+    # The scheduler is told the bridge's limits; without a limit it may go as fast as it likes
+    rate = rate_limit or 1000
+    scheduler = CommandScheduler(client, light_rate=rate, group_rate=rate_limit / 10 if rate_limit else rate,
+                                 bridge_rate=rate, max_workers=args.lights)
+    controller = HueController(scheduler, Inventory(client))
+    light_ids = [str(i) for i in range(1, args.lights + 1)]
+
+    start = time.perf_counter()
+    failed = action(bridge, controller, light_ids)
+    elapsed = time.perf_counter() - start
+    still_on = sum(1 for light in bridge.lights.values() if light['state']['on'])
+    requests_sent = len(bridge.requests)
+    scheduler.close()
+    bridge.stop()
+    print(f"{name:<28}{elapsed * 1000:>9.0f}{requests_sent:>10}{len(failed):>8}{still_on:>10}")
+
+
+ACTIONS = (
+    ('old sequential loop', lambda bridge, controller, light_ids: old_loop(bridge, light_ids)),
+    ('bulk, parallel per light', lambda bridge, controller, light_ids: controller.set_lights(light_ids, {'on': False})),
+    ('bulk, room action', lambda bridge, controller, light_ids: controller.set_room('Studio', {'on': False})),
+    ('bulk, all lights (group 0)', lambda bridge, controller, light_ids: controller.set_all({'on': False})),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--lights', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=20.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=10, help='light writes per second the fake bridge accepts')
+    args = parser.parse_args()
+
+    for rate_limit in (args.rate_limit, None):
+        print(f"\n{args.lights} lights, {args.latency:.0f} ms per request, "
+              f"{f'bridge limit {rate_limit}/s' if rate_limit else 'no rate limit'}")
+        print(f"{'action':<28}{'ms':>9}{'requests':>10}{'failed':>8}{'still on':>10}")
+        for name, action in ACTIONS:
+            run(name, args, rate_limit, action)
+
+
+if __name__ == '__main__':
+    main()
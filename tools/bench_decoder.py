@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+bench_decoder.py
+
+Microbenchmark: messages per second for the table-driven MidiDecoder against the per-message
+parse_midi_message() the dispatcher used before, on its own and together with the timestamp
+formatting and print the old handler did for every event.
+
+Two streams are decoded: plain 3-byte Note On/Off messages (the only thing the old parser
+understood) and a mixed stream with clock, control changes, running status and SysEx, as Logic
+sends it while playing back.
+
+Usage: python tools/bench_decoder.py [--messages N] [--batch N] [--repeat N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from midi_decoder import KIND_NAMES, MidiDecoder
+
+
+def parse_midi_message(message):
+    """The parser used before, kept here as the baseline."""
+    status_byte = message[0]
+    channel = (status_byte & 0x0F) + 1
+    msg_type = status_byte & 0xF0
+    note = message[1]
+    velocity = message[2]
+    if msg_type == 0x90:
+        if velocity > 0:
+            return "Note On ", channel, note, velocity
+        else:
+            return "Note Off", channel, note, 0
+    elif msg_type == 0x80 or (msg_type == 0x90 and velocity == 0):
+        return "Note Off", channel, note, velocity
+    else:
+        return None, None, None, None
+
+
+def format_timestamp(timer):
+    return time.strftime("%H:%M:%S", time.localtime(timer)) + f".{int((timer % 1) * 1000):03d}"
+
+
+def note_stream(count, rng):
+    messages = []
+    for _ in range(count):
+        status = rng.choice((0x80, 0x90)) | rng.randrange(16)
+        messages.append([status, rng.randrange(128), rng.randrange(128)])
+    return messages
+
+
+def mixed_stream(count, rng):
+    messages = []
+    while len(messages) < count:
+        roll = rng.random()
+        if roll < 0.5:
+            messages.append([0xF8])  # clock, 24 per quarter note
+        elif roll < 0.75:
+            messages.append([0x90 | rng.randrange(16), rng.randrange(128), rng.randrange(128)])
+        elif roll < 0.9:
+            messages.append([0xB0 | rng.randrange(16), rng.randrange(120), rng.randrange(128)])
+        elif roll < 0.97:
+            # Running status: two notes behind one status byte
+            messages.append([0x90, rng.randrange(128), 100, rng.randrange(128), 0])
+        else:
+            messages.append([0xF0, 0x7E, 0x7F, 0x06, 0x01, 0xF7])
+    return messages
+
+
+def batches(messages, size):
+    return [messages[i:i + size] for i in range(0, len(messages), size)]
+
+
+def run_old(messages, size):
+    start = time.perf_counter()
+    for batch in batches(messages, size):
+        for message in batch:
+            if len(message) >= 3:
+                parse_midi_message(message)
+    return time.perf_counter() - start
+
+
+def run_old_printing(messages, size):
+    # What handle_midi_message() did per event, printed to /dev/null
+    timer = time.time()
+    with open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        for batch in batches(messages, size):
+            for message in batch:
+                if len(message) >= 3:
+                    msg_type, channel, note, velocity = parse_midi_message(message)
+                    print(f"[port] {format_timestamp(timer)} {msg_type} - Channel: {channel}, Note: {note}, Velocity: {velocity}", file=devnull)
+        return time.perf_counter() - start
+
+
+def run_new(messages, size):
+    decoder = MidiDecoder()
+    out = []
+    start = time.perf_counter()
+    for batch in batches(messages, size):
+        out.clear()
+        decoder.decode_batch(batch, out)
+    return time.perf_counter() - start
+
+
+def best_rate(run, messages, size, repeat):
+    return len(messages) / min(run(messages, size) for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=64, help='messages per dispatcher batch')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'stream':8} {'decoder':20} {'msg/s':>12}")
+    for name, messages in (('notes', note_stream(args.messages, rng)), ('mixed', mixed_stream(args.messages, rng))):
+        old = best_rate(run_old, messages, args.batch, args.repeat)
+        printing = best_rate(run_old_printing, messages, args.batch, args.repeat)
+        new = best_rate(run_new, messages, args.batch, args.repeat)
+        print(f"{name:8} {'parse_midi_message':20} {old:12,.0f}")
+        print(f"{name:8} {'  + format and print':20} {printing:12,.0f}")
+        print(f"{name:8} {'MidiDecoder batch':20} {new:12,.0f}  ({new / old:.2f}x parse, {new / printing:.1f}x with print)")
+    print("parse_midi_message skips everything shorter than 3 bytes and only tells notes apart.")
+
+    # The mixed stream also shows what the old parser could not see
+    kinds = {}
+    for kind, *_ in MidiDecoder().decode_batch(mixed_stream(2000, random.Random(1))):
+        kinds[KIND_NAMES[kind]] = kinds.get(KIND_NAMES[kind], 0) + 1
+    print('mixed stream records:', ', '.join(f"{name.strip()} {count}" for name, count in sorted(kinds.items())))
+
+
+if __name__ == '__main__':
+    main()
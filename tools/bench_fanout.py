@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+bench_fanout.py
+
+Measure how long it takes until every recording lamp has changed, against a local fake bridge.
+
+Compares switching the lamps one after the other, parallel per-light requests through
+LightDispatcher, and a single room action.
+
+Usage: python tools/bench_fanout.py [--lights N] [--latency SECONDS] [--rounds N]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeHueBridge
+from hue_client import HueClient
+from light_dispatch import LightDispatcher
+from scheduler import CommandScheduler
+
+
+def time_until_all_changed(bridge, light_ids, switch):
+    bridge.changed.clear()
+    start = time.monotonic()
+    switch()
+    return max(bridge.changed[str(light_id)] for light_id in light_ids) - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--lights', type=int, default=8, help='number of lamps in the studio')
+    parser.add_argument('--latency', type=float, default=0.02, help='bridge response time in seconds')
+    parser.add_argument('--rounds', type=int, default=10, help='on/off rounds per mode')
+    args = parser.parse_args()
+
+    light_ids = list(range(1, args.lights + 1))
+    # 'Studio' holds all lamps; the loose-light dispatcher must not find it, so it lives on a second bridge
+    with FakeHueBridge(args.lights, latency=args.latency) as plain, \
+            FakeHueBridge(args.lights, groups={'Studio': light_ids}, latency=args.latency) as grouped:
+        plain_client = HueClient(plain.host, plain.username, pool_size=args.lights)
+        grouped_client = HueClient(grouped.host, grouped.username, pool_size=args.lights)
+
+        def sequential(state):
+            for light_id in light_ids:
+                plain_client.set_light_state(light_id, state)
+
+        # No pacing here: this measures the fan-out itself, not the bridge rate limits
+        plain_scheduler = CommandScheduler(plain_client, light_rate=1000, bridge_rate=1000, max_workers=args.lights)
+        grouped_scheduler = CommandScheduler(grouped_client, group_rate=1000, bridge_rate=1000)
+        parallel = LightDispatcher(plain_scheduler, light_ids)
+        room = LightDispatcher(grouped_scheduler, rooms=['Studio'])
+        # Map rooms to groups up front, as the daemon's warm-up does
+        parallel.resolve()
+        room.resolve()
+        modes = (
+            ('sequential', plain, sequential),
+            ('parallel', plain, parallel.apply),
+            ('group', grouped, room.apply),
+        )
+
+        print(f"{args.lights} lamps, {args.latency * 1000:.0f} ms bridge latency, {args.rounds} rounds")
+        print(f"{'mode':<12}{'median ms':>12}{'max ms':>10}{'requests':>10}")
+        for name, bridge, switch in modes:
+            switch({'on': False})  # warm up connections
+            before = len(bridge.requests)
+            times = []
+            for i in range(args.rounds):
+                state = {'on': i % 2 == 0}
+                times.append(time_until_all_changed(bridge, light_ids, lambda: switch(state)))
+            requests_per_round = (len(bridge.requests) - before) / args.rounds
+            print(f"{name:<12}{statistics.median(times) * 1000:>12.1f}{max(times) * 1000:>10.1f}{requests_per_round:>10.1f}")
+
+        plain_scheduler.close()
+        grouped_scheduler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+bench_logging.py
+
+Measure what logging costs the MIDI path: the old synchronous file handler against the queue
+handler with its background JSON-lines writer, with and without sampling of DEBUG records.
+
+First the cost of a single log call on the calling thread, then the pipeline under MIDI bursts
+against the fake bridge: how long the dispatcher spends per message (at DEBUG every message is
+logged), the longest batch, and the note-to-light latency of single record toggles, whose
+"Recording started" and "Set lights" lines are logged on the way to the bridge.
+
+Usage: python tools/bench_logging.py [--calls N] [--bursts N] [--toggles N] [--level INFO|DEBUG]
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import Run, load_app, percentile
+from log_writer import TEXT_FORMAT, LogWriter
+
+MODES = ('sync file', 'queue + JSON', 'queue + JSON, sampled')
+
+
+def use_logging(mode, path, level):
+    """Replace the root logger's handlers; returns the LogWriter, or None for the sync handler."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+    if mode == 'sync file':
+        # What logging.basicConfig(filename=...) did: format and write on the caller's thread
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        return None
+    return LogWriter(path, level, sample=100 if mode.endswith('sampled') else 1).install()
+
+
+def call_cost(mode, path, calls, level):
+    """Microseconds per log call on the calling thread."""
+    writer = use_logging(mode, path, level)
+    if writer:
+        writer.start()
+    log = logging.getLogger('bench')
+    state = {'on': True, 'bri': 254, 'hue': 0, 'sat': 254}
+    costs = []
+    log_call = log.debug if level == logging.DEBUG else log.info
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        log_call('Set light with ID: %s to state: %s', i % 8, state, extra={'event': 'light.set'})
+        costs.append((time.perf_counter_ns() - start) / 1000)
+    start = time.perf_counter()
+    if writer:
+        writer.stop()
+    return costs, time.perf_counter() - start
+
+
+def pipeline(app, args, mode, path, level):
+    writer = use_logging(mode, path, level)
+    if writer:
+        app.log_writer = writer
+    rng = random.Random(7)
+    costs = []
+    longest = 0
+    toggles = []
+    with Run(app, args) as run:
+        handle_batch = run.dispatcher.handler
+
+        def timed_batch(batch):
+            nonlocal longest
+            start = time.perf_counter_ns()
+            handle_batch(batch)
+            took = time.perf_counter_ns() - start
+            costs.append(took / 1000 / len(batch))
+            longest = max(longest, took / 1e6)
+
+        run.dispatcher.handler = timed_batch
+        for i in range(args.bursts):
+            # A busy keyboard part with the record button flapping in between
+            for _ in range(200):
+                if rng.random() < 0.05:
+                    run.midiin.send([0x90, 24, 127 if rng.random() < 0.5 else 0])
+                else:
+                    run.midiin.send([0x90, rng.randrange(36, 84), rng.randrange(1, 128)])
+            time.sleep(0.02)
+        time.sleep(0.5)
+        run.dispatcher.handler = handle_batch
+        # The bursts leave the light either way, start by switching it over
+        on = not run.bridge.lights['1']['state']['on']
+        for i in range(args.toggles):
+            toggles.append(run.toggle(on) * 1000)
+            on = not on
+            time.sleep(0.15)
+        dropped = run.dispatcher.dropped
+    lines = sum(1 for name in os.listdir(os.path.dirname(path)) for _ in open(os.path.join(os.path.dirname(path), name)))
+    return costs, longest, toggles, dropped, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--bursts', type=int, default=50, help='bursts of 200 MIDI messages')
+    parser.add_argument('--toggles', type=int, default=20)
+    parser.add_argument('--level', default='DEBUG', choices=('INFO', 'DEBUG'))
+    parser.add_argument('--latency', type=float, default=5.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=10, help='writes per second the fake bridge accepts')
+    args = parser.parse_args()
+    level = getattr(logging, args.level)
+    workdir = tempfile.mkdtemp(prefix='lp2hue-logbench-')
+
+    print(f"cost of one {args.level} call on the caller's thread, {args.calls} calls")
+    print(f"{'mode':<24}{'p50 us':>9}{'p99 us':>9}{'max us':>10}{'drain ms':>10}")
+    for mode in MODES:
+        path = os.path.join(workdir, f"calls-{MODES.index(mode)}.log")
+        costs, drain = call_cost(mode, path, args.calls, level)
+        print(f"{mode:<24}{percentile(costs, 50):>9.1f}{percentile(costs, 99):>9.1f}{max(costs):>10.1f}"
+              f"{drain * 1000:>10.1f}")
+
+    app = load_app()
+    print(f"\npipeline at {args.level}: {args.bursts} bursts of 200 messages, then {args.toggles} record toggles")
+    print(f"{'mode':<24}{'us/msg p50':>11}{'p99':>8}{'batch max ms':>14}{'toggle p50 ms':>15}{'p99 ms':>9}"
+          f"{'lines':>8}{'dropped':>9}")
+    for mode in MODES:
+        logdir = os.path.join(workdir, f"pipeline-{MODES.index(mode)}")
+        os.mkdir(logdir)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            costs, longest, toggles, dropped, lines = pipeline(app, args, mode, os.path.join(logdir, 'app.log'), level)
+        print(f"{mode:<24}{percentile(costs, 50):>11.1f}{percentile(costs, 99):>8.1f}{longest:>14.2f}"
+              f"{percentile(toggles, 50):>15.2f}{percentile(toggles, 99):>9.2f}{lines:>8}{dropped:>9}")
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
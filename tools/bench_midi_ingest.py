@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+bench_midi_ingest.py
+
+Compare the old 10 ms sleep-poll loop with the callback-driven MidiDispatcher.
+
+For each mode it reports the CPU time burned while no MIDI arrives and the p50/p99 delay between
+a message arriving on the (fake) port and the handler seeing it.
+
+Usage: python tools/bench_midi_ingest.py [--idle SECONDS] [--events N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeMidiIn
+from midi_input import MidiDispatcher
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class PollLoop:
+    """The ingestion loop main() used before: get_message() followed by a 10 ms sleep."""
+
+    def __init__(self, midiin, handler):
+        self.midiin = midiin
+        self.handler = handler
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def _run(self):
+        while self.running:
+            msg = self.midiin.get_message()
+            if msg:
+                message, deltatime = msg
+                self.handler([(message, deltatime, None)])
+            time.sleep(0.01)
+
+
+def run_mode(mode, idle_seconds, events):
+    midiin = FakeMidiIn()
+    sent = []
+    delays = []
+    done = threading.Event()
+
+    def handler(batch):
+        now = time.monotonic()
+        for _ in batch:
+            delays.append(now - sent[len(delays)])
+        if len(delays) == events:
+            done.set()
+
+    if mode == 'poll':
+        runner = PollLoop(midiin, handler)
+    else:
+        runner = MidiDispatcher(handler)
+        runner.attach(midiin)
+    runner.start()
+
+    # Idle phase: nothing arrives, only the ingestion machinery runs
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / idle_seconds * 100
+
+    # Event phase: note 24 on/off with irregular gaps, like a record-arm toggle
+    rng = random.Random(1)
+    for i in range(events):
+        sent.append(time.monotonic())
+        midiin.send([0x90, 24, 127 if i % 2 == 0 else 0])
+        time.sleep(rng.uniform(0.001, 0.02))
+    done.wait(5)
+    runner.stop()
+    return idle_cpu, delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--idle', type=float, default=3.0, help='idle measurement time in seconds')
+    parser.add_argument('--events', type=int, default=200, help='number of MIDI events to send')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'idle CPU %':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for mode in ('poll', 'callback'):
+        idle_cpu, delays = run_mode(mode, args.idle, args.events)
+        print(f"{mode:<10}{idle_cpu:>12.3f}{percentile(delays, 50) * 1000:>10.3f}"
+              f"{percentile(delays, 99) * 1000:>10.3f}{max(delays) * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
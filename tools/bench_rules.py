@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+bench_rules.py
+
+Benchmark the compiled rule table against a linear scan over the rules, for rule files with
+thousands of rules, and check that hot reloading never makes an event miss its rules.
+
+For each size it reports the compile time and the cost of matching one decoded MIDI record.
+The reload check keeps matching records on one thread while another rewrites the rules file.
+
+Usage: python tools/bench_rules.py [--sizes 10,1000,5000,10000] [--events N] [--reload-seconds S]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from midi_decoder import CONTROL_CHANGE, NOTE_ON, MidiDecoder
+from rules import RuleEngine, RuleSet
+
+
+def make_rules(count, rng):
+    rules = []
+    for i in range(count):
+        lo = rng.randrange(128)
+        rule = {
+            'name': f'rule {i}',
+            'velocity' if i % 2 else 'value': [lo, rng.randrange(lo, 128)],
+            'actions': [{'type': 'set_state', 'lights': [rng.randrange(1, 50)], 'state': 'onAIR'}],
+        }
+        rule['note' if i % 2 else 'cc'] = rng.randrange(128)
+        if rng.random() < 0.8:
+            rule['channel'] = rng.randrange(1, 17)
+        rules.append(rule)
+    return {'rules': rules}
+
+
+def linear_match(rules, record):
+    """What matching costs without compiling: test every rule in turn."""
+    kind, channel, number, value, _ = record
+    actions = []
+    for rule in rules:
+        target = rule.get('note') if kind != CONTROL_CHANGE else rule.get('cc')
+        if target != number or rule.get('channel', channel) != channel:
+            continue
+        lo, hi = rule.get('velocity') or rule.get('value')
+        if lo <= value <= hi:
+            actions.extend(rule['actions'])
+    return actions
+
+
+def make_records(count, rng):
+    messages = []
+    for _ in range(count):
+        status = rng.choice((0x90, 0xB0)) | rng.randrange(16)
+        messages.append([status, rng.randrange(128), rng.randrange(1, 128)])
+    return MidiDecoder().decode_batch(messages)
+
+
+def per_event_us(match, records):
+    start = time.perf_counter()
+    for record in records:
+        match(record)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+
+def check_reload(seconds):
+    """Match records while the rules file is rewritten; every event must find its rule."""
+    workdir = tempfile.mkdtemp(prefix='lp2hue-rules-')
+    path = os.path.join(workdir, 'rules.json')
+
+    def write(version):
+        # Every version maps note 60 on every channel and velocity to one action
+        spec = {'rules': [{'note': 60, 'actions': [{'type': 'webhook', 'url': f'http://localhost/{version}'}]}]}
+        spec['rules'] += make_rules(2000, random.Random(version))['rules']
+        with open(path + '.tmp', 'w') as f:
+            json.dump(spec, f)
+        os.replace(path + '.tmp', path)  # atomic, the engine never reads a half-written file
+
+    write(0)
+    engine = RuleEngine(path, recheck=0.01)
+    engine.start()
+    record = (NOTE_ON, 1, 60, 100, 0)
+    missed = matched = 0
+    versions = set()
+    stop = threading.Event()
+
+    def writer():
+        version = 1
+        while not stop.is_set():
+            time.sleep(0.05)
+            write(version)
+            version += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        actions = engine.match(record)
+        if not actions:
+            missed += 1
+        else:
+            matched += 1
+            versions.add(actions[0][2])
+    stop.set()
+    thread.join()
+    engine.stop()
+    return matched, missed, engine.loads, len(versions), engine.errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,5000,10000')
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--reload-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    records = make_records(args.events, rng)
+    print(f"{'rules':>7} {'compile ms':>11} {'table keys':>11} {'compiled us/event':>18} {'linear us/event':>16}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        spec = make_rules(size, rng)
+        start = time.perf_counter()
+        compiled = RuleSet.compile(spec)
+        compile_ms = (time.perf_counter() - start) * 1000
+        for record in records[:200]:
+            assert len(compiled.match(record)) == len(linear_match(spec['rules'], record)), record
+        fast = per_event_us(compiled.match, records)
+        # The linear scan is slow, a sample is enough
+        slow = per_event_us(lambda record: linear_match(spec['rules'], record), records[:max(50, 20000 // size)])
+        print(f"{size:7d} {compile_ms:11.1f} {len(compiled.table):11d} {fast:18.3f} {slow:16.1f}")
+
+    matched, missed, loads, versions, errors = check_reload(args.reload_seconds)
+    print(f"hot reload: {matched} events matched, {missed} missed, {loads} reloads, "
+          f"{versions} rule versions seen, {errors} load errors")
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+bench_scheduler.py
+
+Flood a rate-limited fake bridge with bulk updates while recording toggles come in.
+
+Without the scheduler the bridge refuses part of the burst; with it nothing is refused, queued
+updates for the same light are merged and recording start/stop overtakes the bulk work.
+
+Usage: python tools/bench_scheduler.py [--bulk N] [--lights N] [--limit PER_SECOND]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeHueBridge
+from hue_client import HueClient, HueRateLimited
+from scheduler import PRIORITY_BULK, PRIORITY_RECORDING, CommandScheduler
+
+RECORDING_LIGHT = 1
+
+
+def run_unscheduled(client, args):
+    refused = 0
+    lock = threading.Lock()
+
+    def send(light_id, state):
+        nonlocal refused
+        try:
+            client.set_light_state(light_id, state)
+        except HueRateLimited:
+            with lock:
+                refused += 1
+
+    with ThreadPoolExecutor(8) as pool:
+        for i in range(args.bulk):
+            pool.submit(send, 2 + i % args.lights, {'bri': i % 254})
+        for i in range(4):
+            pool.submit(send, RECORDING_LIGHT, {'on': i % 2 == 0})
+    return refused
+
+
+def run_scheduled(client, args):
+    scheduler = CommandScheduler(client)
+    bulk = [scheduler.set_light_state(2 + i % args.lights, {'bri': i % 254}, PRIORITY_BULK) for i in range(args.bulk)]
+    recording_latency = []
+    for i in range(4):
+        start = time.monotonic()
+        scheduler.set_light_state(RECORDING_LIGHT, {'on': i % 2 == 0}, PRIORITY_RECORDING).result()
+        recording_latency.append(time.monotonic() - start)
+        time.sleep(0.3)
+    for future in bulk:
+        future.result()
+    stats = scheduler.stats()
+    scheduler.close()
+    return recording_latency, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--bulk', type=int, default=60, help='number of cosmetic light updates in the burst')
+    parser.add_argument('--lights', type=int, default=12, help='number of lights the bulk updates cycle over')
+    parser.add_argument('--limit', type=int, default=10, help='writes per second the fake bridge accepts')
+    args = parser.parse_args()
+
+    with FakeHueBridge(args.lights + 1, latency=0.005, rate_limit=args.limit) as bridge:
+        client = HueClient(bridge.host, bridge.username)
+        refused = run_unscheduled(client, args)
+        print(f"unscheduled: {args.bulk + 4} writes, {refused} refused by the bridge")
+
+        time.sleep(1.1)  # let the fake bridge's window empty
+        bridge.rejected = 0
+        recording_latency, stats = run_scheduled(client, args)
+        print(f"scheduled:   {stats['submitted']} writes, {stats['merged']} merged, {stats['sent']} sent, "
+              f"{bridge.rejected} refused by the bridge")
+        print(f"  recording toggle latency: median {statistics.median(recording_latency) * 1000:.1f} ms, "
+              f"max {max(recording_latency) * 1000:.1f} ms")
+        print(f"  queue wait: avg {stats['wait_avg_ms']:.1f} ms, p95 {stats['wait_p95_ms']:.1f} ms, "
+              f"max {stats['wait_max_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""
+bench_sinks.py
+
+Measure how the recording-state outputs keep out of each other's way, against local stand-ins.
+
+Isolation: record toggles arrive at `--rate` per second for a few seconds and go to a fast MQTT
+broker, an OSC receiver, a webhook that answers slowly and an Awtrix clock that hangs (accepts
+the connection, never answers). Sent one after the other, as the daemon used to, every output
+waits for the slow ones; with a queue and worker per output the fast ones keep up and only the
+slow ones fall behind. The report shows throughput, latency from toggle to send, backlog and drops per
+output, and whether each ended up in the final state.
+
+Daemon: the whole daemon is started with [Sinks] pointing at the stand-ins, and record toggles
+are timed from the MIDI note to the Hue light with and without the extra outputs.
+
+Usage: python tools/bench_sinks.py [--rate N] [--seconds S] [--slow MS] [--policy POLICY]
+"""
+
+import argparse
+import contextlib
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from awtrix_client import AwtrixClient
+from benchmark import Run, load_app, percentile
+from fakes import FakeMqttBroker, FakeOscReceiver, FakeWebhook
+from sinks import LATEST, POLICIES, MqttSink, OscSink, WebhookSink, parse_address
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class Outputs:
+    """The stand-ins and a sink for each; final() tells whether each stand-in shows `recording`."""
+
+    def __init__(self, args):
+        self.mqtt = FakeMqttBroker().start()
+        self.osc = FakeOscReceiver().start()
+        self.webhook = FakeWebhook(latency=args.slow / 1000.0).start()
+        # A clock that hangs: connections are accepted by the kernel but never answered
+        self.dead = socket.create_server(('127.0.0.1', 0), backlog=64)
+        self.dead_host = f"127.0.0.1:{self.dead.getsockname()[1]}"
+
+    def sinks(self, args):
+        mqtt_host, mqtt_port = parse_address(self.mqtt.address, 1883)
+        osc_host, osc_port = parse_address(self.osc.address, 9000)
+        return [
+            MqttSink(mqtt_host, mqtt_port, policy=args.policy),
+            OscSink(osc_host, osc_port, policy=args.policy),
+            WebhookSink(f"http://{self.webhook.host}/hook", policy=args.policy),
+            AwtrixClient(self.dead_host, timeout=args.dead / 1000.0, policy=args.policy),
+        ]
+
+    def final(self, recording):
+        return {
+            'mqtt': bool(self.mqtt.published) and self.mqtt.published[-1][2] == (b'1' if recording else b'0'),
+            'osc': bool(self.osc.received) and self.osc.received[-1][2] == int(recording),
+            'webhook': bool(self.webhook.received) and self.webhook.received[-1][1] == {'recording': recording},
+            'awtrix': None,
+        }
+
+    def stop(self):
+        for fake in (self.mqtt, self.osc, self.webhook):
+            fake.stop()
+        self.dead.close()
+
+
+def serial(args):
+    """Every toggle sent to each output in turn on the caller's thread."""
+    outputs = Outputs(args)
+    sinks = outputs.sinks(args)
+    for sink in sinks:
+        sink.setup()
+    counts = {sink.name: 0 for sink in sinks}
+    latencies = {sink.name: [] for sink in sinks}
+    recording = False
+    start = time.monotonic()
+    due = start
+    while time.monotonic() - start < args.seconds:
+        recording = not recording
+        for sink in sinks:
+            try:
+                counts[sink.name] += sink.send(recording) is not False
+            except Exception:
+                pass
+            latencies[sink.name].append((time.monotonic() - due) * 1000)
+        due += 1.0 / args.rate
+        time.sleep(max(0.0, due - time.monotonic()))
+    wall = time.monotonic() - start
+    toggles = len(latencies[sinks[0].name])
+    time.sleep(0.2)
+    final = outputs.final(recording)
+    for sink in sinks:
+        sink.teardown()
+    outputs.stop()
+    return [(sink.name, toggles, counts[sink.name] / wall, percentile(latencies[sink.name], 50),
+             max(latencies[sink.name]), 0, 0, final[sink.name]) for sink in sinks]
+
+
+def queued(args):
+    """Every toggle put on each output's own queue."""
+    outputs = Outputs(args)
+    sinks = [sink.start() for sink in outputs.sinks(args)]
+    recording = False
+    toggles = 0
+    start = time.monotonic()
+    while time.monotonic() - start < args.seconds:
+        recording = not recording
+        for sink in sinks:
+            sink.put(recording)
+        toggles += 1
+        time.sleep(1.0 / args.rate)
+    wall = time.monotonic() - start
+    backlogs = {sink.name: sink.backlog() for sink in sinks}
+    # The fast outputs have long caught up; give the slow webhook the time its backlog needs
+    wait_for(lambda: all(sink.backlog() == 0 for sink in sinks[:3]), args.seconds * 2 + 5)
+    time.sleep(0.2)
+    final = outputs.final(recording)
+    results = []
+    for sink in sinks:
+        stats = sink.stats()
+        results.append((sink.name, toggles, stats['sent'] / wall, stats['p50_ms'], stats['max_ms'],
+                        backlogs[sink.name], stats['dropped'], final[sink.name]))
+    for sink in sinks:
+        sink.stop(timeout=0.1)
+    outputs.stop()
+    return results
+
+
+def daemon(app, args, with_sinks):
+    """Note-to-light times through the daemon, optionally with every extra output configured."""
+    args.latency, args.rate_limit = 5.0, None
+    outputs = Outputs(args) if with_sinks else None
+    app.MQTT_BROKER = outputs.mqtt.address if outputs else ''
+    app.OSC_TARGET = outputs.osc.address if outputs else ''
+    app.WEBHOOK_URL = f"http://{outputs.webhook.host}/hook" if outputs else ''
+    app.SINK_POLICY = args.policy
+    times = []
+    final = None
+    try:
+        with Run(app, args) as run:
+            if outputs:
+                # Run clears AWTRIX_HOST; add the clock to the outputs it started with
+                clock = AwtrixClient(outputs.dead_host, timeout=args.dead / 1000.0, policy=args.policy).start()
+                app.sinks.append(clock)
+            on = not run.bridge.lights['1']['state']['on']
+            for _ in range(args.toggles):
+                times.append(run.toggle(on) * 1000)
+                on = not on
+                time.sleep(0.05)
+            if outputs:
+                wait_for(lambda: all(sink.backlog() == 0 for sink in app.sinks if sink.name != 'awtrix'))
+                time.sleep(0.1)
+                final = outputs.final(not on)
+            stats = {sink.name: sink.stats() for sink in app.sinks}
+    finally:
+        if outputs:
+            outputs.stop()
+        app.MQTT_BROKER = app.OSC_TARGET = app.WEBHOOK_URL = ''
+    return times, final, stats
+
+
+def print_table(name, results):
+    print(f"{name}")
+    print(f"  {'output':<10}{'toggles':>9}{'sent/s':>9}{'p50 ms':>10}{'max ms':>10}{'backlog':>9}"
+          f"{'dropped':>9}{'final':>7}")
+    for output, toggles, rate, p50, worst, backlog, dropped, final in results:
+        state = '-' if final is None else 'ok' if final else 'wrong'
+        print(f"  {output:<10}{toggles:>9}{rate:>9.1f}{p50:>10.1f}{worst:>10.1f}{backlog:>9}{dropped:>9}{state:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rate', type=float, default=20.0, help='record toggles per second')
+    parser.add_argument('--seconds', type=float, default=3.0, help='how long toggles are sent')
+    parser.add_argument('--slow', type=float, default=200.0, help='webhook response time in ms')
+    parser.add_argument('--dead', type=float, default=500.0, help='timeout in ms for the clock that hangs')
+    parser.add_argument('--policy', choices=POLICIES, default=LATEST, help='what a full sink queue gives up')
+    parser.add_argument('--toggles', type=int, default=20, help='record toggles through the daemon')
+    args = parser.parse_args()
+
+    print(f"{args.rate:.0f} toggles/s for {args.seconds:.0f} s; webhook answers in {args.slow:.0f} ms, "
+          f"clock hangs ({args.dead:.0f} ms timeout); policy {args.policy}")
+    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+        print_table('one after the other', serial(args))
+        print_table('queue and worker per output', queued(args))
+
+    app = load_app()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        plain, _, _ = daemon(app, args, False)
+        extra, final, stats = daemon(app, args, True)
+    print('daemon, note to Hue light')
+    print(f"  {'Hue only':<22}{'p50 ms':>8}{percentile(plain, 50):>8.1f}{'max ms':>8}{max(plain):>8.1f}")
+    print(f"  {'Hue + 4 more outputs':<22}{'p50 ms':>8}{percentile(extra, 50):>8.1f}{'max ms':>8}{max(extra):>8.1f}")
+    for name, sink_stats in stats.items():
+        state = '' if not final or final.get(name) is None else '  final ok' if final[name] else '  final wrong'
+        print(f"  {name:<10} sent {sink_stats['sent']:>3}, failed {sink_stats['failed']:>3}, "
+              f"dropped {sink_stats['dropped']:>3}, p50 {sink_stats['p50_ms']:.1f} ms{state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+bench_startup.py
+
+Measure how fast logic_pro_to_hue.py is ready after a (re)start: time from process start to
+the module being imported, the MIDI port being open, the first MIDI event being handled and
+the recording light being on.
+
+Each run starts the daemon's main() in a fresh Python process against the fake bridge, with a
+fake MIDI port in place of rtmidi. From the moment the port is opened, "Logic" sends the record
+note followed by one clock message per millisecond, like a session that is already playing.
+Messages sent before the daemon listens are lost; the report counts them. `--bridge-latency`
+slows every bridge request down, as a bridge that is still waking up would.
+
+To compare with another version, point --src at its src folder (e.g. a git worktree).
+
+Usage: python tools/bench_startup.py [--runs N] [--bridge-latency MS] [--src DIR]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'src'))
+from fakes import FakeHueBridge
+
+# Runs in the child: times are time.monotonic(), which is shared between processes
+CHILD = r'''
+import json, sys, threading, time, types
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, sys.argv[2])
+from fakes import FakeMidiIn
+
+times = {}
+ports = []
+
+
+def play(midiin):
+    times['first_sent'] = time.monotonic()
+    midiin.send([0x90, 24, 127])
+    while True:
+        time.sleep(0.001)
+        midiin.send([0xF8])
+
+
+def open_midiinput(port=None, **kwargs):
+    midiin = FakeMidiIn(port)
+    ports.append(midiin)
+    times['port_open'] = time.monotonic()
+    threading.Thread(target=play, args=(midiin,), daemon=True).start()
+    return midiin, midiin.port_name
+
+
+rtmidi = types.ModuleType('rtmidi')
+rtmidi.midiutil = types.ModuleType('rtmidi.midiutil')
+rtmidi.midiutil.open_midiinput = open_midiinput
+sys.modules['rtmidi'], sys.modules['rtmidi.midiutil'] = rtmidi, rtmidi.midiutil
+
+import logic_pro_to_hue as app
+times['imported'] = time.monotonic()
+handled = threading.Event()
+make_batch_handler = app.make_batch_handler
+
+
+def timed_handler(*args):
+    handler = make_batch_handler(*args)
+
+    def handle_batch(batch):
+        if not handled.is_set():
+            times['first_handled'] = time.monotonic()
+            times['first_message'] = list(batch[0][0])
+            handled.set()
+        handler(batch)
+    return handle_batch
+
+
+app.make_batch_handler = timed_handler
+threading.Thread(target=app.main, daemon=True).start()
+handled.wait(30)
+time.sleep(float(sys.argv[3]))
+times['lost'] = sum(len(midiin._pending) for midiin in ports)
+print('STARTUP ' + json.dumps(times), flush=True)
+'''
+
+CONFIG = """[Hue]
+BRIDGE_IP = {host}
+LIGHT_ID = 1
+USERNAME = {username}
+FOCUS_MODE = 'Music Production'
+EVENT_STREAM_URL = http://{host}/eventstream/clip/v2
+
+[MIDI]
+PORTS = Startup Virtual Out
+"""
+
+
+def run_once(args, src):
+    bridge = FakeHueBridge(1, latency=args.bridge_latency / 1000.0).start()
+    workdir = tempfile.mkdtemp(prefix='lp2hue-startup-')
+    with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+        f.write(CONFIG.format(host=bridge.host, username=bridge.username))
+    started = time.monotonic()
+    child = subprocess.Popen([sys.executable, '-c', CHILD, src, TOOLS, str(args.settle)], cwd=workdir,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    light_on = bridge.wait_until(lambda: bridge.lights['1']['state']['on'], 30.0)
+    on_at = bridge.changed.get('1') if light_on else None
+    output, _ = child.communicate(timeout=60)
+    bridge.stop()
+    lines = [line for line in output.splitlines() if line.startswith('STARTUP ')]
+    if not lines:
+        raise RuntimeError(f"the daemon did not report back:\n{output}")
+    times = json.loads(lines[-1][len('STARTUP '):])
+    result = {stage: (times[stage] - started) * 1000 for stage in ('imported', 'port_open', 'first_handled')}
+    result['light_on'] = (on_at - started) * 1000 if on_at else float('nan')
+    # The record note is the first message sent; if the first one handled is a clock, it was lost
+    result['record_note_lost'] = times['first_message'] != [0x90, 24, 127]
+    result['lost'] = times['lost']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--bridge-latency', type=float, default=200.0, help='fake bridge response time in ms')
+    parser.add_argument('--settle', type=float, default=0.5, help='seconds to keep running after the first event')
+    parser.add_argument('--src', default=os.path.join(TOOLS, '..', 'src'), help='src folder of the version to test')
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    print(f"{args.runs} starts of {src}, bridge answering in {args.bridge_latency:.0f} ms")
+    print(f"{'run':<6}{'import ms':>11}{'port open ms':>14}{'1st event ms':>14}{'light on ms':>13}{'lost msgs':>11}"
+          f"{'record note':>13}")
+    results = []
+    for i in range(args.runs):
+        result = run_once(args, src)
+        results.append(result)
+        print(f"{i + 1:<6}{result['imported']:>11.1f}{result['port_open']:>14.1f}{result['first_handled']:>14.1f}"
+              f"{result['light_on']:>13.1f}{result['lost']:>11}{'lost' if result['record_note_lost'] else 'handled':>13}")
+    median = {key: statistics.median(result[key] for result in results)
+              for key in ('imported', 'port_open', 'first_handled', 'light_on', 'lost')}
+    print(f"{'median':<6}{median['imported']:>11.1f}{median['port_open']:>14.1f}{median['first_handled']:>14.1f}"
+          f"{median['light_on']:>13.1f}{median['lost']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+"""
+bench_status.py
+
+Load-test the recording-status push API with many concurrent local subscribers.
+
+Fan-out: `--clients` SSE and as many WebSocket subscribers connect to a StatusServer, plus one
+that never reads. Recording toggles are published every `--interval` ms while a few late
+subscribers join. The report shows publish() cost (what the MIDI path pays), the time from
+publish until each and until the last subscriber had the change, the server's threads, and
+checks that every subscriber saw a snapshot and then every delta in order, ending in the
+server's state.
+
+Daemon: the whole daemon is started with [Status] and a fake bridge; record toggles are timed
+from the MIDI note to the Hue light with and without the subscribers, and to the last
+subscriber.
+
+Usage: python tools/bench_status.py [--clients N] [--changes N] [--interval MS]
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import Run, load_app, percentile
+from status_api import SSE, WEBSOCKET, StatusServer
+
+
+class Subscriber:
+    """One SSE or WebSocket client; `messages` holds (receipt time, type, seq, state)."""
+
+    def __init__(self, port, kind):
+        self.kind = kind
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        if kind == SSE:
+            request = 'GET /events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'
+        else:
+            key = base64.b64encode(os.urandom(16)).decode()
+            request = (f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                       f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+        self.sock.sendall(request.encode())
+        self.sock.setblocking(False)
+        self.buf = b''
+        self.headers = False
+        self.messages = []
+
+    def feed(self, now):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        self.buf += data
+        if not self.headers:
+            if b'\r\n\r\n' not in self.buf:
+                return True
+            self.headers = True
+            self.buf = self.buf.split(b'\r\n\r\n', 1)[1]
+        if self.kind == SSE:
+            *events, self.buf = self.buf.split(b'\n\n')
+            for event in events:
+                for line in event.split(b'\n'):
+                    if line.startswith(b'data: '):
+                        self._add(now, line[6:])
+        else:
+            while len(self.buf) >= 2:
+                opcode, length, offset = self.buf[0] & 0x0f, self.buf[1] & 0x7f, 2
+                if length == 126:
+                    if len(self.buf) < 4:
+                        break
+                    length, offset = struct.unpack_from('>H', self.buf, 2)[0], 4
+                if len(self.buf) < offset + length:
+                    break
+                payload, self.buf = self.buf[offset:offset + length], self.buf[offset + length:]
+                if opcode == 0x1:
+                    self._add(now, payload)
+        return True
+
+    def _add(self, now, data):
+        message = json.loads(data)
+        self.messages.append((now, message['type'], message['seq'], message['state']))
+
+
+
+class Reader:
+    """Read every subscriber on one thread, stamping each message on arrival."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='subscribers', daemon=True)
+
+    def add(self, subscriber):
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.selector.register(subscriber.sock, selectors.EVENT_READ, subscriber)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._thread.join()
+        for subscriber in self.subscribers:
+            subscriber.sock.close()
+        self.selector.close()
+
+    def _run(self):
+        while not self._closed:
+            with self.lock:
+                ready = self.selector.select(0.05)
+                now = time.monotonic()
+                for key, _ in ready:
+                    if not key.data.feed(now):
+                        self.selector.unregister(key.fileobj)
+
+    def wait(self, predicate, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if predicate():
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+def replay(messages):
+    """(ok, state): a snapshot first, then contiguous deltas applied on top of it."""
+    if not messages or messages[0][1] != 'snapshot':
+        return False, None
+    _, _, seq, state = messages[0]
+    state = dict(state)
+    for _, kind, next_seq, delta in messages[1:]:
+        if kind != 'delta' or next_seq != seq + 1:
+            return False, state
+        seq = next_seq
+        state.update(delta)
+    return True, state
+
+
+def connect(reader, port, clients):
+    for i in range(clients):
+        reader.add(Subscriber(port, SSE))
+        reader.add(Subscriber(port, WEBSOCKET))
+
+
+def serve_subscribers(conn):
+    """Child process holding the subscribers, so their parsing does not share the daemon's interpreter."""
+    reader = Reader().start()
+    while True:
+        command, *params = conn.recv()
+        if command == 'connect':
+            port, clients = params
+            connect(reader, port, clients)
+            conn.send(reader.wait(lambda: all(subscriber.messages for subscriber in reader.subscribers)))
+        elif command == 'late':
+            port, clients = params
+            for i in range(clients):
+                reader.add(Subscriber(port, SSE if i % 2 else WEBSOCKET))
+            conn.send(True)
+        elif command == 'wait':
+            seq, = params
+            conn.send(reader.wait(lambda: all(subscriber.messages and subscriber.messages[-1][2] >= seq
+                                              for subscriber in reader.subscribers)))
+        elif command == 'results':
+            with reader.lock:
+                conn.send([(subscriber.kind, subscriber.messages) for subscriber in reader.subscribers])
+            reader.stop()
+            return
+
+
+class Subscribers:
+    """The subscriber process, driven over a pipe."""
+
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.get_context('spawn').Process(target=serve_subscribers, args=(child,),
+                                                                     daemon=True)
+        self.process.start()
+
+    def call(self, *command):
+        self.conn.send(command)
+        return self.conn.recv()
+
+    def results(self):
+        results = self.call('results')
+        self.process.join()
+        return results
+
+
+def fan_out(args):
+    threads = threading.active_count()
+    server = StatusServer(0, state={'recording': False, 'focus': None}).start()
+    server_threads = threading.active_count() - threads
+    subscribers = Subscribers()
+    subscribers.call('connect', server.port, args.clients)
+    # One subscriber that connects and never reads
+    stalled = socket.create_connection(('127.0.0.1', server.port))
+    stalled.sendall(b'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    time.sleep(0.1)
+    connected = server.subscribers()
+
+    published, costs = {}, []
+    for i in range(args.changes):
+        if i == args.changes // 2:
+            # Late joiners get a snapshot that already has the changes so far
+            subscribers.call('late', server.port, args.late)
+        now = time.monotonic()
+        start = time.perf_counter()
+        server.publish(recording=i % 2 == 0)
+        costs.append((time.perf_counter() - start) * 1e6)
+        published[server.seq] = now
+        time.sleep(args.interval / 1000.0)
+    final = server.snapshot()[1]
+    subscribers.call('wait', server.seq)
+    results = subscribers.results()
+    stalled.close()
+    server.stop()
+
+    each, last = [], {}
+    for _, messages in results:
+        for now, kind, seq, _ in messages:
+            if kind == 'delta':
+                each.append((now - published[seq]) * 1000)
+                last[seq] = max(last.get(seq, 0.0), now)
+    late = [messages for _, messages in results[-args.late:]]
+    return {
+        'connected': connected, 'server_threads': server_threads, 'costs': costs, 'each': each,
+        'to_last': [(stamp - published[seq]) * 1000 for seq, stamp in last.items()],
+        'consistent': all(replay(messages) == (True, final) for _, messages in results),
+        'late_ok': all(messages and messages[0][2] > 0 for messages in late),
+    }
+
+
+def free_port():
+    with socket.create_server(('127.0.0.1', 0)) as sock:
+        return sock.getsockname()[1]
+
+
+def daemon(app, args, clients):
+    """Note-to-light and note-to-last-subscriber times through the whole daemon."""
+    args.latency, args.rate_limit = 5.0, None
+    app.STATUS_PORT = free_port()
+    subscribers = Subscribers()
+    lights, sent = [], {}
+    try:
+        with Run(app, args) as run:
+            subscribers.call('connect', app.status_server.port, clients)
+            on = not run.bridge.lights['1']['state']['on']
+            for _ in range(args.toggles):
+                seq = app.status_server.seq + 1
+                now = time.monotonic()
+                lights.append(run.toggle(on) * 1000)
+                subscribers.call('wait', seq)
+                sent[seq] = now
+                on = not on
+                time.sleep(0.05)
+    finally:
+        results = subscribers.results()
+        app.STATUS_PORT = 0
+    last = {}
+    for _, messages in results:
+        for now, _, seq, _ in messages:
+            if seq in sent:
+                last[seq] = max(last.get(seq, 0.0), now)
+    return lights, [(last[seq] - stamp) * 1000 for seq, stamp in sent.items() if seq in last]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--clients', type=int, default=250, help='SSE subscribers, and as many WebSocket ones')
+    parser.add_argument('--changes', type=int, default=100, help='recording changes to publish')
+    parser.add_argument('--interval', type=float, default=20.0, help='ms between changes')
+    parser.add_argument('--late', type=int, default=10, help='subscribers joining halfway through')
+    parser.add_argument('--toggles', type=int, default=20, help='record toggles through the daemon')
+    args = parser.parse_args()
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    result = fan_out(args)
+    connected = result['connected']
+    print(f"{connected[SSE] - 1} SSE + {connected[WEBSOCKET]} WebSocket subscribers (+1 that never reads), "
+          f"{args.changes} changes every {args.interval:.0f} ms, server threads: {result['server_threads']}")
+    print(f"  publish() cost      p50 {percentile(result['costs'], 50):8.1f} us   max {max(result['costs']):8.1f} us")
+    print(f"  to each subscriber  p50 {percentile(result['each'], 50):8.2f} ms   p99 {percentile(result['each'], 99):8.2f} ms"
+          f"   max {max(result['each']):8.2f} ms")
+    print(f"  to last subscriber  p50 {percentile(result['to_last'], 50):8.2f} ms   max {max(result['to_last']):8.2f} ms")
+    check('every subscriber got a snapshot and then every delta in order', result['consistent'])
+    check('late subscribers start from a snapshot with the changes so far', result['late_ok'])
+    check('one server thread for all subscribers', result['server_threads'] == 1)
+
+    app = load_app()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        plain, _ = daemon(app, args, 0)
+        lights, subscribers = daemon(app, args, args.clients)
+    print('daemon, note to Hue light')
+    print(f"  {'no subscribers':<26}p50 {percentile(plain, 50):7.1f} ms   max {max(plain):7.1f} ms")
+    print(f"  {f'{args.clients * 2} subscribers':<26}p50 {percentile(lights, 50):7.1f} ms   max {max(lights):7.1f} ms")
+    if subscribers:
+        print(f"  {'note to last subscriber':<26}p50 {percentile(subscribers, 50):7.1f} ms   max {max(subscribers):7.1f} ms")
+    check('every toggle reached every subscriber', len(subscribers) == args.toggles)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""
+benchmark.py
+
+End-to-end note-to-light benchmark for logic_pro_to_hue.py, fully offline.
+
+The real pipeline from logic_pro_to_hue.start() is fed by a synthetic MIDI source in place of
+open_midiinput() and drives a local fake Hue bridge with configurable latency and rate limit.
+For each scenario it reports p50/p95/p99 latency, event throughput and CPU use of the process
+(which includes the stand-ins). Use --json to keep results for comparison between versions.
+
+Scenarios:
+  single      one record toggle at a time, note on -> light on
+  burst       rapid arm/disarm bursts, latency from the last message to the final light state
+  fanout      single toggles switching several lamps, latency until the last lamp changed
+  throughput  a flood of MIDI messages that don't trigger anything
+
+Usage: python tools/benchmark.py [--scenario NAME ...] [--latency MS] [--rate-limit N]
+                                 [--lights N] [--json FILE] [--label TEXT]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'src'))
+from fakes import FakeHueBridge, FakeMidiIn
+
+CONFIG = """[Hue]
+BRIDGE_IP = 127.0.0.1
+LIGHT_ID = 1
+USERNAME = fakeuser
+FOCUS_MODE = 'Music Production'
+"""
+
+
+def load_app():
+    """Import logic_pro_to_hue with a throw-away config.ini and log file."""
+    workdir = tempfile.mkdtemp(prefix='lp2hue-bench-')
+    with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+        f.write(CONFIG)
+    os.chdir(workdir)
+    import logic_pro_to_hue
+    return logic_pro_to_hue
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class Run:
+    """One scenario: a fake bridge, a fake MIDI port and the app pipeline between them."""
+
+    def __init__(self, app, args, lights=1, ports=1):
+        self.app = app
+        self.bridge = FakeHueBridge(max(lights, 1), latency=args.latency / 1000.0, rate_limit=args.rate_limit)
+        self.light_ids = [str(i) for i in range(1, lights + 1)]
+        self.ports = [FakeMidiIn('Benchmark Virtual Out')]
+        self.ports += [FakeMidiIn(f'Benchmark Virtual Out {i}') for i in range(2, ports + 1)]
+        self.midiin = self.ports[0]
+
+    def __enter__(self):
+        self.bridge.start()
+        app = self.app
+        app.BRIDGE_IP, app.USERNAME = self.bridge.host, self.bridge.username
+        app.LIGHT_IDS, app.ROOMS, app.AWTRIX_HOST = [int(i) for i in self.light_ids], [], ''
+        app.EVENT_STREAM_URL = f"http://{self.bridge.host}/eventstream/clip/v2"
+        self.inputs = [(midiin, midiin.port_name) for midiin in self.ports]
+        self.dispatcher = app.start(self.inputs)
+        # Measure the steady state: give the background warm-up and the event stream time to connect
+        if app.EVENT_STREAM:
+            app.mirror.wait_live()
+        self.cpu = time.process_time()
+        self.wall = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.app.stop(self.inputs, self.dispatcher)
+        self.bridge.stop()
+
+    def usage(self):
+        wall = time.monotonic() - self.wall
+        return wall, (time.process_time() - self.cpu) / wall * 100
+
+    def lights_are(self, on, since):
+        lights = self.bridge.lights
+        return all(lights[i]['state']['on'] == on and self.bridge.changed.get(i, 0) >= since for i in self.light_ids)
+
+    def toggle(self, on):
+        """Send one record toggle and return the time until every lamp shows it."""
+        sent = time.monotonic()
+        self.midiin.send([0x90, 24, 127 if on else 0])
+        if not self.bridge.wait_until(lambda: self.lights_are(on, sent)):
+            raise RuntimeError('light did not follow the record toggle')
+        return max(self.bridge.changed[i] for i in self.light_ids) - sent
+
+
+def scenario_single(app, args, lights=1, gap=None):
+    latencies = []
+    with Run(app, args, lights) as run:
+        for i in range(args.events):
+            latencies.append(run.toggle(i % 2 == 0))
+            time.sleep((gap or args.gap) / 1000.0)
+        wall, cpu = run.usage()
+    return latencies, args.events / wall, cpu, ''
+
+
+def scenario_fanout(app, args):
+    # Leave the bridge time to refill its rate limit, otherwise this measures queueing
+    gap = max(args.gap, args.lights * 1000.0 / args.rate_limit)
+    return scenario_single(app, args, args.lights, gap)
+
+
+def scenario_burst(app, args):
+    rng = random.Random(3)
+    latencies = []
+    events = 0
+    with Run(app, args) as run:
+        for i in range(max(1, args.events // 5)):
+            final = i % 2 == 0
+            size = rng.randint(5, 20)
+            # Random arm/disarm flapping that settles on the final state
+            states = [rng.random() < 0.5 for _ in range(size - 1)] + [final]
+            for state in states:
+                sent = time.monotonic()
+                run.midiin.send([0x90, 24, 127 if state else 0])
+                time.sleep(0.001)
+            events += size
+            time.sleep(args.gap / 1000.0)
+            # Nothing may still be on its way and the lamp must show the last state sent
+            if run.bridge.lights['1']['state']['on'] != final:
+                raise RuntimeError('light shows a stale state after a burst')
+            latencies.append(max(0.0, run.bridge.changed.get('1', 0) - sent))
+        wall, cpu = run.usage()
+        writes = sum(1 for _, method, _ in run.bridge.requests if method == 'PUT')
+    return latencies, events / wall, cpu, f"{events} note-24 messages became {writes} light writes"
+
+
+def scenario_throughput(app, args):
+    count = args.events * 500
+    with Run(app, args) as run:
+        start = time.monotonic()
+        limit = run.dispatcher.queue.maxsize - 64
+        for i in range(count):
+            # rtmidi can't be told to wait; the generator backs off instead so we measure the dispatcher
+            while run.dispatcher.queue.qsize() >= limit:
+                time.sleep(0)
+            run.midiin.send([0x90, 36 + i % 48, 1 + i % 126])
+        while run.dispatcher.handled + run.dispatcher.dropped < count and time.monotonic() - start < 60:
+            time.sleep(0.001)
+        elapsed = time.monotonic() - start
+        _, cpu = run.usage()
+        handled, dropped = run.dispatcher.handled, run.dispatcher.dropped
+    return [], handled / elapsed, cpu, f"{handled} of {count} messages handled, {dropped} dropped by the full queue"
+
+
+SCENARIOS = {
+    'single': scenario_single,
+    'burst': scenario_burst,
+    'fanout': scenario_fanout,
+    'throughput': scenario_throughput,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=5.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=10, help='writes per second the fake bridge accepts')
+    parser.add_argument('--lights', type=int, default=8, help='number of lamps in the fanout scenario')
+    parser.add_argument('--events', type=int, default=40, help='record toggles per scenario')
+    parser.add_argument('--gap', type=float, default=250.0, help='pause between toggles in ms')
+    parser.add_argument('--json', help='append the results as one JSON line to this file')
+    parser.add_argument('--label', default='', help='label stored with the JSON results, e.g. a version')
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    app = load_app()
+    results = {}
+    print(f"{'scenario':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'events/s':>11}{'CPU %':>8}")
+    for name in args.scenario:
+        # The pipeline prints every MIDI event; keep the report readable
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            latencies, rate, cpu, note = SCENARIOS[name](app, args)
+        ms = [latency * 1000 for latency in latencies]
+        row = {
+            'p50_ms': percentile(ms, 50), 'p95_ms': percentile(ms, 95), 'p99_ms': percentile(ms, 99),
+            'max_ms': max(ms) if ms else 0.0, 'events_per_s': rate, 'cpu_pct': cpu,
+        }
+        results[name] = row
+        print(f"{name:<12}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}"
+              f"{rate:>11.1f}{cpu:>8.1f}")
+        if note:
+            print(f"  {note}")
+
+    if json_path:
+        with open(json_path, 'a') as f:
+            f.write(json.dumps({'label': args.label, 'time': time.time(), 'latency_ms': args.latency,
+                                'rate_limit': args.rate_limit, 'results': results}) + '\n')
+
+
+if __name__ == "__main__":
+    main()
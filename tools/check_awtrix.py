@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+check_awtrix.py
+
+Exercise AwtrixClient against a local stand-in for the clock.
+
+Shows that show_recording()/clear_recording() return immediately even when the clock is slow,
+and that the clock ends up with (and then without) the recording app.
+
+Usage: python tools/check_awtrix.py [--latency SECONDS] [--host HOST]
+       --host sends to a real clock instead of the stand-in.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from awtrix_client import AwtrixClient
+from fakes import FakeAwtrix
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--latency', type=float, default=0.2, help='response delay of the stand-in in seconds')
+    parser.add_argument('--host', help='real Awtrix host to use instead of the stand-in')
+    args = parser.parse_args()
+
+    fake = None if args.host else FakeAwtrix(latency=args.latency).start()
+    client = AwtrixClient(args.host or fake.host)
+    client.start()
+
+    start = time.perf_counter()
+    client.show_recording()
+    queued = time.perf_counter() - start
+    print(f"show_recording() returned after {queued * 1000:.3f} ms")
+    wait_for(lambda: client.sent == 1)
+    print(f"Clock updated after {(time.perf_counter() - start) * 1000:.1f} ms")
+    if fake:
+        print(f"Apps on the clock: {fake.apps}")
+
+    start = time.perf_counter()
+    client.clear_recording()
+    print(f"clear_recording() returned after {(time.perf_counter() - start) * 1000:.3f} ms")
+    wait_for(lambda: client.sent == 2)
+    if fake:
+        print(f"Apps on the clock: {fake.apps}")
+
+    client.stop()
+    print(f"sent={client.sent} failed={client.failed} dropped={client.dropped}")
+    if fake:
+        fake.stop()
+        if fake.apps or client.sent != 2:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+check_coalesce.py
+
+Feed bursts of record arm/disarm toggles into the RecordingStateMachine and show how many
+light writes are left, and that the last write always matches the last toggle.
+
+Usage: python tools/check_coalesce.py [--window MS] [--toggles N] [--write-ms MS]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from recording_state import RecordingStateMachine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--window', type=float, default=50, help='coalescing window in ms')
+    parser.add_argument('--toggles', type=int, default=500, help='number of note 24 messages to send')
+    parser.add_argument('--write-ms', type=float, default=20, help='simulated duration of one light write')
+    args = parser.parse_args()
+
+    writes = []
+
+    def apply(recording, context):
+        time.sleep(args.write_ms / 1000.0)
+        writes.append(recording)
+
+    machine = RecordingStateMachine(apply, args.window / 1000.0)
+    rng = random.Random(7)
+    state = False
+    for _ in range(args.toggles):
+        # Mostly real toggles, sometimes Logic repeats the same state
+        if rng.random() < 0.8:
+            state = not state
+        machine.feed(state)
+        time.sleep(rng.choice((0.0005, 0.002, 0.01, 0.08)))
+    time.sleep(args.window / 1000.0 * 2 + args.write_ms / 1000.0 * 2)
+
+    print(f"toggles sent:   {args.toggles}")
+    print(f"light writes:   {len(writes)}")
+    print(f"counters:       {machine.counters()}")
+    print(f"final state:    sent={state} written={writes[-1] if writes else None}")
+    if not writes or writes[-1] != state:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,36 +2,47 @@
 
 # needs full disk access permission for Terminal
 
+"""
+check_focus.py
 
-import json
-import os
+Print the active macOS Focus Mode using the same cached lookup as logic_pro_to_hue.py.
+
+Usage: python tools/check_focus.py [--db DIR] [--assertions FILE] [--at HH:MM]
+       --db points at a directory holding Assertions.json and ModeConfigurations.json, e.g. the
+       fixtures in tools/fixtures/focus, --at evaluates the schedule at another time of day.
+"""
+
+import argparse
 import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from focus import ASSERT_PATH, MODECONFIG_PATH, FocusCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--db', help='directory with Assertions.json and ModeConfigurations.json')
+    parser.add_argument('--assertions', help='use this file instead of Assertions.json')
+    parser.add_argument('--at', help='time of day to evaluate schedules at (HH:MM)')
+    args = parser.parse_args()
+
+    assert_path, modeconfig_path = ASSERT_PATH, MODECONFIG_PATH
+    if args.db:
+        assert_path = os.path.join(args.db, 'Assertions.json')
+        modeconfig_path = os.path.join(args.db, 'ModeConfigurations.json')
+    if args.assertions:
+        assert_path = args.assertions
+
+    now = None
+    if args.at:
+        hour, minute = (int(x) for x in args.at.split(':'))
+        now = datetime.datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    cache = FocusCache(assert_path, modeconfig_path)
+    print(cache.get(now))
 
-ASSERT_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/Assertions.json")
-MODECONFIG_PATH = os.path.expanduser("~/Library/DoNotDisturb/DB/ModeConfigurations.json")
-def get_focus():
-    focus = "No focus" #default
-    assertJ = json.load(open(ASSERT_PATH))['data'][0]['storeAssertionRecords']
-    configJ = json.load(open(MODECONFIG_PATH))['data'][0]['modeConfigurations']
-    if assertJ:
-        modeid = assertJ[0]['assertionDetails']['assertionDetailsModeIdentifier']
-        focus = configJ[modeid]['mode']['name']
-    else:
-        date = datetime.datetime.today()
-        now = date.hour * 60 + date.minute
-
-        for modeid in configJ:
-            triggers = configJ[modeid]['triggers']['triggers'][0]
-            if triggers and triggers['enabledSetting'] == 2:
-                start = triggers['timePeriodStartTimeHour'] * 60 + triggers['timePeriodStartTimeMinute']
-                end = triggers['timePeriodEndTimeHour'] * 60 + triggers['timePeriodEndTimeMinute']
-                if start < end:
-                    if now >= start and now < end:
-                        focus = configJ[modeid]['mode']['name']
-                elif start > end: # includes midnight
-                    if now >= start or now < end:
-                        focus = configJ[modeid]['mode']['name']
-    return focus
 
 if '__main__' == __name__:
-    print(get_focus())
+    main()
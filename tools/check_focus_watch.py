@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+check_focus_watch.py
+
+Check the event-driven Focus Mode watcher on copies of the fixture database files.
+
+For file notifications (inotify on Linux, kqueue on macOS) and for mtime polling, Focus is
+switched on and off by replacing Assertions.json (as macOS does, with a rename) and by writing
+it in place. The report shows how long each change took to reach the MIDI dispatcher, how often
+the files were looked at while nothing changed, and that MIDI is only handled while "Music
+Production" is on. `--boundary` also schedules Music Production from the next full minute and
+checks that the watcher switches at the boundary without any file change (takes up to a minute).
+
+Usage: python tools/check_focus_watch.py [--changes N] [--poll SECONDS] [--boundary]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'src'))
+from benchmark import percentile
+from focus import FocusCache, FocusWatcher
+from midi_input import MidiDispatcher
+
+FIXTURES = os.path.join(TOOLS, 'fixtures', 'focus')
+MUSIC = 'Music Production'
+
+
+def write(path, data, replace):
+    if replace:
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+class Gate:
+    """on_change for the watcher: gates a dispatcher and remembers when each focus arrived."""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.arrived = {}
+        self.changed = threading.Condition()
+
+    def __call__(self, focus):
+        with self.changed:
+            self.dispatcher.enabled = focus == MUSIC
+            self.arrived[focus] = time.monotonic()
+            self.changed.notify_all()
+
+    def wait(self, focus, since, timeout):
+        with self.changed:
+            if self.changed.wait_for(lambda: self.arrived.get(focus, 0) >= since, timeout):
+                return self.arrived[focus] - since
+        return None
+
+
+def unscheduled(workdir):
+    """Copy the fixture modes without their schedules, so the result does not depend on the time of day."""
+    with open(os.path.join(FIXTURES, 'ModeConfigurations.json')) as f:
+        config = json.load(f)
+    for mode in config['data'][0]['modeConfigurations'].values():
+        mode['triggers'] = {'triggers': []}
+    write(os.path.join(workdir, 'ModeConfigurations.json'), config, True)
+
+
+def run(args, workdir, notify):
+    assert_path = os.path.join(workdir, 'Assertions.json')
+    config_path = os.path.join(workdir, 'ModeConfigurations.json')
+    with open(os.path.join(FIXTURES, 'Assertions.json')) as f:
+        idle = json.load(f)
+    with open(os.path.join(FIXTURES, 'Assertions_active.json')) as f:
+        active = json.load(f)
+    write(assert_path, idle, True)
+    scheduled = FocusCache(assert_path, config_path).get()
+
+    handled = []
+    dispatcher = MidiDispatcher(handled.extend)
+    gate = Gate(dispatcher)
+    cache = FocusCache(assert_path, config_path)
+    watcher = FocusWatcher(cache, gate, args.poll, notify).start()
+    dispatcher.start()
+    latencies, gated_ok = [], True
+    try:
+        for i in range(args.changes):
+            on = i % 2 == 0
+            since = time.monotonic()
+            write(assert_path, active if on else idle, replace=i % 4 < 2)
+            latency = gate.wait(MUSIC if on else scheduled, since, args.poll * 3 + 2)
+            if latency is None:
+                latencies.append(float('nan'))
+                continue
+            latencies.append(latency * 1000)
+            # MIDI goes through only while Music Production is on
+            before = len(handled)
+            dispatcher.on_midi(([0x90, 60, 100], 0.0))
+            time.sleep(0.01)
+            gated_ok &= (len(handled) > before) == (on or scheduled == MUSIC)
+        # Wake-ups of the watcher plus, when polling, every look at the files
+        looks = watcher.wakeups + getattr(watcher.watch, 'checks', 0)
+        time.sleep(args.idle)
+        idle_looks = watcher.wakeups + getattr(watcher.watch, 'checks', 0) - looks
+    finally:
+        watcher.stop()
+        dispatcher.stop()
+    return watcher.watch.kind, latencies, idle_looks, gated_ok, dispatcher.gated, cache.loads
+
+
+def boundary(args, workdir):
+    assert_path = os.path.join(workdir, 'Assertions.json')
+    config_path = os.path.join(workdir, 'ModeConfigurations.json')
+    with open(os.path.join(FIXTURES, 'ModeConfigurations.json')) as f:
+        config = json.load(f)
+    start = datetime.datetime.now().replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    end = start + datetime.timedelta(minutes=1)
+    modes = config['data'][0]['modeConfigurations']
+    for mode in modes.values():
+        trigger = {'enabledSetting': 2 if mode['mode']['name'] == MUSIC else 1,
+                   'timePeriodStartTimeHour': start.hour, 'timePeriodStartTimeMinute': start.minute,
+                   'timePeriodEndTimeHour': end.hour, 'timePeriodEndTimeMinute': end.minute}
+        mode['triggers'] = {'triggers': [trigger]}
+    write(config_path, config, True)
+    with open(os.path.join(FIXTURES, 'Assertions.json')) as f:
+        write(assert_path, json.load(f), True)
+
+    gate = Gate(MidiDispatcher(list))
+    watcher = FocusWatcher(FocusCache(assert_path, config_path), gate, args.poll).start()
+    try:
+        at = time.monotonic() + (start - datetime.datetime.now()).total_seconds()
+        late = gate.wait(MUSIC, at, 75)
+    finally:
+        watcher.stop()
+    return late, watcher.wakeups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--changes', type=int, default=20, help='focus switches per watcher')
+    parser.add_argument('--poll', type=float, default=1.0, help='mtime polling interval in seconds')
+    parser.add_argument('--idle', type=float, default=3.0, help='seconds without changes to count wake-ups')
+    parser.add_argument('--boundary', action='store_true', help='also wait for a scheduled focus to start')
+    args = parser.parse_args()
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    workdir = tempfile.mkdtemp(prefix='lp2hue-focus-')
+    unscheduled(workdir)
+    print(f"{args.changes} focus switches, half by rename and half in place; polling every {args.poll:.1f} s")
+    print(f"{'watch':<10}{'p50 ms':>9}{'max ms':>9}{'idle checks':>13}{'file loads':>12}{'gated msgs':>12}")
+    for notify in (True, False):
+        kind, latencies, idle_looks, gated_ok, gated, loads = run(args, workdir, notify)
+        seen = [latency for latency in latencies if latency == latency]
+        print(f"{kind:<10}{percentile(seen, 50):>9.1f}{max(seen, default=float('nan')):>9.1f}"
+              f"{idle_looks:>13}{loads:>12}{gated:>12}")
+        check(f"{kind}: every focus change reached the dispatcher", len(seen) == len(latencies))
+        check(f"{kind}: MIDI handled only while {MUSIC} is on", gated_ok)
+        if notify and kind != 'poll':
+            check(f"{kind}: no wake-ups while nothing changes", idle_looks == 0)
+
+    if args.boundary:
+        print('waiting for a schedule boundary...')
+        late, wakeups = boundary(args, workdir)
+        if late is not None:
+            print(f"     scheduled focus applied {late * 1000:.0f} ms after the boundary, {wakeups} wake-up(s)")
+        check('scheduled focus switched on at the boundary', late is not None and late < 1.0)
+    shutil.rmtree(workdir)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
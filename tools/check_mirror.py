@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+check_mirror.py
+
+Exercise LightMirror and the scheduler's write skipping against the fake bridge's v2 event stream.
+
+Shows that "which lights are on" is answered without touching the bridge, that a write the
+lights already have is skipped, that changes made elsewhere reach the mirror through the event
+stream (and make the next write go out again), and that the mirror resyncs after the stream
+drops.
+
+Usage: python tools/check_mirror.py [--lights N] [--latency MS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeHueBridge
+from hue_client import HueClient
+from light_mirror import LightMirror
+from scheduler import CommandScheduler
+
+onAIR = {'on': True, 'bri': 254, 'sat': 254, 'hue': 65535}
+offAIR = {'on': False, 'bri': 254, 'sat': 254, 'hue': 65535}
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def writes(bridge):
+    return sum(1 for _, method, _ in bridge.requests if method == 'PUT')
+
+
+def gets(bridge):
+    return sum(1 for _, method, path in bridge.requests if method == 'GET' and path.endswith('/lights'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--lights', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=20.0, help='bridge response time in ms')
+    args = parser.parse_args()
+
+    bridge = FakeHueBridge(args.lights, groups={'Studio': range(1, args.lights + 1)},
+                           latency=args.latency / 1000.0).start()
+    client = HueClient(bridge.host, bridge.username)
+    mirror = LightMirror(client, f"http://{bridge.host}/eventstream/clip/v2", backoff=(0.05, 0.5),
+                         echo_window=0.2).start()
+    scheduler = CommandScheduler(client, light_rate=100, group_rate=100, bridge_rate=100, mirror=mirror)
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    check('mirror live after connect', mirror.wait_live())
+
+    # Reads from memory
+    before = gets(bridge)
+    start = time.perf_counter()
+    for _ in range(1000):
+        on = mirror.lights_on()
+    per_read = (time.perf_counter() - start) / 1000
+    print(f"     lights_on() from memory: {per_read * 1e6:.1f} us per call")
+    start = time.perf_counter()
+    client.get_lights()
+    print(f"     GET /lights from the bridge: {(time.perf_counter() - start) * 1000:.1f} ms")
+    check('1000 reads without a bridge request', gets(bridge) == before + 1 and on == [])
+
+    # Writes the lights already have are skipped
+    before = writes(bridge)
+    scheduler.set_light_state('1', onAIR).result()
+    check('first onAIR write sent', writes(bridge) == before + 1)
+    start = time.perf_counter()
+    scheduler.set_light_state('1', onAIR).result()
+    print(f"     skipped write answered in {(time.perf_counter() - start) * 1e6:.0f} us")
+    check('repeated onAIR write skipped', writes(bridge) == before + 1)
+    check('lights_on() sees the write', [light_id for light_id, _ in mirror.lights_on()] == ['1'])
+
+    # Changes made elsewhere arrive over the event stream
+    changed = time.perf_counter()
+    bridge.external_change('1', {'on': False})
+    check('external change mirrored', wait_for(lambda: mirror.state('1')['on'] is False))
+    print(f"     event reached the mirror after {(time.perf_counter() - changed) * 1000:.1f} ms")
+    before = writes(bridge)
+    scheduler.set_light_state('1', onAIR).result()
+    check('write after external change sent', writes(bridge) == before + 1)
+
+    time.sleep(0.25)  # colour events right after our own write are taken as its echo
+    bridge.external_change('1', {'xy': [0.3, 0.3]})
+    wait_for(lambda: mirror.state('1').get('xy') == [0.3, 0.3])
+    before = writes(bridge)
+    scheduler.set_light_state('1', onAIR).result()
+    check('colour changed elsewhere: onAIR sent again', writes(bridge) == before + 1)
+
+    # Groups: all members off already
+    scheduler.set_light_state('1', offAIR).result()
+    before = writes(bridge)
+    scheduler.set_group_action('1', offAIR).result()
+    check('group off skipped when every member is off', writes(bridge) == before)
+
+    # Queued or in-flight writes are never overtaken by a skipped one
+    first = scheduler.set_light_state('2', onAIR)
+    second = scheduler.set_light_state('2', offAIR)
+    first.result(), second.result()
+    check('off after a pending on still sent', bridge.lights['2']['state']['on'] is False)
+
+    # Resync after the stream drops
+    connects = mirror.connects
+    bridge.drop_streams()
+    bridge.external_change('3', {'on': True})  # happens while nobody listens
+    check('reconnected', wait_for(lambda: mirror.connects > connects and mirror.live))
+    check('missed change picked up by the refill', mirror.state('3')['on'] is True)
+
+    scheduler.close()
+    mirror.stop()
+    bridge.stop()
+    print(f"scheduler: sent={scheduler.sent} skipped={scheduler.skipped}; mirror: events={mirror.events} connects={mirror.connects}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""
+check_multiport.py
+
+Feed dozens of MIDI ports into one process and check that the single dispatcher keeps up.
+
+Every fake port gets its own sender thread, standing in for the thread rtmidi calls its callback
+from. Each sends a numbered stream of Control Change messages on its own MIDI channel, and the
+last port finally sends the record note. The check verifies that every message arrives tagged
+with the port it came from, in the order that port sent it, that every message is decoded, and
+that attaching more ports adds no threads of our own. It reports the callback to dispatch latency.
+
+Usage: python tools/check_multiport.py [--ports N] [--messages N] [--rate PER_PORT_PER_S]
+       --rate 0 sends flat out; the dispatcher queue may then drop, as with rtmidi, but never reorder.
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import Run, load_app, percentile
+
+
+def send_stream(midiin, channel, count, rate, go):
+    """Numbered CC messages: controller and value carry the sequence number, 14 bits."""
+    go.wait()
+    interval = 1.0 / rate if rate else 0.0
+    due = time.perf_counter()
+    for seq in range(count):
+        midiin.send([0xB0 | channel, (seq >> 7) & 0x7F, seq & 0x7F])
+        if interval:
+            due += interval
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+
+def app_threads():
+    """Names of the threads the app started, leaving out the fake bridge's server threads."""
+    return sorted(thread.name for thread in threading.enumerate() if not thread.name.startswith('Thread-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--messages', type=int, default=2000, help='messages per port')
+    parser.add_argument('--rate', type=float, default=200.0, help='messages per second per port, 0 = flat out')
+    parser.add_argument('--latency', type=float, default=5.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=10, help='writes per second the fake bridge accepts')
+    args = parser.parse_args()
+    count = min(args.messages, 1 << 14)
+
+    app = load_app()
+    failures = []
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        with Run(app, args, ports=1) as run:
+            single_port_threads = app_threads()
+        with Run(app, args, ports=args.ports) as run:
+            threads = app_threads()
+            dispatcher = run.dispatcher
+            received = {source: [] for source in range(args.ports)}
+            latencies = []
+            decoded = [0]
+            handle_batch = dispatcher.handler
+            handle_record = app.handle_midi_record
+
+            def check_batch(batch):
+                now = time.monotonic_ns()
+                for message, deltatime, received_ns, source in batch:
+                    received[source].append(message)
+                    latencies.append((now - received_ns) / 1e6)
+                handle_batch(batch)
+
+            def count_record(record, trace):
+                decoded[0] += 1
+                handle_record(record, trace)
+
+            dispatcher.handler = check_batch
+            app.handle_midi_record = count_record
+            go = threading.Event()
+            senders = [threading.Thread(target=send_stream, args=(midiin, source % 16, count, args.rate, go))
+                       for source, midiin in enumerate(run.ports)]
+            for sender in senders:
+                sender.start()
+            start = time.perf_counter()
+            go.set()
+            for sender in senders:
+                sender.join()
+            run.ports[-1].send([0x90, 24, 127])
+            total = args.ports * count + 1
+            deadline = time.monotonic() + 30
+            while dispatcher.handled + dispatcher.dropped < total and time.monotonic() < deadline:
+                time.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            light_on = run.bridge.wait_until(lambda: run.bridge.lights['1']['state']['on'], 5.0)
+            app.handle_midi_record = handle_record
+            handled, dropped = dispatcher.handled, dispatcher.dropped
+
+    for source, messages in received.items():
+        status = 0xB0 | source % 16
+        if any(message[0] != status for message in messages if message[0] != 0x90):
+            failures.append(f'port {source}: messages tagged with the wrong port')
+            break
+        # Drops leave gaps, but whatever arrived must be in the order it was sent
+        sequence = [(message[1] << 7) | message[2] for message in messages if message[0] == status]
+        if any(b <= a for a, b in zip(sequence, sequence[1:])):
+            failures.append(f'port {source}: messages out of order')
+            break
+
+    print(f"ports:       {args.ports} x {count} messages at {args.rate or 'max'} msg/s each")
+    print(f"dispatcher:  {handled} handled, {dropped} dropped in {elapsed:.2f} s ({handled / elapsed:.0f} msg/s)")
+    print(f"decoded:     {decoded[0]} records")
+    print(f"latency:     p50 {percentile(latencies, 50):.3f} ms, p99 {percentile(latencies, 99):.3f} ms, "
+          f"max {max(latencies):.3f} ms (callback to handler)")
+    print(f"threads:     {len(threads)} with {args.ports} ports, {len(single_port_threads)} with one port")
+    print(f"record note: light {'on' if light_on else 'still off'}")
+
+    if dropped and args.rate:
+        failures.append('messages dropped')
+    if decoded[0] != handled:
+        failures.append('not every message was decoded')
+    if threads != single_port_threads:
+        failures.append('more ports started more threads')
+    if not light_on:
+        failures.append('the record note on the last port did not switch the light on')
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
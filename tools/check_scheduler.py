@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+check_scheduler.py
+
+Check that light and group commands share one bridge budget in the CommandScheduler.
+
+The bridge handles about 10 light commands or 1 group command per second. A stream of light
+commands with one group action in the middle is sent through the scheduler to the fake bridge,
+once with the group charged like a light command (how the scheduler used to count) and once
+with the default cost. The report shows the pause in light traffic before the group action and
+how far the bridge got ahead of its budget (a full bucket plus 10 per second since the first
+write), counting the group as the 10 light commands it costs the bridge. It checks that with
+the default cost the group holds the lights back for about a second and the budget holds, and
+that a closed scheduler refuses new writes and is replaced by the next get_scheduler().
+
+Usage: python tools/check_scheduler.py [--lights N]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from fakes import FakeHueBridge
+from hue_client import HueClient
+from scheduler import GROUP, RESULT_TIMEOUT, CommandScheduler, get_scheduler
+
+
+def run(bridge, args, group_cost=None):
+    """Send the lights with a group action halfway; returns the (time, is group) of every write."""
+    scheduler = CommandScheduler(HueClient(bridge.host, bridge.username))
+    if group_cost is not None:
+        scheduler.costs[GROUP] = group_cost
+    start = len(bridge.requests)
+    futures = []
+    for i in range(1, args.lights + 1):
+        futures.append(scheduler.set_light_state(i, {'bri': i}))
+        if i == args.lights // 2:
+            futures.append(scheduler.set_group_action('1', {'on': True}))
+    for future in futures:
+        future.result(RESULT_TIMEOUT)
+    scheduler.close()
+    writes = [(stamp, '/groups/' in path) for stamp, method, path in bridge.requests[start:] if method == 'PUT']
+    return sorted(writes), scheduler.costs[GROUP]
+
+
+def measure(writes, rate, group_cost):
+    """(pause in light writes before the group, most light commands sent beyond the budget)."""
+    group = next(stamp for stamp, is_group in writes if is_group)
+    before = max(stamp for stamp, is_group in writes if not is_group and stamp <= group)
+    first = writes[0][0]
+    sent = 0.0
+    ahead = 0.0
+    for stamp, is_group in writes:
+        sent += group_cost if is_group else 1.0
+        ahead = max(ahead, sent - rate - rate * (stamp - first))
+    return group - before, ahead
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--lights', type=int, default=40, help='light commands around the group action')
+    args = parser.parse_args()
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    with FakeHueBridge(args.lights, groups={'Studio': [1, 2, 3]}, latency=0.002) as bridge:
+        print(f"{args.lights} light commands with one group action halfway, bridge budget 10/s")
+        print(f"{'group cost':<12}{'pause before group s':>22}{'over budget':>14}")
+        results = {}
+        for group_cost in (1.0, None):
+            writes, cost = run(bridge, args, group_cost)
+            results[cost] = measure(writes, 10.0, 10.0)
+            print(f"{cost:<12.0f}{results[cost][0]:>22.2f}{results[cost][1]:>14.1f}")
+
+        closed = get_scheduler(bridge.host, bridge.username)
+        closed.close()
+        future = closed.set_light_state(1, {'on': True})
+        refused = future.done() and isinstance(future.exception(0), RuntimeError)
+        fresh = get_scheduler(bridge.host, bridge.username)
+        sent = fresh is not closed and fresh.set_light_state(1, {'on': True}).result(RESULT_TIMEOUT)
+        fresh.close()
+
+    pause, ahead = results[max(results)]
+    check('a group action holds light commands back for about a second', 0.85 <= pause <= 1.3)
+    # One light command of slack for the time between the scheduler's clock and the bridge's
+    check('the bridge never gets more than its budget', ahead <= 1.0)
+    check('a closed scheduler fails new writes straight away', refused)
+    check('get_scheduler() replaces a closed scheduler', bool(sent))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
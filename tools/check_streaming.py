@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+check_streaming.py
+
+Run the streaming effects mode against a local UDP receiver and check frame rate and jitter.
+
+While a fake performance plays notes and MIDI clock (120 bpm) into the EffectEngine, a
+Streamer sends frames to a socket on localhost. The receiver checks every packet, its sequence
+number and arrival time. Jitter is held against how late a plain time.sleep() wakes up on the
+same machine at the same time, so a busy or single-CPU machine does not fail the check on its
+own. Rendering and packing are also run under tracemalloc to show that frames are built
+without allocating.
+
+Usage: python tools/check_streaming.py [--rate HZ] [--seconds S] [--channels N]
+"""
+
+import argparse
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from midi_decoder import CLOCK, NOTE_ON, START, STOP
+from streaming import EffectEngine, FramePacker, Streamer, parse_frame
+
+ENTERTAINMENT_ID = '1a8d99cc-967b-44f2-9202-43f976c0fa6b'
+
+
+class Receiver:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.arrivals = []
+        self.frames = []
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def _run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(2048)
+            except socket.timeout:
+                continue
+            self.arrivals.append(time.monotonic())
+            self.frames.append(data)
+
+
+def play(engine, seconds, stop):
+    """Notes at random moments plus 24 clocks per beat at 120 bpm."""
+    rng = random.Random(5)
+    engine.feed((START, 0, 0, 0, 0), time.monotonic())
+    tick = 0.5 / 24
+    next_clock = time.monotonic() + tick
+    while not stop.is_set():
+        now = time.monotonic()
+        if now >= next_clock:
+            engine.feed((CLOCK, 0, 0, 0, 0), now)
+            next_clock += tick
+        if rng.random() < 0.02:
+            engine.feed((NOTE_ON, 1, rng.randrange(36, 60), rng.randrange(40, 128), 0), now)
+        time.sleep(0.002)
+    engine.feed((STOP, 0, 0, 0, 0), time.monotonic())
+
+
+def oversleep(period, stop, late):
+    """Collect how many ms each time.sleep(period) overslept, next to the streamer."""
+    while not stop.is_set():
+        start = time.monotonic()
+        time.sleep(period)
+        late.append((time.monotonic() - start - period) * 1000)
+
+
+def allocation_check(channels, frames=5000):
+    engine = EffectEngine(channels)
+    packer = FramePacker(ENTERTAINMENT_ID, list(range(channels)))
+    streamer = Streamer('127.0.0.1', 9, engine, packer)
+    engine.feed((NOTE_ON, 1, 40, 127, 0), time.monotonic())
+    now = time.monotonic()
+    tracemalloc.start()
+    # Warm up under tracing, so free lists filled by the first frames don't count
+    for i in range(1000):
+        engine.render(now, streamer.values)
+        packer.pack(i & 0xFF, streamer.values)
+    before = tracemalloc.take_snapshot()
+    for i in range(frames):
+        engine.render(now + i * 0.001, streamer.values)
+        packer.pack(i & 0xFF, streamer.values)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                if os.path.basename(stat.traceback[0].filename) == 'streaming.py')
+    return grown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rate', type=float, default=50.0)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--channels', type=int, default=6)
+    args = parser.parse_args()
+
+    receiver = Receiver()
+    receiver.thread.start()
+    engine = EffectEngine(args.channels)
+    streamer = Streamer('127.0.0.1', receiver.port, engine, FramePacker(ENTERTAINMENT_ID, list(range(args.channels))),
+                        rate=args.rate)
+    stop = threading.Event()
+    player = threading.Thread(target=play, args=(engine, args.seconds, stop), daemon=True)
+    late = []
+    sleeper = threading.Thread(target=oversleep, args=(1.0 / args.rate, stop, late), daemon=True)
+    player.start()
+    sleeper.start()
+    streamer.start()
+    time.sleep(args.seconds)
+    streamer.stop()
+    stop.set()
+    player.join()
+    sleeper.join()
+    time.sleep(0.1)
+    receiver.running = False
+    receiver.thread.join()
+
+    failures = []
+    arrivals = receiver.arrivals
+    period_ms = 1000.0 / args.rate
+    intervals = [(b - a) * 1000 for a, b in zip(arrivals, arrivals[1:])]
+    deviations = sorted(abs(interval - period_ms) for interval in intervals)
+    rate = (len(arrivals) - 1) / (arrivals[-1] - arrivals[0])
+    gaps = 0
+    lit = 0
+    for previous, frame in zip(receiver.frames, receiver.frames[1:]):
+        sequence, config_id, channels = parse_frame(frame)
+        if sequence != (parse_frame(previous)[0] + 1) & 0xFF:
+            gaps += 1
+        if config_id != ENTERTAINMENT_ID or len(channels) != args.channels:
+            failures.append('malformed frame')
+            break
+        lit += any(r for _, r, _, _ in channels)
+
+    print(f"frames received:  {len(arrivals)} (streamer sent {streamer.frames}, {streamer.late} late, {streamer.errors} errors)")
+    print(f"frame rate:       {rate:.2f} Hz (target {args.rate:.0f})")
+    print(f"interval:         mean {statistics.mean(intervals):.3f} ms, stdev {statistics.pstdev(intervals):.3f} ms")
+    late.sort()
+    baseline = late[int(0.99 * (len(late) - 1))]
+    # An interval is off by both its ends' lateness; never stricter than half a frame
+    allowed = max(period_ms / 2, 2 * baseline)
+    print(f"jitter:           p50 {deviations[len(deviations) // 2]:.3f} ms, "
+          f"p99 {deviations[int(0.99 * (len(deviations) - 1))]:.3f} ms, max {deviations[-1]:.3f} ms")
+    print(f"time.sleep():     p99 {baseline:.3f} ms late, jitter allowed up to {allowed:.3f} ms")
+    print(f"sequence gaps:    {gaps}")
+    print(f"frames with light: {lit} of {len(arrivals) - 1}")
+    grown = allocation_check(args.channels)
+    print(f"memory held after 5000 frames: {grown} bytes")
+
+    if abs(rate - args.rate) > args.rate * 0.02:
+        failures.append('frame rate off by more than 2%')
+    if deviations[int(0.99 * (len(deviations) - 1))] > allowed:
+        failures.append('p99 jitter above what time.sleep() manages here')
+    if gaps or streamer.late:
+        failures.append('frames lost or late')
+    if not lit:
+        failures.append('notes never lit a channel')
+    if grown > 0:
+        failures.append('frames allocate memory')
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+check_supervisor.py
+
+Exercise supervised mode against a flapping fake bridge and a MIDI port that comes and goes.
+
+Flapping: the fake bridge drops every request for `--down` seconds, several times over, while
+Logic keeps toggling record. Without supervision every change made during an outage is lost
+and the light stays wrong until the next toggle after the bridge is back. Supervised, the
+changes are buffered and the light is put into the latest recording state once the bridge
+answers again, with one write per light rather than one per missed toggle. The report shows
+the recovery time and buffered changes per outage and whether the light ended up right.
+Requests time out and retries back off after fractions of a second (`--timeout`,
+`--backoff-max`), so the unsupervised run, which never recovers on its own, does not spend
+minutes waiting for the daemon's defaults.
+
+Reboot: the bridge drops its event stream and comes back with the light off; reconciling on
+reconnect must switch it back on. Port: the MIDI port disappears and comes back; the port
+watcher must reopen it and record toggles must reach the light again.
+
+Usage: python tools/check_supervisor.py [--outages N] [--down SECONDS] [--up SECONDS] [--timeout SECONDS]
+                                        [--backoff-max SECONDS]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import Run, load_app, percentile
+from fakes import FakeMidiIn, open_fake_midiinput
+from supervisor import PortWatcher
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def writes(bridge, since):
+    return sum(1 for stamp, method, _ in list(bridge.requests) if method == 'PUT' and stamp >= since)
+
+
+class Toggler:
+    """Logic pressing record on and off every `interval` seconds on a thread; pause() holds it."""
+
+    def __init__(self, midiin, interval):
+        self.midiin = midiin
+        self.interval = interval
+        self.recording = False
+        self.sent = 0
+        self.running = threading.Event()
+        self.running.set()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='toggler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self.running.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.running.wait()
+            if self._closed.is_set():
+                return
+            self.recording = not self.recording
+            self.midiin.send([0x90, 24, 127 if self.recording else 0])
+            self.sent += 1
+
+
+def flapping(app, args, supervised):
+    app.SUPERVISED = supervised
+    results = []
+    with Run(app, args) as run:
+        light = run.bridge.lights['1']['state']
+        toggler = Toggler(run.midiin, args.interval).start()
+        for _ in range(args.outages):
+            time.sleep(args.up)
+            sink_buffered = app.hue_sink.buffered if supervised else 0
+            run.bridge.set_down(True)
+            time.sleep(args.down)
+            # Logic stops toggling as the bridge returns: is the light right again without a new toggle?
+            toggler.running.clear()
+            time.sleep(app.COALESCE_MS / 1000.0 + 0.02)
+            back = time.monotonic()
+            run.bridge.set_down(False)
+            recovered = wait_for(lambda: light['on'] == toggler.recording, args.down + app.BACKOFF_MAX)
+            took = time.monotonic() - back
+            time.sleep(0.2)
+            results.append({
+                'recovered': recovered,
+                'seconds': took if recovered else float('nan'),
+                'buffered': app.hue_sink.buffered - sink_buffered if supervised else 0,
+                'writes': writes(run.bridge, back),
+            })
+            toggler.running.set()
+        toggler.stop()
+        time.sleep(app.COALESCE_MS / 1000.0 + 0.05)
+        final = wait_for(lambda: light['on'] == toggler.recording, args.down + app.BACKOFF_MAX)
+        stats = app.hue_sink.stats() if supervised else None
+    return results, final, toggler.sent, stats
+
+
+def reboot(app, args):
+    app.SUPERVISED = True
+    with Run(app, args) as run:
+        light = run.bridge.lights['1']['state']
+        on = not light['on']
+        run.toggle(on)
+        # The bridge restarts: streams drop and the light comes back in its power-on state
+        with run.bridge.lock:
+            light['on'] = not on
+        run.bridge.set_down(True)
+        time.sleep(0.3)
+        back = time.monotonic()
+        run.bridge.set_down(False)
+        restored = wait_for(lambda: light['on'] == on, 2 * app.BACKOFF_MAX + 5.0)
+        return restored, time.monotonic() - back
+
+
+def port(app, args):
+    app.SUPERVISED = True
+    name = 'Benchmark Virtual Out'
+    FakeMidiIn.present = {name}
+    try:
+        with Run(app, args) as run:
+            watcher = PortWatcher(run.inputs, open_fake_midiinput, run.dispatcher.attach, args.port_check).start()
+            try:
+                FakeMidiIn.present = set()
+                noticed = wait_for(lambda: watcher.lost == 1)
+                time.sleep(0.5)
+                back = time.monotonic()
+                FakeMidiIn.present = {name}
+                reopened = wait_for(lambda: watcher.reopened == 1)
+                took = time.monotonic() - back
+                run.midiin = run.inputs[0][0]
+                on = not run.bridge.lights['1']['state']['on']
+                latency = run.toggle(on) if reopened else float('nan')
+            finally:
+                watcher.stop()
+    finally:
+        FakeMidiIn.present = None
+    return noticed, reopened, took, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--outages', type=int, default=3)
+    parser.add_argument('--down', type=float, default=1.5, help='seconds the bridge is gone per outage')
+    parser.add_argument('--up', type=float, default=0.5, help='seconds the bridge is up between outages')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between record toggles')
+    parser.add_argument('--port-check', type=float, default=0.1, help='seconds between MIDI port checks')
+    parser.add_argument('--latency', type=float, default=5.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=None, help='writes per second the fake bridge accepts')
+    parser.add_argument('--timeout', type=float, default=0.2, help='seconds a request to the bridge may take')
+    parser.add_argument('--backoff-max', type=float, default=1.0, help='longest wait between retries in seconds')
+    args = parser.parse_args()
+    app = load_app()
+    app.HUE_TIMEOUT = args.timeout
+    app.BACKOFF_MAX = args.backoff_max
+    app.BACKOFF_MIN = min(app.BACKOFF_MIN, args.backoff_max)
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    print(f"{args.outages} outages of {args.down:.1f} s, record toggled every {args.interval * 1000:.0f} ms, "
+          f"backoff {app.BACKOFF_MIN}..{app.BACKOFF_MAX} s, requests time out after {app.HUE_TIMEOUT} s")
+    print(f"{'mode':<14}{'recovered':>11}{'recovery p50 s':>16}{'max s':>8}{'buffered/outage':>17}"
+          f"{'writes/recovery':>17}{'final':>7}")
+    for supervised in (False, True):
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results, final, sent, stats = flapping(app, args, supervised)
+        recovered = [result for result in results if result['recovered']]
+        seconds = [result['seconds'] for result in recovered]
+        print(f"{'supervised' if supervised else 'unsupervised':<14}{len(recovered):>6}/{len(results):<4}"
+              f"{percentile(seconds, 50):>16.2f}{max(seconds, default=0.0):>8.2f}"
+              f"{sum(result['buffered'] for result in results) / len(results):>17.1f}"
+              f"{sum(result['writes'] for result in recovered) / max(len(recovered), 1):>17.1f}"
+              f"{'ok' if final else 'wrong':>7}")
+        if supervised:
+            print(f"     {sent} toggles sent, sink: {stats}")
+            check('every outage recovered to the latest recording state', len(recovered) == len(results))
+            check('one write per light per recovery', all(result['writes'] <= 1 for result in recovered))
+            check('light ends in the final recording state', final)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        restored, took = reboot(app, args)
+    print(f"     bridge reboot: recording light restored after {took:.2f} s")
+    check('reconcile after a bridge reboot', restored)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        noticed, reopened, took, latency = port(app, args)
+    print(f"     MIDI port back: reopened after {took * 1000:.0f} ms, next toggle on the light in {latency * 1000:.1f} ms")
+    check('missing MIDI port noticed', noticed)
+    check('MIDI port reopened and handled', reopened)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+
+"""
+fakes.py
+
+Local stand-ins for the hardware logic_pro_to_hue.py talks to, so the pipeline can be exercised
+and benchmarked on Linux without Logic Pro, a MIDI driver or any network devices.
+"""
+
+import collections
+import itertools
+import json
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeMidiIn:
+    """Mimics the parts of rtmidi.MidiIn that the daemon and the tools use.
+
+    Messages passed to send() go to the registered callback, or are queued for get_message()
+    when no callback is set, just like rtmidi does. As with rtmidi, get_message() returns
+    nothing while a callback is set.
+
+    `present`, when set, is the set of port names the fake MIDI system currently has: ports can be
+    made to disappear and come back, and open_fake_midiinput() fails for missing ones.
+    """
+
+    present = None
+
+    def __init__(self, port_name="Fake Virtual Out"):
+        self.port_name = port_name
+        self._callback = None
+        self._data = None
+        self._pending = collections.deque()
+        self._last = None
+        self._lock = threading.Lock()
+        self._open = True
+
+    def set_callback(self, func, data=None):
+        self._callback = func
+        self._data = data
+
+    def cancel_callback(self):
+        self._callback = None
+        self._data = None
+
+    def get_message(self):
+        if self._callback is not None:
+            # rtmidi warns "a user callback is currently set for this port" and returns nothing
+            return None
+        try:
+            return self._pending.popleft()
+        except IndexError:
+            return None
+
+    def send(self, message):
+        """Inject one MIDI message as if it arrived on the port now."""
+        with self._lock:
+            now = time.monotonic()
+            deltatime = 0.0 if self._last is None else now - self._last
+            self._last = now
+        event = (list(message), deltatime)
+        callback = self._callback
+        if callback is not None:
+            callback(event, self._data)
+        else:
+            self._pending.append(event)
+
+    def get_ports(self):
+        return sorted(self.present) if self.present is not None else [self.port_name]
+
+    def is_port_open(self):
+        return self._open
+
+    def close_port(self):
+        self._open = False
+        self._callback = None
+
+
+def open_fake_midiinput(port=None, **kwargs):
+    """Drop-in replacement for rtmidi.midiutil.open_midiinput."""
+    if FakeMidiIn.present is not None and port not in FakeMidiIn.present:
+        raise OSError(f"MIDI port not found: {port}")
+    midiin = FakeMidiIn(port or "Fake Virtual Out")
+    return midiin, midiin.port_name
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        if self.server.fake.down:
+            # Hang up without an answer, the client sees the connection drop
+            self.close_connection = True
+            return
+        if self.server.fake.stream(self):
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else None
+        url = urlsplit(self.path)
+        status, result = self.server.fake.handle(self.command, url.path, parse_qs(url.query), body)
+        data = json.dumps(result).encode() if result is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # A client hanging up, e.g. a daemon process that was ended, is no error for a fake
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeHttpServer:
+    """Threaded JSON-over-HTTP server on 127.0.0.1; subclasses implement handle()."""
+
+    def __init__(self):
+        self.requests = []
+        self.down = False
+        self.server = _Server(('127.0.0.1', 0), _JsonHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def set_down(self, down):
+        """While down, every request is dropped without an answer, like a device that went away."""
+        self.down = down
+
+    def handle(self, method, path, query, body):
+        raise NotImplementedError
+
+    def stream(self, handler):
+        """Serve a long-lived response on `handler` and return True, or return False."""
+        return False
+
+
+class FakeAwtrix(FakeHttpServer):
+    """Stand-in for an Awtrix clock: keeps the custom apps it was sent."""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.apps = {}
+
+    def handle(self, method, path, query, body):
+        time.sleep(self.latency)
+        self.requests.append((time.monotonic(), method, path, query, body))
+        if method == 'POST' and path == '/api/custom':
+            name = query.get('name', [''])[0]
+            if body:
+                self.apps[name] = body
+            else:
+                self.apps.pop(name, None)
+            return 200, None
+        return 404, {'error': 'not found'}
+
+
+class FakeWebhook(FakeHttpServer):
+    """Webhook receiver: keeps (monotonic time, JSON body) of every POST, answering after `latency`."""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.received = []
+
+    def handle(self, method, path, query, body):
+        time.sleep(self.latency)
+        if method != 'POST':
+            return 405, {'error': 'method not allowed'}
+        self.received.append((time.monotonic(), body))
+        return 200, None
+
+
+class FakeMqttBroker:
+    """Just enough of an MQTT 3.1.1 broker for publishers: accepts CONNECT and records PUBLISH.
+
+    `published` holds (monotonic time, topic, payload, retain); `retained` the last payload per
+    topic. Every packet is handled after `latency` seconds, so a slow broker backs up its client.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.published = []
+        self.retained = {}
+        self.connects = 0
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self._closed = False
+        self._clients = []
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server.getsockname()[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self.server.close()
+        for client in self._clients:
+            client.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    @staticmethod
+    def _read(client, count):
+        data = b''
+        while len(data) < count:
+            chunk = client.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError('client went away')
+            data += chunk
+        return data
+
+    def _serve(self, client):
+        try:
+            while True:
+                header = self._read(client, 1)[0]
+                length, shift = 0, 0
+                while True:
+                    byte = self._read(client, 1)[0]
+                    length |= (byte & 0x7f) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = self._read(client, length)
+                time.sleep(self.latency)
+                kind = header >> 4
+                if kind == 1:
+                    self.connects += 1
+                    client.sendall(b'\x20\x02\x00\x00')
+                elif kind == 3:
+                    size = struct.unpack('>H', body[:2])[0]
+                    topic = body[2:2 + size].decode()
+                    payload = body[2 + size:]
+                    retain = bool(header & 1)
+                    self.published.append((time.monotonic(), topic, payload, retain))
+                    if retain:
+                        self.retained[topic] = payload
+                elif kind == 14:
+                    return
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+
+class FakeOscReceiver:
+    """UDP receiver for OSC messages with one int32 argument; keeps (monotonic time, address, value)."""
+
+    def __init__(self):
+        self.received = []
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.socket.getsockname()[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.socket.close()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.socket.recv(1024)
+            except OSError:
+                return
+            address = data[:data.index(b'\0')].decode()
+            self.received.append((time.monotonic(), address, struct.unpack('>i', data[-4:])[0]))
+
+
+class FakeHueBridge(FakeHttpServer):
+    """Stand-in for the Hue bridge v1 REST API: /config, /lights and /groups.
+
+    Every request waits `latency` seconds. With `rate_limit` set, writes are metered by a token
+    bucket of that many per second (and one more than that saved up, to absorb network jitter);
+    writes beyond it are refused with HTTP 429, like a saturated bridge.
+    `changed` maps each light id to the monotonic time its state was last written, so a benchmark
+    can tell when all lamps have switched.
+
+    GET /eventstream/clip/v2 is a server-sent event stream in the v2 format: every change,
+    including external_change() by "another app", is pushed to all connected streams.
+    """
+
+    def __init__(self, lights=4, groups=None, latency=0.0, username='fakeuser', rate_limit=None):
+        super().__init__()
+        self.latency = latency
+        self.username = username
+        self.rate_limit = rate_limit
+        self.rejected = 0
+        self._tokens = rate_limit
+        self._stamp = time.monotonic()
+        self.lock = threading.Lock()
+        self.lights = {
+            str(i): {'name': f"Lamp {i}", 'state': {'on': False, 'bri': 254, 'hue': 0, 'sat': 0}}
+            for i in range(1, lights + 1)
+        }
+        self.groups = {}
+        for i, (name, members) in enumerate((groups or {}).items(), 1):
+            self.groups[str(i)] = {'name': name, 'type': 'Room', 'lights': [str(m) for m in members]}
+        self.changed = {}
+        self.updated = threading.Condition(self.lock)
+        self.streams = []
+        self._event_ids = itertools.count(1)
+
+    def stop(self):
+        self.drop_streams()
+        super().stop()
+
+    def set_down(self, down):
+        super().set_down(down)
+        if down:
+            self.drop_streams()
+
+    def drop_streams(self):
+        """Close every event stream, as a bridge reboot or Wi-Fi hiccup would."""
+        with self.lock:
+            streams, self.streams = self.streams, []
+        for events in streams:
+            events.put(None)
+
+    def external_change(self, light_id, state):
+        """Change a light as the Hue app or a wall switch would, bypassing the REST API."""
+        with self.lock:
+            self.lights[str(light_id)]['state'].update(state)
+            self.changed[str(light_id)] = time.monotonic()
+            self.updated.notify_all()
+        self._emit([str(light_id)], state)
+
+    def stream(self, handler):
+        if handler.command != 'GET' or urlsplit(handler.path).path != '/eventstream/clip/v2':
+            return False
+        if handler.headers.get('hue-application-key') != self.username:
+            handler.send_error(403)
+            return True
+        events = queue.Queue()
+        with self.lock:
+            self.streams.append(events)
+        # Chunked like the bridge's: without a length the client would drop its hold on the socket
+        handler.close_connection = True
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        try:
+            data = b': hi\n\n'
+            while data is not None:
+                handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                data = events.get()
+            handler.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if events in self.streams:
+                    self.streams.remove(events)
+        return True
+
+    def _emit(self, light_ids, body):
+        resource = {}
+        if 'on' in body:
+            resource['on'] = {'on': body['on']}
+        if 'bri' in body:
+            resource['dimming'] = {'brightness': round(body['bri'] / 2.54, 2)}
+        if 'xy' in body:
+            resource['color'] = {'xy': {'x': body['xy'][0], 'y': body['xy'][1]}}
+        elif 'hue' in body or 'sat' in body:
+            # Not a real colour conversion, just something that changes with hue and sat
+            state = self.lights[light_ids[0]]['state']
+            resource['color'] = {'xy': {'x': round(state.get('hue', 0) / 65535 * 0.7, 4),
+                                        'y': round(state.get('sat', 0) / 254 * 0.8, 4)}}
+        if 'ct' in body:
+            resource['color_temperature'] = {'mirek': body['ct']}
+        if not resource:
+            return
+        event_id = next(self._event_ids)
+        payload = [{
+            'creationtime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'id': f"event-{event_id}",
+            'type': 'update',
+            'data': [dict(resource, id=f"light-{light_id}", id_v1=f"/lights/{light_id}", type='light')
+                     for light_id in light_ids],
+        }]
+        data = f"id: {int(time.time())}:{event_id}\ndata: {json.dumps(payload)}\n\n".encode()
+        with self.lock:
+            streams = list(self.streams)
+        for events in streams:
+            events.put(data)
+
+    def wait_until(self, predicate, timeout=5.0):
+        """Block until predicate() holds after a light write, return False on timeout."""
+        with self.updated:
+            return self.updated.wait_for(predicate, timeout)
+
+    def handle(self, method, path, query, body):
+        time.sleep(self.latency)
+        now = time.monotonic()
+        with self.lock:
+            self.requests.append((now, method, path))
+        parts = path.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'api' or parts[1] != self.username:
+            return 200, [{'error': {'type': 1, 'address': path, 'description': 'unauthorized user'}}]
+        resource = parts[2:]
+        if method == 'GET' and resource == ['config']:
+            return 200, {'name': 'Fake bridge', 'whitelist': {self.username: {}}}
+        if method == 'GET' and resource == ['lights']:
+            return 200, self.lights
+        if method == 'GET' and resource == ['groups']:
+            return 200, self.groups
+        if method == 'PUT' and len(resource) == 3 and resource[0] == 'lights' and resource[2] == 'state':
+            return self._set(path, [resource[1]], body, now)
+        if method == 'PUT' and len(resource) == 3 and resource[0] == 'groups' and resource[2] == 'action':
+            group = self.groups.get(resource[1])
+            members = list(self.lights) if resource[1] == '0' else group and group['lights']
+            return self._set(path, members, body, now)
+        return 404, [{'error': {'type': 3, 'address': path, 'description': 'resource not available'}}]
+
+    def _over_limit(self, now):
+        if self.rate_limit is None:
+            return False
+        with self.lock:
+            self._tokens = min(self.rate_limit + 1, self._tokens + (now - self._stamp) * self.rate_limit)
+            self._stamp = now
+            if self._tokens < 1:
+                self.rejected += 1
+                return True
+            self._tokens -= 1
+            return False
+
+    def _set(self, path, light_ids, body, now):
+        if self._over_limit(now):
+            return 429, [{'error': {'type': 901, 'address': path, 'description': 'rate limited'}}]
+        if not light_ids or any(light_id not in self.lights for light_id in light_ids):
+            return 200, [{'error': {'type': 3, 'address': path, 'description': 'resource not available'}}]
+        with self.lock:
+            for light_id in light_ids:
+                self.lights[light_id]['state'].update(body or {})
+                self.changed[light_id] = now
+            self.updated.notify_all()
+        self._emit(light_ids, body or {})
+        base = path.rsplit('/', 1)[0].split('/api/' + self.username, 1)[1]
+        return 200, [{'success': {f"{base}/{key}": value}} for key, value in (body or {}).items()]
@@ -1,44 +1,141 @@
-import requests
+#!/usr/bin/env python3
 
-import configparser
+"""
+hue_controller.py
 
-# Load config from external file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Read the light configuration from the config file
-HUE_BRIDGE_IP = config.get('Hue', 'BRIDGE_IP')
-LIGHT_ID = config.getint('Hue', 'LIGHT_ID')
-USERNAME = config.get('Hue', 'USERNAME')
-API_KEY = config.get('Hue','API_KEY')
-FOCUS_MODE = config.get('Hue','FOCUS_MODE')
-
-print (API_KEY)
-
-# Philips Hue bridge IP address and API key
-#HUE_BRIDGE_IP = "YOUR_HUE_BRIDGE_IP_ADDRESS"
-#API_KEY = "YOUR_HUE_API_KEY"
-
-# Base URL for API requests
-BASE_URL = f"http://{HUE_BRIDGE_IP}/api/{API_KEY}"
-
-def get_lights(state):
-    lights_url = f"{BASE_URL}/lights"
-    response = requests.get(lights_url)
-    lights = response.json()
-
-    lights_info = [
-        (light_id, details['name'])
-        for light_id, details in lights.items()
-        if details['state']['on'] == state
-    ]
-    return lights_info
-
-def turn_on_off_lights(state):
-    if state == 'on':
-        lights = get_lights(False)
-    else:
-        lights = get_lights(True)
+Switch Hue lights on or off, interactively or from the command line.
+
+All writes of one action are handed to the shared CommandScheduler at once, which sends them in
+parallel as fast as the bridge's rate limits allow; a whole room goes out as one group action.
+The light inventory is cached for a few seconds (or followed live by the event stream mirror),
+so choosing lights does not download /lights for every step.
+
+Usage: python tools/hue_controller.py                         interactive menu
+       python tools/hue_controller.py list [--on | --off] [--room ROOM]
+       python tools/hue_controller.py on|off [--room ROOM] [--lights 1,2,3]
+       Without --room or --lights, on/off switch every light.
+"""
+
+import argparse
+import configparser
+import os
+import sys
+import threading
+import time
+
+# Share the keep-alive bridge client with the main script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from hue_client import get_client
+from light_dispatch import parse_list
+from light_mirror import LightMirror
+from scheduler import PRIORITY_BULK, RESULT_TIMEOUT, get_scheduler
+
+
+class Inventory:
+    """The bridge's lights and groups, read again at most every `ttl` seconds.
+
+    While a live mirror is attached, light states come from the mirror instead.
+    """
+
+    def __init__(self, client, ttl=5.0, mirror=None):
+        self.client = client
+        self.ttl = ttl
+        self.mirror = mirror
+        self.fetches = 0
+        self._lights = None
+        self._groups = None
+        self._stamp = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        with self._lock:
+            if self._lights is None or time.monotonic() - self._stamp > self.ttl:
+                self._lights = self.client.get_lights()
+                self._groups = self.client.get_groups()
+                self._stamp = time.monotonic()
+                self.fetches += 1
+            return self._lights, self._groups
+
+    def invalidate(self):
+        self._stamp = 0.0
+
+    def lights(self):
+        """Return {light id: {'name': ..., 'state': {...}}}."""
+        if self.mirror is not None and self.mirror.live:
+            return {light_id: {'name': self.mirror.names.get(light_id, light_id), 'state': self.mirror.state(light_id)}
+                    for light_id in list(self.mirror.lights)}
+        return self._refresh()[0]
+
+    def groups(self):
+        return self._refresh()[1]
+
+    def find_group(self, room):
+        """Return the id of a room or zone given by name or id, None when unknown."""
+        groups = self.groups()
+        if room in groups:
+            return room
+        for group_id, details in groups.items():
+            if details.get('name', '').lower() == room.lower():
+                return group_id
+        return None
+
+
+class HueController:
+    """Bulk light operations on one bridge."""
+
+    def __init__(self, scheduler, inventory, priority=PRIORITY_BULK):
+        self.scheduler = scheduler
+        self.inventory = inventory
+        self.priority = priority
+
+    def lights(self, on=None, room=None):
+        """Return [(light id, name)], optionally only lights that are on/off or in a room."""
+        lights = self.inventory.lights()
+        members = None
+        if room is not None:
+            group_id = self.inventory.find_group(room)
+            if group_id is None:
+                raise KeyError(f"No room or zone named {room}")
+            members = set(self.inventory.groups()[group_id].get('lights', []))
+        return [(light_id, details['name']) for light_id, details in lights.items()
+                if (on is None or details['state'].get('on') == on) and (members is None or light_id in members)]
+
+    def set_lights(self, light_ids, state):
+        """Send `state` to every light in parallel and wait; returns the ids that failed."""
+        futures = [(light_id, self.scheduler.set_light_state(light_id, state, self.priority)) for light_id in light_ids]
+        failed = [light_id for light_id, future in futures if not _succeeded(future)]
+        self.inventory.invalidate()
+        return failed
+
+    def set_room(self, room, state):
+        """Send `state` to a room or zone with one group action, light by light if that fails."""
+        group_id = self.inventory.find_group(room)
+        if group_id is None:
+            raise KeyError(f"No room or zone named {room}")
+        if _succeeded(self.scheduler.set_group_action(group_id, state, self.priority)):
+            self.inventory.invalidate()
+            return []
+        return self.set_lights(self.inventory.groups()[group_id].get('lights', []), state)
+
+    def set_all(self, state):
+        """Send `state` to every light with one action on group 0."""
+        if _succeeded(self.scheduler.set_group_action('0', state, self.priority)):
+            self.inventory.invalidate()
+            return []
+        return self.set_lights(list(self.inventory.lights()), state)
+
+
+def _succeeded(future):
+    try:
+        result = future.result(RESULT_TIMEOUT)
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return False
+    return not (isinstance(result, list) and any('error' in item for item in result))
+
+
+def turn_on_off_lights(controller, state):
+    lights = controller.lights(on=state != 'on')
 
     if not lights:
         print(f"No lights are {'off' if state == 'on' else 'on'}")
@@ -52,19 +149,20 @@ def turn_on_off_lights(state):
     if selection.lower() == 'q':
         return
 
-    selected_numbers = [int(x.strip()) for x in selection.split(',') if x.strip().isdigit()]
-
-    for selected_number in selected_numbers:
-        if 0 < selected_number <= len(lights):
-            selected_light_id, _ = lights[selected_number - 1]
-            light_url = f"{BASE_URL}/lights/{selected_light_id}/state"
-            print(light_url)
-            requests.put(light_url, json={"on": state == 'on'})
-            print(f"Light '{lights[selected_number - 1][1]}' turned {'on' if state == 'on' else 'off'}")
+    selected = []
+    for number in [int(x.strip()) for x in selection.split(',') if x.strip().isdigit()]:
+        if 0 < number <= len(lights):
+            selected.append(lights[number - 1])
         else:
-            print(f"Invalid selection: {selected_number}")
+            print(f"Invalid selection: {number}")
 
-def main():
+    failed = controller.set_lights([light_id for light_id, _ in selected], {"on": state == 'on'})
+    for light_id, light_name in selected:
+        if light_id not in failed:
+            print(f"Light '{light_name}' turned {'on' if state == 'on' else 'off'}")
+
+
+def menu(controller):
     while True:
         print("\nSelect an action:")
         print("1. Turn on lights")
@@ -73,14 +171,79 @@ def main():
 
         choice = input("Enter your choice: ")
         if choice == '1':
-            turn_on_off_lights('on')
+            turn_on_off_lights(controller, 'on')
         elif choice == '2':
-            turn_on_off_lights('off')
+            turn_on_off_lights(controller, 'off')
         elif choice == '3':
             break
         else:
             print("Invalid choice. Please enter a valid option.")
 
-if __name__ == "__main__":
-    main()
 
+def run_command(controller, args):
+    if args.command == 'list':
+        on = True if args.on else False if args.off else None
+        for light_id, name in controller.lights(on=on, room=args.room):
+            print(f"{light_id}\t{name}")
+        return 0
+
+    state = {"on": args.command == 'on'}
+    start = time.perf_counter()
+    if args.lights:
+        targets = f"lights {args.lights}"
+        failed = controller.set_lights(parse_list(args.lights), state)
+    elif args.room:
+        targets = args.room
+        failed = controller.set_room(args.room, state)
+    else:
+        targets = 'all lights'
+        failed = controller.set_all(state)
+    print(f"Turned {targets} {args.command} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('command', nargs='?', choices=('list', 'on', 'off'), help='leave out for the menu')
+    parser.add_argument('--room', help='room or zone name (or group id)')
+    parser.add_argument('--lights', help='comma separated light ids')
+    parser.add_argument('--on', action='store_true', help='list: only lights that are on')
+    parser.add_argument('--off', action='store_true', help='list: only lights that are off')
+    args = parser.parse_args()
+
+    # Load config from external file
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    HUE_BRIDGE_IP = config.get('Hue', 'BRIDGE_IP')
+    API_KEY = config.get('Hue', 'API_KEY')
+    EVENT_STREAM_URL = config.get('Hue', 'EVENT_STREAM_URL', fallback='')
+
+    # Pooled client for API requests, writes are paced by the shared scheduler
+    bridge = get_client(HUE_BRIDGE_IP, API_KEY)
+    scheduler = get_scheduler(HUE_BRIDGE_IP, API_KEY)
+    mirror = None
+    if args.command is None:
+        # The menu runs for a while: follow light states over the event stream
+        mirror = LightMirror(bridge, EVENT_STREAM_URL or None).start()
+        scheduler.mirror = mirror
+    controller = HueController(scheduler, Inventory(bridge, mirror=mirror))
+
+    try:
+        if args.command is None:
+            menu(controller)
+            return 0
+        return run_command(controller, args)
+    except KeyError as e:
+        print(e.args[0])
+        return 1
+    finally:
+        scheduler.close()
+        if mirror:
+            mirror.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
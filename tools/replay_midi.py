@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+replay_midi.py
+
+Replay a recorded MIDI session through the whole pipeline against the fake bridge.
+
+The log (recorded with `tools/test_ports.py --record FILE`) is fed into the MIDI dispatcher at
+its original pace, N times faster or as fast as possible. The report shows how the pipeline
+kept up and checks that the lights end up in the recording state the session left them in.
+`--synthesize SECONDS` first writes a made-up session (120 bpm clock, notes and a record
+toggle every few seconds) to the log path, so this runs without a Mac or Logic.
+
+Usage: python tools/replay_midi.py SESSION.midilog [--speed N] [--synthesize SECONDS] [--flood]
+       --speed 1 plays in real time (default), 0 as fast as possible.
+       The replay waits while the dispatcher queue is full; --flood doesn't, like rtmidi.
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from benchmark import Run, load_app
+from midi_decoder import MidiDecoder
+from midi_log import MidiLog, MidiRecorder, replay
+from rules import RECORDING
+
+
+def synthesize(path, seconds, seed=1):
+    """Write a session of `seconds`: clock, a busy keyboard part and periodic record toggles."""
+    rng = random.Random(seed)
+    tick = 0.5 / 24
+    now = last = 0.0
+    recording = False
+    next_toggle = 2.0
+    with MidiRecorder(path) as recorder:
+        recorder.write([0xFA], 0.0)
+        while now < seconds:
+            now += tick
+            events = [[0xF8]]
+            if rng.random() < 0.3:
+                events.append([0x90, rng.randrange(48, 72), rng.randrange(30, 128)])
+            if rng.random() < 0.2:
+                events.append([0x80, rng.randrange(48, 72), 64])
+            if now >= next_toggle:
+                recording = not recording
+                events.append([0x90, 24, 127 if recording else 0])
+                next_toggle += rng.uniform(1.0, 4.0)
+            for message in events:
+                recorder.write(message, now - last)
+                last = now
+        recorder.write([0xFC], tick)
+        return recorder.count
+
+
+def expected_recording(app, path):
+    """The recording state the session ends in, according to the active rules."""
+    decoder = MidiDecoder()
+    state = None
+    with MidiLog(path) as log:
+        for message, _ in log:
+            for record in decoder.decode_batch([message]):
+                for action in app.rule_engine.match(record):
+                    if action[0] == RECORDING:
+                        state = action[1]
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('log')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 = as fast as possible')
+    parser.add_argument('--synthesize', type=float, metavar='SECONDS', help='write a synthetic session first')
+    parser.add_argument('--latency', type=float, default=5.0, help='fake bridge response time in ms')
+    parser.add_argument('--rate-limit', type=int, default=10, help='writes per second the fake bridge accepts')
+    parser.add_argument('--lights', type=int, default=1)
+    parser.add_argument('--flood', action='store_true', help='never wait for the dispatcher, let its queue drop')
+    args = parser.parse_args()
+    path = os.path.abspath(args.log)
+
+    if args.synthesize:
+        count = synthesize(path, args.synthesize)
+        print(f"wrote {count} messages ({os.path.getsize(path)} bytes) to {path}")
+
+    app = load_app()
+    expected = expected_recording(app, path)
+    with MidiLog(path) as log, contextlib.redirect_stdout(open(os.devnull, 'w')):
+        with Run(app, args, args.lights) as run:
+            sink = run.dispatcher.on_midi
+            if not args.flood:
+                limit = run.dispatcher.queue.maxsize - 1
+
+                def sink(event, on_midi=run.dispatcher.on_midi, queue=run.dispatcher.queue):
+                    while queue.qsize() >= limit:
+                        time.sleep(0)
+                    on_midi(event)
+            count, elapsed, lateness = replay(log, sink, args.speed)
+            deadline = time.monotonic() + 30
+            while run.dispatcher.handled + run.dispatcher.dropped < count and time.monotonic() < deadline:
+                time.sleep(0.005)
+            # Let the coalescing window close and the scheduler drain
+            scheduler = app.get_scheduler(app.BRIDGE_IP, app.USERNAME)
+            time.sleep(app.COALESCE_MS / 1000.0 + 0.05)
+            while (any(scheduler.depth().values()) or scheduler.inflight) and time.monotonic() < deadline:
+                time.sleep(0.005)
+            handled, dropped = run.dispatcher.handled, run.dispatcher.dropped
+            counters = app.recording.counters()
+            stats = scheduler.stats()
+            final = [run.bridge.lights[i]['state']['on'] for i in run.light_ids]
+
+    print(f"replayed {count} messages in {elapsed:.2f} s at speed {args.speed or 'max'} "
+          f"({count / elapsed:.0f} msg/s), worst lateness {lateness * 1000:.1f} ms")
+    print(f"dispatcher: {handled} handled, {dropped} dropped")
+    print(f"recording:  {counters}")
+    print(f"hue:        sent={stats['sent']} merged={stats['merged']} skipped={stats['skipped']} "
+          f"rate_limited={stats['rate_limited']} failed={stats['failed']}")
+    print(f"final light state: {'on' if all(final) else 'off' if not any(final) else final}, "
+          f"session ends {'recording' if expected else 'not recording'}")
+    if expected is not None and final != [expected] * len(final):
+        print('FAIL lights do not match the end of the session')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+
+"""
+soak.py
+
+Soak test: replay compressed days of studio traffic through the daemon and watch for leaks.
+
+The whole daemon runs in this process: supervised, with metrics, the status API, every sink,
+Focus watching and hot-reloaded rules. The stand-ins (Hue bridge, Awtrix clock, MQTT broker,
+OSC receiver, webhook) and the status subscribers run in a child process, so their bookkeeping
+is not counted. Each simulated day lasts `--day` seconds and brings the following:
+
+- MIDI clock and notes at `--rate` messages per second
+- record toggles
+- rule actions: light states, scenes and webhooks
+- Focus switches and a rules edit
+- a bridge outage
+- a MIDI port that disappears and comes back
+- status subscribers that come and go
+- metrics scrapes
+
+Every `--sample` seconds the harness records RSS, traced Python memory, open file descriptors,
+sockets and threads. The first day is warm-up: pools fill and caches load. After that, growth
+up to the end must stay under the thresholds, or the run fails. Either way the report lists the
+tracemalloc allocators that grew most.
+
+Usage: python tools/soak.py [--days N] [--day SECONDS] [--rate N] [--sample SECONDS] [--csv FILE]
+                            [--max-rss-mb MB] [--max-traced-mb MB] [--max-fds N] [--max-threads N]
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import selectors
+import shutil
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'src'))
+from benchmark import load_app
+from fakes import FakeAwtrix, FakeHueBridge, FakeMidiIn, FakeMqttBroker, FakeOscReceiver, FakeWebhook, open_fake_midiinput
+from focus import FocusCache
+from metrics import process_stats
+
+PORT_NAME = 'Soak Virtual Out'
+RESOURCES = ('rss_mb', 'traced_mb', 'fds', 'sockets', 'threads')
+
+
+def free_port():
+    with socket.create_server(('127.0.0.1', 0)) as sock:
+        return sock.getsockname()[1]
+
+
+class Subscribers:
+    """Status API subscribers that read and discard everything; churn() replaces the oldest."""
+
+    def __init__(self, port):
+        self.port = port
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.sockets = []
+        self.received = 0
+        self.opened = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def open(self):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        if self.opened % 2:
+            key = base64.b64encode(os.urandom(16)).decode()
+            request = (f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                       f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+        else:
+            request = 'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        sock.sendall(request.encode())
+        sock.setblocking(False)
+        with self.lock:
+            self.sockets.append(sock)
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.opened += 1
+
+    def churn(self):
+        with self.lock:
+            sock = self.sockets.pop(0)
+            self.selector.unregister(sock)
+        sock.close()
+        self.open()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                ready = self.selector.select(0.05)
+                for key, _ in ready:
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:
+                        data = b''
+                    if not data:
+                        self.selector.unregister(key.fileobj)
+                    self.received += len(data)
+            time.sleep(0.001)
+
+
+def serve_stand_ins(conn):
+    """Child process: the devices the daemon talks to, and the status subscribers."""
+    bridge = FakeHueBridge(3, groups={'Studio': [1, 2, 3]}, latency=0.002).start()
+    awtrix = FakeAwtrix().start()
+    mqtt = FakeMqttBroker().start()
+    osc = FakeOscReceiver().start()
+    webhook = FakeWebhook().start()
+    subscribers = None
+    conn.send({'bridge': bridge.host, 'username': bridge.username, 'awtrix': awtrix.host,
+               'mqtt': mqtt.address, 'osc': osc.address, 'webhook': webhook.host})
+    while True:
+        command, *params = conn.recv()
+        if command == 'down':
+            bridge.set_down(params[0])
+            conn.send(True)
+        elif command == 'light':
+            conn.send(bridge.lights['1']['state']['on'])
+        elif command == 'subscribe':
+            port, count = params
+            subscribers = Subscribers(port)
+            for _ in range(count):
+                subscribers.open()
+            conn.send(True)
+        elif command == 'churn':
+            subscribers.churn()
+            conn.send(True)
+        elif command == 'scrape':
+            with urllib.request.urlopen(f"http://127.0.0.1:{params[0]}/metrics", timeout=5) as response:
+                text = response.read().decode()
+            conn.send({line.split()[0]: float(line.split()[1]) for line in text.splitlines()
+                       if line.startswith('lp2hue_process_')})
+        elif command == 'counts':
+            # What reached each device since the last call; cleared so the stand-ins stay small too
+            counts = {
+                'hue writes': sum(1 for _, method, _ in bridge.requests if method == 'PUT'),
+                'awtrix': len(awtrix.requests), 'mqtt': len(mqtt.published), 'osc': len(osc.received),
+                'webhook': len(webhook.received), 'status kB': subscribers.received // 1024 if subscribers else 0,
+            }
+            for records in (bridge.requests, awtrix.requests, mqtt.published, osc.received, webhook.received):
+                del records[:]
+            if subscribers:
+                subscribers.received = 0
+            conn.send(counts)
+        elif command == 'stop':
+            for fake in (bridge, awtrix, mqtt, osc, webhook):
+                fake.stop()
+            conn.send(True)
+            return
+
+
+class StandIns:
+    """The stand-in process, driven over a pipe."""
+
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.get_context('spawn').Process(target=serve_stand_ins, args=(child,),
+                                                                     daemon=True)
+        self.process.start()
+        self.addresses = self.conn.recv()
+
+    def call(self, *command):
+        self.conn.send(command)
+        return self.conn.recv()
+
+    def stop(self):
+        self.call('stop')
+        self.process.join()
+
+
+def write_rules(path, webhook_url, bri):
+    rules = {
+        'rules': [
+            {'name': 'Record on', 'note': 24, 'velocity': 127, 'actions': [{'type': 'recording', 'on': True}]},
+            {'name': 'Record off', 'note': 24, 'velocity': 0, 'actions': [{'type': 'recording', 'on': False}]},
+            {'name': 'Fader', 'cc': 7, 'value': [1, 127],
+             'actions': [{'type': 'set_state', 'lights': [2], 'state': {'on': True, 'bri': bri}}]},
+            {'name': 'Pad', 'note': 36, 'velocity': [1, 127], 'actions': [{'type': 'scene', 'group': '1', 'scene': 'Soak'}]},
+            {'name': 'Sustain', 'cc': 64, 'value': [64, 127],
+             'actions': [{'type': 'webhook', 'url': webhook_url, 'body': {'sustain': True}}]},
+        ],
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(rules, f)
+    os.replace(tmp, path)
+
+
+def sample(start, day):
+    """One row of resource figures for this process."""
+    stats = process_stats()
+    return {
+        'seconds': round(time.monotonic() - start, 1), 'day': round(day, 2),
+        'rss_mb': stats['rss_bytes'] / 2 ** 20, 'traced_mb': tracemalloc.get_traced_memory()[0] / 2 ** 20,
+        'fds': stats['fds'], 'sockets': stats['sockets'], 'threads': stats['threads'],
+    }
+
+
+class Traffic:
+    """Synthetic MIDI for one port: clock, notes and now and then a fader, a pad or the sustain pedal."""
+
+    def __init__(self, rate, seed=1):
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.sent = 0
+
+    def batch(self, inputs, count):
+        midiin = inputs[0][0]
+        if midiin is None:
+            # The port is gone; Logic's messages are lost, as they would be
+            return
+        rng = self.rng
+        for _ in range(count):
+            roll = rng.random()
+            if roll < 0.6:
+                message = [0xF8]
+            elif roll < 0.8:
+                message = [0x90, rng.randrange(48, 72), rng.randrange(30, 128)]
+            elif roll < 0.99:
+                message = [0x80, rng.randrange(48, 72), 64]
+            elif roll < 0.995:
+                message = [0xB0, 7, rng.randrange(1, 128)]
+            elif roll < 0.998:
+                message = [0x99, 36, 100]
+            else:
+                message = [0xB0, 64, 127]
+            midiin.send(message)
+        self.sent += count
+
+
+def soak(args, app, stand_ins, workdir, rows, csv):
+    addresses = stand_ins.addresses
+    rules_path = os.path.join(os.getcwd(), 'rules.json')
+    webhook_url = f"http://{addresses['webhook']}/rule"
+    write_rules(rules_path, webhook_url, 200)
+    focus_dir = os.path.join(workdir, 'focus')
+    shutil.copytree(os.path.join(TOOLS, 'fixtures', 'focus'), focus_dir)
+    assert_path = os.path.join(focus_dir, 'Assertions.json')
+    with open(os.path.join(focus_dir, 'Assertions.json')) as f:
+        idle = f.read()
+    with open(os.path.join(focus_dir, 'Assertions_active.json')) as f:
+        active = f.read()
+
+    app.focus_cache = FocusCache(assert_path, os.path.join(focus_dir, 'ModeConfigurations.json'))
+    # Focus changes are watched and published but do not gate, so every toggle must reach the light
+    app.FOCUS_MODE, app.FOCUS_POLL = '', 1.0
+    app.SUPERVISED, app.BACKOFF_MIN, app.BACKOFF_MAX, app.PORT_CHECK = True, 0.1, 1.0, 0.2
+    app.BRIDGE_IP, app.USERNAME = addresses['bridge'], addresses['username']
+    app.EVENT_STREAM_URL = f"http://{addresses['bridge']}/eventstream/clip/v2"
+    app.LIGHT_IDS, app.ROOMS = [1], []
+    app.AWTRIX_HOST, app.MQTT_BROKER, app.OSC_TARGET = addresses['awtrix'], addresses['mqtt'], addresses['osc']
+    app.WEBHOOK_URL = f"http://{addresses['webhook']}/recording"
+    app.STATUS_PORT, app.METRICS_PORT = free_port(), free_port()
+
+    before = sample(time.monotonic(), 0)
+    FakeMidiIn.present = {PORT_NAME}
+    midiin = FakeMidiIn(PORT_NAME)
+    inputs = [(midiin, PORT_NAME)]
+    dispatcher = app.start(inputs, open_port=open_fake_midiinput)
+    stand_ins.call('subscribe', app.status_server.port, args.subscribers)
+
+    traffic = Traffic(args.rate)
+    recording = False
+    toggles = 0
+    start = time.monotonic()
+    next_sample = start
+    step = 0.01
+    per_step = max(1, int(args.rate * step))
+    events = []
+    for day in range(args.days):
+        base = day * args.day
+        events += [(base + args.day * (i + 0.5) / args.toggles, 'toggle') for i in range(args.toggles)]
+        events += [(base + args.day * (i + 0.25) / args.focus, 'focus') for i in range(args.focus)]
+        events += [(base + args.day * (i + 0.1) / args.churn, 'churn') for i in range(args.churn)]
+        events += [(base + args.day * 0.3, 'outage'), (base + args.day * 0.3 + args.outage, 'back'),
+                   (base + args.day * 0.6, 'port gone'), (base + args.day * 0.6 + 0.5, 'port back'),
+                   (base + args.day * 0.8, 'rules')]
+    events.sort()
+    focus_on = False
+    daily = []
+    baseline = None
+    try:
+        while True:
+            now = time.monotonic() - start
+            if now >= args.days * args.day:
+                break
+            while events and events[0][0] <= now:
+                _, event = events.pop(0)
+                if event == 'toggle' and inputs[0][0] is not None:
+                    recording = not recording
+                    toggles += 1
+                    inputs[0][0].send([0x90, 24, 127 if recording else 0])
+                elif event == 'focus':
+                    focus_on = not focus_on
+                    tmp = assert_path + '.tmp'
+                    with open(tmp, 'w') as f:
+                        f.write(active if focus_on else idle)
+                    os.replace(tmp, assert_path)
+                elif event == 'churn':
+                    stand_ins.call('churn')
+                elif event in ('outage', 'back'):
+                    stand_ins.call('down', event == 'outage')
+                elif event in ('port gone', 'port back'):
+                    FakeMidiIn.present = set() if event == 'port gone' else {PORT_NAME}
+                elif event == 'rules':
+                    write_rules(rules_path, webhook_url, 100 + int(now) % 150)
+            traffic.batch(inputs, per_step)
+            if time.monotonic() >= next_sample:
+                if baseline is None and now >= args.day:
+                    # Warm-up is over; the snapshot is taken first so its own memory does not count as growth
+                    baseline = tracemalloc.take_snapshot()
+                row = sample(start, now / args.day)
+                row['steady'] = baseline is not None
+                row['scraped'] = stand_ins.call('scrape', app.metrics_server.port).get('lp2hue_process_open_fds', -1)
+                rows.append(row)
+                print(f"{row['seconds']:>8.1f}{row['day']:>7.2f}{traffic.sent:>11}{row['rss_mb']:>9.1f}"
+                      f"{row['traced_mb']:>11.2f}{row['fds']:>6}{row['sockets']:>9}{row['threads']:>9}")
+                if csv:
+                    csv.write(','.join(str(row[key]) for key in ('seconds', 'day') + RESOURCES) + '\n')
+                    csv.flush()
+                next_sample += args.sample
+                if int(now / args.day) > len(daily):
+                    daily.append(stand_ins.call('counts'))
+            time.sleep(max(0.0, step - (time.monotonic() - start - now)))
+        daily.append(stand_ins.call('counts'))
+        # The last toggle has to be on the light once the supervisor caught up
+        deadline = time.monotonic() + 5
+        while stand_ins.call('light') != recording and time.monotonic() < deadline:
+            time.sleep(0.05)
+        light_ok = stand_ins.call('light') == recording
+        counters = app.recording.counters()
+    finally:
+        app.stop(inputs, dispatcher)
+        FakeMidiIn.present = None
+    time.sleep(0.5)
+    after = sample(start, args.days)
+    return {'before': before, 'after': after, 'toggles': toggles, 'sent': traffic.sent, 'light_ok': light_ok,
+            'daily': daily, 'counters': counters, 'baseline': baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--days', type=int, default=4, help='simulated days, the first is warm-up')
+    parser.add_argument('--day', type=float, default=45.0, help='seconds per simulated day')
+    parser.add_argument('--rate', type=int, default=2000, help='MIDI messages per second')
+    parser.add_argument('--toggles', type=int, default=120, help='record toggles per day')
+    parser.add_argument('--focus', type=int, default=8, help='Focus switches per day')
+    parser.add_argument('--churn', type=int, default=30, help='status subscribers replaced per day')
+    parser.add_argument('--subscribers', type=int, default=20, help='status subscribers connected')
+    parser.add_argument('--outage', type=float, default=1.0, help='seconds of bridge outage per day')
+    parser.add_argument('--sample', type=float, default=5.0, help='seconds between samples')
+    parser.add_argument('--frames', type=int, default=1, help='traceback frames tracemalloc keeps and lists')
+    parser.add_argument('--top', type=int, default=10, help='allocators to list')
+    parser.add_argument('--csv', help='also write the samples to this file')
+    parser.add_argument('--max-rss-mb', type=float, default=8.0, help='allowed RSS growth after warm-up')
+    parser.add_argument('--max-traced-mb', type=float, default=2.0, help='allowed traced Python memory growth')
+    parser.add_argument('--max-fds', type=int, default=4, help='allowed growth of open file descriptors')
+    parser.add_argument('--max-sockets', type=int, default=4, help='allowed growth of open sockets')
+    parser.add_argument('--max-threads', type=int, default=2, help='allowed growth of threads')
+    args = parser.parse_args()
+    if args.days < 2:
+        parser.error('--days must be at least 2, the first day is warm-up')
+
+    tracemalloc.start(args.frames)
+    stand_ins = StandIns()
+    app = load_app()
+    workdir = os.getcwd()
+    rows = []
+    csv = open(args.csv, 'w') if args.csv else None
+    if csv:
+        csv.write(','.join(('seconds', 'day') + RESOURCES) + '\n')
+    print(f"{args.days} days of {args.day:.0f} s, {args.rate} MIDI msgs/s, {args.toggles} toggles, {args.focus} Focus "
+          f"switches, {args.churn} subscriber reconnects, 1 bridge outage and 1 lost port per day")
+    print(f"{'seconds':>8}{'day':>7}{'MIDI msgs':>11}{'RSS MB':>9}{'traced MB':>11}{'fds':>6}{'sockets':>9}{'threads':>9}")
+    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+        result = soak(args, app, stand_ins, workdir, rows, csv)
+    final_snapshot = tracemalloc.take_snapshot()
+    stand_ins.stop()
+    if csv:
+        csv.close()
+
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    print('per day: ' + '; '.join(', '.join(f"{key} {value}" for key, value in counts.items())
+                                  for counts in result['daily'][:args.days]))
+    print(f"{result['sent']} MIDI messages, {result['toggles']} record toggles, recording events: {result['counters']}")
+    steady = [row for row in rows if row['steady']]
+    window = max(1, min(3, len(steady) // 3))
+    limits = {'rss_mb': args.max_rss_mb, 'traced_mb': args.max_traced_mb, 'fds': args.max_fds,
+              'sockets': args.max_sockets, 'threads': args.max_threads}
+    for key in RESOURCES:
+        first = statistics.median(row[key] for row in steady[:window])
+        last = statistics.median(row[key] for row in steady[-window:])
+        peak = max(row[key] for row in steady)
+        growth = last - first
+        per_day = growth / max(steady[-1]['day'] - steady[0]['day'], 1e-9)
+        unit = ' MB' if key.endswith('_mb') else ''
+        print(f"     {key:<10} after warm-up {first:8.2f}{unit}, at the end {last:8.2f}{unit}, peak {peak:8.2f}{unit}, "
+              f"{per_day:+.3f}{unit} per day")
+        check(f"{key} growth {growth:+.2f} within {limits[key]}", growth <= limits[key])
+    check('the metrics endpoint reports the same open descriptors (within 4)',
+          all(abs(row['scraped'] - row['fds']) <= 4 for row in steady))
+    check('every record toggle reached the recording state machine',
+          result['counters']['received'] == result['toggles'])
+    check('the light shows the last record toggle', result['light_ok'])
+    print(f"     after stop(): {result['after']['threads']} threads, {result['after']['sockets']} sockets, "
+          f"{result['after']['fds']} fds (before start(): {result['before']['threads']}, "
+          f"{result['before']['sockets']}, {result['before']['fds']})")
+
+    if result['baseline'] is not None:
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen *>'),
+                   tracemalloc.Filter(False, __file__)]
+        group = 'traceback' if args.frames > 1 else 'lineno'
+        stats = final_snapshot.filter_traces(filters).compare_to(result['baseline'].filter_traces(filters), group)
+        print(f"top {args.top} allocators by growth since the end of warm-up:")
+        for stat in stats[:args.top]:
+            frame = stat.traceback[-1]
+            print(f"  {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7} blocks  "
+                  f"{os.path.relpath(frame.filename, os.path.join(TOOLS, '..'))}:{frame.lineno}")
+            # With --frames, the callers too, innermost first
+            for caller in list(reversed(stat.traceback))[1:]:
+                print(f"        {os.path.relpath(caller.filename, os.path.join(TOOLS, '..'))}:{caller.lineno}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,24 @@
 #
 # midiin_poll.py
 #
-"""Show how to receive MIDI input by polling an input port."""
+"""Show how to receive MIDI input by polling an input port.
+
+With --record FILE every message is also written to a session log that
+tools/replay_midi.py can play back.
+"""
 
 from __future__ import print_function
 
+import argparse
 import logging
+import os
 import sys
 import time
 from rtmidi.midiutil import open_midiinput
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from midi_log import MidiRecorder
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger('midiin_poll')
@@ -46,6 +55,10 @@ def format_timestamp(timer):
 
 def main():
     """Main function to receive MIDI input."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--record', metavar='FILE', help='also write every message to this session log')
+    args = parser.parse_args()
+
     try:
         midiin, actual_port_name = open_midiinput(port_name)
         log.info(f"Successfully opened MIDI input port: {actual_port_name}")
@@ -56,6 +69,7 @@ def main():
         log.error(f"Error opening MIDI input port '{port_name}': {e}")
         sys.exit()
 
+    recorder = MidiRecorder(args.record) if args.record else None
     print("Entering main loop. Press Control-C to exit.")
     try:
         timer = time.time()
@@ -65,6 +79,8 @@ def main():
             if msg:
                 message, deltatime = msg
                 timer += deltatime
+                if recorder:
+                    recorder.write(message, deltatime)
 
                 # Parse the MIDI message
                 msg_type, channel, note, velocity = parse_midi_message(message)
@@ -77,6 +93,9 @@ def main():
     except KeyboardInterrupt:
         print('Exiting...')
     finally:
+        if recorder:
+            recorder.close()
+            print(f"Recorded {recorder.count} messages to {args.record}")
         print("Closing MIDI input port...")
         midiin.close_port()
         del midiin